@@ -4,4 +4,14 @@ set -xeE
 # EE
 sudo cat > /etc/cron.d/every_election_cron <<- EOF
 0 3 * * * ee-manage-py-command sync_elections
+EOF
+
+# Sitemaps, only rewritten when their sections have changed
+sudo cat > /etc/cron.d/wcivf_sitemaps <<- EOF
+*/30 * * * * wcivf /var/www/wcivf/venv/bin/python /var/www/wcivf/code/manage.py build_sitemaps
+EOF
+
+# Snapshot of the current ballots, only rewritten when ballots have changed
+sudo cat > /etc/cron.d/wcivf_ballot_export <<- EOF
+*/5 * * * * wcivf /var/www/wcivf/venv/bin/python /var/www/wcivf/code/manage.py export_current_ballots
 EOF
\ No newline at end of file
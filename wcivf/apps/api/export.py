@@ -0,0 +1,140 @@
+"""
+Exports every current ballot, with its candidates, as newline delimited
+JSON: one ballot per line, in the same format as the candidates APIs.
+
+Ballots are read from the database with a server-side cursor a chunk at a
+time, and the candidates for each chunk built with CandidatesPayloadBuilder,
+so however many ballots there are only one chunk is held in memory.
+
+The import commands, and the export_current_ballots command, write the
+lines to a gzipped snapshot file in BALLOT_EXPORT_DIR for the export view
+to serve. The snapshot is only rewritten when the BallotChange log shows
+ballots have changed since it was last written.
+"""
+
+import gzip
+import itertools
+import json
+import os
+from pathlib import Path
+
+from api.payloads import CandidatesPayloadBuilder
+from api.renderers import ORJSONRenderer
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from elections.models import BallotChange, PostElection
+
+# How many ballots are read from the database at once
+EXPORT_CHUNK_SIZE = 500
+SNAPSHOT_FILENAME = "current_ballots.ndjson.gz"
+MANIFEST_FILENAME = "current_ballots.json"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+# How much of the snapshot is read at once when it's decompressed
+SNAPSHOT_BLOCK_SIZE = 64 * 1024
+
+
+def get_snapshot_path():
+    return Path(settings.BALLOT_EXPORT_DIR) / SNAPSHOT_FILENAME
+
+
+def get_export_queryset():
+    return (
+        PostElection.objects.filter(election__current=True)
+        .select_related(
+            "post",
+            "election",
+            "election__voting_system",
+            "voting_system",
+            "replaced_by",
+        )
+        .prefetch_related("husting_set")
+        .order_by("election__election_date", "election__election_weight", "pk")
+    )
+
+
+def iter_export_lines(url_prefix, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields a line of JSON, as bytes, for each current ballot
+    """
+    builder = CandidatesPayloadBuilder(url_prefix)
+    renderer = ORJSONRenderer()
+    ballots = get_export_queryset().iterator(chunk_size=chunk_size)
+    while chunk := list(itertools.islice(ballots, chunk_size)):
+        for ballot in builder.build(chunk):
+            yield renderer.render(ballot) + b"\n"
+
+
+def iter_snapshot(path):
+    """
+    Yields the snapshot decompressed, a block at a time
+    """
+    with gzip.open(path) as f:
+        while block := f.read(SNAPSHOT_BLOCK_SIZE):
+            yield block
+
+
+async def aiter_chunks(iterator, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the items from a sync iterator, a chunk at a time, in the sync
+    thread. StreamingHttpResponse would otherwise read the whole of a sync
+    iterator into a list before sending any of it under ASGI.
+    """
+    get_chunk = sync_to_async(
+        lambda: b"".join(itertools.islice(iterator, chunk_size)),
+        thread_sensitive=True,
+    )
+    while chunk := await get_chunk():
+        yield chunk
+
+
+def get_export_version():
+    """
+    Returns the position of the latest settled change to any ballot, as a
+    list so that it compares equal once it's been through JSON
+    """
+    return list(BallotChange.objects.latest_position())
+
+
+def read_manifest():
+    try:
+        with open(get_snapshot_path().with_name(MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_snapshot(force=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes the export to a gzipped file in BALLOT_EXPORT_DIR, replacing any
+    existing snapshot only once it's complete. Returns how many ballots
+    were written, or None if no ballots have changed since the last
+    snapshot (unless `force` is set) or BALLOT_EXPORT_DIR isn't set.
+    """
+    if not settings.BALLOT_EXPORT_DIR:
+        return None
+    path = get_snapshot_path()
+    # read before the export, so that changes made while it's being written
+    # are in the next one
+    version = get_export_version()
+    if (
+        not force
+        and path.exists()
+        and read_manifest().get("version") == version
+    ):
+        return None
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    count = 0
+    with gzip.open(tmp_path, "wb") as f:
+        for line in iter_export_lines(settings.CANONICAL_URL, chunk_size):
+            f.write(line)
+            count += 1
+    os.replace(tmp_path, path)
+
+    manifest_path = path.with_name(MANIFEST_FILENAME)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "ballots": count}, f)
+    os.replace(tmp_path, manifest_path)
+    return count
@@ -0,0 +1,24 @@
+from api.export import get_snapshot_path, write_snapshot
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes every current ballot, with its candidates, to a gzipped "
+        "newline delimited JSON file in BALLOT_EXPORT_DIR, if any ballots "
+        "have changed since it was last written"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Write the file whether or not any ballots have changed",
+        )
+
+    def handle(self, **options):
+        count = write_snapshot(force=options["force"])
+        if count is None:
+            self.stdout.write("No ballots have changed")
+            return
+        self.stdout.write(f"Wrote {count} ballots to {get_snapshot_path()}")
@@ -0,0 +1,231 @@
+"""
+Builds the responses for the candidates APIs as plain dicts.
+
+The serializers in api.serializers make a serializer for every candidate,
+party, leaflet and husting, and DRF's field machinery dominated the time
+taken for postcodes with a lot of candidates. Here candidacies and what's
+shown with them are fetched for every ballot at once as .values() rows,
+and the dicts built from them directly. The output is exactly the same as
+the serializers would give, which test_payloads checks.
+"""
+
+from collections import defaultdict
+
+from django.urls import reverse
+from django.utils.text import slugify
+from leaflets.models import Leaflet
+from people.models import PersonPost
+from rest_framework import serializers
+
+# the number of leaflets shown for each person
+LEAFLETS_PER_PERSON = 4
+LEAFLET_URL_FMT = "https://electionleaflets.org/leaflets/{}/"
+# what VotingSystemSerializer gives for ballots without a voting system
+NO_VOTING_SYSTEM = {"slug": "", "name": ""}
+# formats datetimes as HustingSerializer does
+DATETIME_FIELD = serializers.DateTimeField()
+
+
+class CandidatesPayloadBuilder:
+    def __init__(self, url_prefix):
+        # every URL is on this site, so the scheme and host are only worked
+        # out once, rather than with build_absolute_uri for each of them
+        self.url_prefix = url_prefix
+        # and people's URLs only differ by ID and slug, so are only reversed
+        # once
+        self.person_path_prefix = reverse("person_view", args=[0, "x"])[
+            : -len("0/x")
+        ]
+
+    @classmethod
+    def for_request(cls, request):
+        return cls(request.build_absolute_uri("/")[:-1])
+
+    def person_url(self, ynr_id, name):
+        return f"{self.url_prefix}{self.person_path_prefix}{ynr_id}/{slugify(name)}"
+
+    def get_candidacy_rows(self, ballots):
+        """
+        Returns a dict of candidacy rows for each ballot ID, in the order
+        they're listed on the ballot
+        """
+        rows_by_ballot = defaultdict(list)
+        for uses_lists in {ballot.election.uses_lists for ballot in ballots}:
+            rows = (
+                PersonPost.objects.filter(
+                    post_election__in=[
+                        ballot.pk
+                        for ballot in ballots
+                        if ballot.election.uses_lists == uses_lists
+                    ]
+                )
+                .in_ballot_order(uses_lists)
+                .values(
+                    "pk",
+                    "post_election_id",
+                    "list_position",
+                    "party_id",
+                    "party__party_name",
+                    "person_id",
+                    "person__name",
+                    "person__email",
+                    "person__photo_url",
+                )
+            )
+            for row in rows:
+                rows_by_ballot[row["post_election_id"]].append(row)
+        return rows_by_ballot
+
+    def get_leaflets(self, person_ids):
+        """
+        Returns a dict of the leaflets shown for each person
+        """
+        leaflets = defaultdict(list)
+        rows = (
+            Leaflet.objects.filter(person__in=person_ids)
+            .order_by("date_uploaded_to_electionleaflets")
+            .values_list("person_id", "leaflet_id", "thumb_url")
+        )
+        for person_id, leaflet_id, thumb_url in rows:
+            if len(leaflets[person_id]) < LEAFLETS_PER_PERSON:
+                leaflets[person_id].append(
+                    {
+                        "leaflet_id": leaflet_id,
+                        "thumb_url": thumb_url,
+                        "leaflet_url": LEAFLET_URL_FMT.format(leaflet_id),
+                    }
+                )
+        return leaflets
+
+    def get_previous_party_affiliations(self, person_post_ids):
+        """
+        Returns a dict of the parties each candidacy was previously
+        affiliated with
+        """
+        affiliations = defaultdict(list)
+        rows = (
+            PersonPost.previous_party_affiliations.through.objects.filter(
+                personpost__in=person_post_ids
+            )
+            .order_by("party__party_name")
+            .values_list("personpost_id", "party_id", "party__party_name")
+        )
+        for person_post_id, party_id, party_name in rows:
+            affiliations[person_post_id].append(
+                {"party_id": party_id, "party_name": party_name}
+            )
+        return affiliations
+
+    def build_candidate(self, row, display_as_party_list, leaflets, parties):
+        party = None
+        if row["party_id"] is not None:
+            party = {
+                "party_id": row["party_id"],
+                "party_name": row["party__party_name"],
+            }
+        return {
+            "list_position": row["list_position"]
+            if display_as_party_list
+            else None,
+            "party": party,
+            "person": {
+                "ynr_id": row["person_id"],
+                "name": row["person__name"],
+                "absolute_url": self.person_url(
+                    row["person_id"], row["person__name"]
+                ),
+                "email": row["person__email"],
+                "photo_url": row["person__photo_url"],
+                "leaflets": leaflets.get(row["person_id"]) or None,
+            },
+            "previous_party_affiliations": parties.get(row["pk"]) or None,
+        }
+
+    def build_voting_system(self, voting_system):
+        if not voting_system:
+            return dict(NO_VOTING_SYSTEM)
+        return {
+            "slug": voting_system.slug,
+            "name": voting_system.name,
+            "uses_party_lists": voting_system.uses_party_lists,
+        }
+
+    def build_hustings(self, ballot):
+        hustings = [
+            {
+                "title": husting.title,
+                "url": husting.url,
+                "starts": DATETIME_FIELD.to_representation(husting.starts),
+                "ends": DATETIME_FIELD.to_representation(husting.ends)
+                if husting.ends
+                else None,
+                "location": husting.location,
+                "postevent_url": husting.postevent_url,
+            }
+            for husting in ballot.husting_set.all()
+        ]
+        return hustings or None
+
+    def fetch(self, ballots):
+        """
+        Returns the candidacy rows for each ballot, and the leaflets and
+        previous party affiliations shown with them, for `build`. These are
+        all the candidates in the payload depend on.
+        """
+        rows_by_ballot = self.get_candidacy_rows(ballots)
+        all_rows = [row for rows in rows_by_ballot.values() for row in rows]
+        leaflets = {}
+        parties = {}
+        if all_rows:
+            leaflets = self.get_leaflets({row["person_id"] for row in all_rows})
+            parties = self.get_previous_party_affiliations(
+                [row["pk"] for row in all_rows]
+            )
+        return rows_by_ballot, leaflets, parties
+
+    def build(self, ballots, fetched=None):
+        """
+        Returns a list with a dict for each ballot, with its candidates
+        """
+        rows_by_ballot, leaflets, parties = fetched or self.fetch(ballots)
+
+        results = []
+        for ballot in ballots:
+            display_as_party_list = ballot.display_as_party_list
+            election = ballot.election
+            results.append(
+                {
+                    "ballot_paper_id": ballot.ballot_paper_id,
+                    "absolute_url": self.url_prefix + ballot.get_absolute_url(),
+                    "election_date": election.election_date,
+                    "election_name": election.nice_election_name,
+                    "election_id": election.slug,
+                    "post": {
+                        "post_name": ballot.post.label,
+                        "post_slug": ballot.post.ynr_id,
+                    },
+                    "cancelled": ballot.cancelled,
+                    "ballot_locked": ballot.locked,
+                    "replaced_by": ballot.replaced_by.ballot_paper_id
+                    if ballot.replaced_by_id
+                    else None,
+                    "candidates": [
+                        self.build_candidate(
+                            row, display_as_party_list, leaflets, parties
+                        )
+                        for row in rows_by_ballot[ballot.pk]
+                    ],
+                    "voting_system": self.build_voting_system(
+                        ballot.voting_system
+                    ),
+                    "requires_voter_id": ballot.get_voter_id_requirements,
+                    "postal_voting_requirements": ballot.get_postal_voting_requirements,
+                    "seats_contested": ballot.winner_count,
+                    "organisation_type": ballot.post.organization_type,
+                    "hustings": self.build_hustings(ballot),
+                    "last_updated": getattr(
+                        ballot, "last_updated", ballot.modified
+                    ),
+                }
+            )
+        return results
@@ -1,11 +1,20 @@
+import threading
+from unittest import mock
+
 import vcr
+from api.views import CandidatesAndElectionsForBallots
 from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from elections.models import BallotChange, PostElection
 from elections.tests.factories import (
     ElectionFactory,
     PostElectionFactory,
     PostFactory,
 )
+from leaflets.models import Leaflet
 from parties.tests.factories import PartyFactory
+from people.models import PersonPost
 from people.tests.factories import PersonFactory, PersonPostFactory
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
@@ -127,6 +136,62 @@ class TestAPISearchViews(APITestCase):
         assert req.status_code == 200
         assert req.json() == []
 
+    def test_candidates_for_ballots_conditional_get(self):
+        url = "{}?ballot_ids=parl.cities-of-london-and-westminster.2017-06-08".format(
+            reverse("api:candidates-for-ballots-list")
+        )
+        req = self.client.get(url)
+        assert req.status_code == 200
+        # candidacies aren't timestamped, so only the ETag can be used
+        assert not req.has_header("Last-Modified")
+        etag = req["ETag"]
+
+        # the ballots, their hustings, and the candidacies, leaflets and
+        # party affiliations are fetched, but nothing's built
+        with self.assertNumQueries(5):
+            req = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert req.status_code == 304
+        req = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE="Sun, 01 Jan 2023 00:00:00 GMT"
+        )
+        assert req.status_code == 200
+
+        self.election.name = "2017 UK Parliamentary General Election"
+        self.election.save()
+        req = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert req.status_code == 200
+        assert req["ETag"] != etag
+
+    def test_candidates_for_ballots_etag_covers_candidates(self):
+        url = "{}?ballot_ids=parl.cities-of-london-and-westminster.2017-06-08".format(
+            reverse("api:candidates-for-ballots-list")
+        )
+        etag = self.client.get(url)["ETag"]
+
+        candidacy = PersonPost.objects.create(
+            post_election=self.post_election,
+            election=self.election,
+            person=PersonFactory(name="New Candidate"),
+            post=self.post,
+        )
+        # as when candidacies are imported, the ballot isn't touched
+        PostElection.objects.filter(pk=self.post_election.pk).update(
+            modified="2023-01-01T00:00:00Z"
+        )
+        req = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert req.status_code == 200
+        assert req["ETag"] != etag
+        etag = req["ETag"]
+
+        Leaflet.objects.create(person=candidacy.person, leaflet_id=1)
+        req = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert req.status_code == 200
+        assert req["ETag"] != etag
+        assert [
+            candidate["person"]["leaflets"] is not None
+            for candidate in req.json()[0]["candidates"]
+        ] == [False, True]
+
     @vcr.use_cassette("fixtures/vcr_cassettes/test_postcode_view.yaml")
     def test_lock_status(self):
         self.post_election.locked = True
@@ -135,3 +200,122 @@ class TestAPISearchViews(APITestCase):
         req = self.client.get("{}?postcode=EC1A4EU".format(url))
         assert req.status_code == 200
         assert req.json()[0]["ballot_locked"] is True
+
+
+class TestBallotChangesAPI(APITestCase):
+    def setUp(self):
+        self.url = reverse("api:candidates-for-ballots-changes")
+        self.ballot = PostElectionFactory(
+            ballot_paper_id="local.foo.2024-05-02"
+        )
+        self.other_ballot = PostElectionFactory(
+            ballot_paper_id="local.bar.2024-05-02",
+            post=PostFactory(ynr_id="bar"),
+        )
+        BallotChange.objects.all().delete()
+
+    def test_changes_recorded_on_save(self):
+        PersonPostFactory(
+            post_election=self.ballot,
+            post=self.ballot.post,
+            election=self.ballot.election,
+        )
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == ["local.foo.2024-05-02"]
+
+    def test_changes_pages(self):
+        self.ballot.save()
+        self.other_ballot.save()
+        self.ballot.save()
+        BallotChange.objects.record(["local.deleted.2024-05-02"])
+        with mock.patch.object(
+            CandidatesAndElectionsForBallots, "changes_page_size", 2
+        ):
+            req = self.client.get(self.url)
+            data = req.json()
+            assert [
+                ballot["ballot_paper_id"] for ballot in data["results"]
+            ] == [
+                "local.foo.2024-05-02",
+                "local.bar.2024-05-02",
+            ]
+            assert data["deleted"] == []
+            assert data["more"] is True
+
+            # the ballot changed again in the next page
+            req = self.client.get(self.url, {"cursor": data["cursor"]})
+            data = req.json()
+            assert [
+                ballot["ballot_paper_id"] for ballot in data["results"]
+            ] == ["local.foo.2024-05-02"]
+            assert data["deleted"] == ["local.deleted.2024-05-02"]
+            assert data["more"] is False
+
+            # nothing's changed since
+            cursor = data["cursor"]
+            data = self.client.get(self.url, {"cursor": cursor}).json()
+            assert data == {
+                "cursor": cursor,
+                "more": False,
+                "deleted": [],
+                "results": [],
+            }
+
+            self.ballot.save()
+            self.ballot.save()
+            data = self.client.get(self.url, {"cursor": cursor}).json()
+            assert [
+                ballot["ballot_paper_id"] for ballot in data["results"]
+            ] == ["local.foo.2024-05-02"]
+
+    def test_invalid_cursor(self):
+        req = self.client.get(self.url, {"cursor": "foo"})
+        assert req.status_code == 400
+        assert req.json() == {"detail": "Invalid cursor"}
+
+
+class TestBallotChangesConcurrentTransactions(TransactionTestCase):
+    def test_change_committed_late_not_missed(self):
+        """
+        A change made by a transaction that commits after a later one
+        isn't shown until it has, so clients that have read past the
+        later change still get it
+        """
+        url = reverse("api:candidates-for-ballots-changes")
+        ballot = PostElectionFactory(ballot_paper_id="local.foo.2024-05-02")
+        other_ballot = PostElectionFactory(
+            ballot_paper_id="local.bar.2024-05-02",
+            post=PostFactory(ynr_id="bar"),
+        )
+        BallotChange.objects.all().delete()
+        recorded = threading.Event()
+        commit = threading.Event()
+
+        def slow_import():
+            try:
+                with transaction.atomic():
+                    BallotChange.objects.record([ballot.ballot_paper_id])
+                    recorded.set()
+                    commit.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=slow_import)
+        thread.start()
+        try:
+            assert recorded.wait(10)
+            # committed while the import's transaction is still running,
+            # with a later pk than the import's change
+            BallotChange.objects.record([other_ballot.ballot_paper_id])
+
+            data = self.client.get(url).json()
+            assert data["results"] == []
+        finally:
+            commit.set()
+            thread.join()
+        data = self.client.get(url, {"cursor": data["cursor"]}).json()
+        assert [ballot["ballot_paper_id"] for ballot in data["results"]] == [
+            "local.foo.2024-05-02",
+            "local.bar.2024-05-02",
+        ]
@@ -0,0 +1,157 @@
+import gzip
+import json
+
+import pytest
+from api.export import iter_export_lines, write_snapshot
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.http import FileResponse
+from django.test import AsyncClient
+from django.urls import reverse
+from elections.tests.factories import (
+    ElectionFactoryLazySlug,
+    PostElectionFactory,
+    PostFactory,
+)
+from people.tests.factories import PersonPostFactory
+
+
+@pytest.fixture
+def export_dir(settings, tmp_path):
+    settings.BALLOT_EXPORT_DIR = tmp_path
+    return tmp_path
+
+
+@pytest.fixture
+def ballots():
+    current = ElectionFactoryLazySlug(election_date="2024-05-02", current=True)
+    ballots = [
+        PostElectionFactory(
+            ballot_paper_id=f"local.foo.{ynr_id}.2024-05-02",
+            post=PostFactory(ynr_id=ynr_id),
+            election=current,
+        )
+        for ynr_id in ("bar", "baz", "qux")
+    ]
+    for ballot in ballots:
+        PersonPostFactory(
+            post_election=ballot, post=ballot.post, election=current
+        )
+    # not current, so not exported
+    PostElectionFactory(
+        ballot_paper_id="local.foo.old.2019-05-02",
+        post=PostFactory(ynr_id="old"),
+        election=ElectionFactoryLazySlug(
+            election_date="2019-05-02", current=False
+        ),
+    )
+    return ballots
+
+
+def parse_lines(content):
+    return [json.loads(line) for line in content.decode().splitlines()]
+
+
+@pytest.mark.django_db
+def test_iter_export_lines(ballots):
+    lines = list(iter_export_lines("https://example.com", chunk_size=2))
+
+    assert all(line.endswith(b"\n") for line in lines)
+    results = parse_lines(b"".join(lines))
+    assert [ballot["ballot_paper_id"] for ballot in results] == [
+        ballot.ballot_paper_id for ballot in ballots
+    ]
+    assert len(results[0]["candidates"]) == 1
+    assert results[0]["absolute_url"].startswith("https://example.com/")
+    # chunks don't change the output
+    assert lines == list(iter_export_lines("https://example.com"))
+
+
+async def get_export(headers=None):
+    response = await AsyncClient().get(
+        reverse("api:current-ballots-export"), headers=headers
+    )
+    if response.is_async:
+        content = b"".join(
+            [chunk async for chunk in response.streaming_content]
+        )
+    else:
+        content = b"".join(response.streaming_content)
+    return response, content
+
+
+@pytest.mark.django_db
+def test_export_view_streams_without_snapshot(export_dir, ballots):
+    response, content = async_to_sync(get_export)()
+
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/x-ndjson"
+    assert not response.has_header("Content-Encoding")
+    # sent as it's read from the database, rather than all at once
+    assert response.is_async
+    assert len(parse_lines(content)) == 3
+
+
+@pytest.mark.django_db
+def test_export_view_streams_gzip(export_dir, ballots):
+    response, content = async_to_sync(get_export)(
+        headers={"Accept-Encoding": "gzip, deflate"}
+    )
+
+    assert response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response["Vary"]
+    assert response.is_async
+    assert len(parse_lines(gzip.decompress(content))) == 3
+
+
+@pytest.mark.django_db
+def test_export_view_serves_snapshot(export_dir, ballots):
+    write_snapshot()
+    # not in the snapshot until it's written again
+    ballots[0].delete()
+
+    response, content = async_to_sync(get_export)(
+        headers={"Accept-Encoding": "gzip, deflate"}
+    )
+    assert isinstance(response, FileResponse)
+    assert response["Content-Encoding"] == "gzip"
+    assert len(parse_lines(gzip.decompress(content))) == 3
+
+    response, content = async_to_sync(get_export)()
+    assert response.is_async
+    assert not response.has_header("Content-Encoding")
+    assert len(parse_lines(content)) == 3
+
+
+@pytest.mark.django_db
+def test_write_snapshot(export_dir, ballots):
+    assert write_snapshot() == 3
+
+    with gzip.open(export_dir / "current_ballots.ndjson.gz") as f:
+        results = parse_lines(f.read())
+    assert results[0]["absolute_url"].startswith(
+        "https://whocanivotefor.co.uk/"
+    )
+    assert not list(export_dir.glob(".*"))
+
+
+@pytest.mark.django_db
+def test_write_snapshot_only_when_changed(export_dir, ballots):
+    assert write_snapshot() == 3
+    assert write_snapshot() is None
+
+    ballots[0].save()
+    assert write_snapshot() == 3
+    assert write_snapshot(force=True) == 3
+
+
+@pytest.mark.django_db
+def test_write_snapshot_without_dir(settings, ballots):
+    settings.BALLOT_EXPORT_DIR = None
+    assert write_snapshot() is None
+
+
+@pytest.mark.django_db
+def test_export_current_ballots_command(export_dir, ballots):
+    call_command("export_current_ballots")
+    assert (export_dir / "current_ballots.ndjson.gz").exists()
@@ -0,0 +1,208 @@
+import datetime
+
+import pytest
+from api import serializers
+from api.payloads import CandidatesPayloadBuilder
+from api.renderers import ORJSONRenderer
+from api.views import CandidatesAndElectionsForBallots
+from elections.models import PostElection, VotingSystem
+from elections.tests.factories import (
+    ElectionFactoryLazySlug,
+    PostElectionFactory,
+    PostFactory,
+)
+from elections.views.mixins import PostelectionsToPeopleMixin
+from hustings.api.serializers import HustingSerializer
+from hustings.models import Husting
+from leaflets.models import Leaflet
+from parties.tests.factories import PartyFactory
+from people.tests.factories import PersonFactory, PersonPostFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+def serializer_payload(request, postelections):
+    """
+    Builds the payload with serializers, as the candidates APIs did before
+    api.payloads
+    """
+    results = []
+    for postelection in postelections:
+        personposts = PostelectionsToPeopleMixin().people_for_ballot(
+            postelection, compact=True
+        )
+        candidates = [
+            serializers.PersonPostSerializer(
+                personpost,
+                context={"request": request, "postelection": postelection},
+            ).data
+            for personpost in personposts
+        ]
+        hustings = None
+        if postelection.husting_set.all():
+            hustings = HustingSerializer(
+                postelection.husting_set.all(), many=True, read_only=True
+            ).data
+        election = {
+            "ballot_paper_id": postelection.ballot_paper_id,
+            "absolute_url": request.build_absolute_uri(
+                postelection.get_absolute_url()
+            ),
+            "election_date": postelection.election.election_date,
+            "election_name": postelection.election.nice_election_name,
+            "election_id": postelection.election.slug,
+            "post": {
+                "post_name": postelection.post.label,
+                "post_slug": postelection.post.ynr_id,
+            },
+            "cancelled": postelection.cancelled,
+            "ballot_locked": postelection.locked,
+            "replaced_by": postelection.replaced_by,
+            "candidates": candidates,
+            "voting_system": serializers.VotingSystemSerializer(
+                postelection.voting_system
+            ).data,
+            "requires_voter_id": postelection.get_voter_id_requirements,
+            "postal_voting_requirements": postelection.get_postal_voting_requirements,
+            "seats_contested": postelection.winner_count,
+            "organisation_type": postelection.post.organization_type,
+            "hustings": hustings,
+            "last_updated": getattr(
+                postelection, "last_updated", postelection.modified
+            ),
+        }
+        if postelection.replaced_by:
+            election["replaced_by"] = postelection.replaced_by.ballot_paper_id
+        else:
+            election["replaced_by"] = None
+        results.append(election)
+    return results
+
+
+@pytest.fixture
+def ballots():
+    """
+    A ballot that uses party lists and one that doesn't, with as much as
+    possible shown with them
+    """
+    fptp_ballot = PostElectionFactory(
+        ballot_paper_id="local.foo.bar.2024-05-02",
+        post=PostFactory(ynr_id="bar", label="Bar Ward"),
+        election=ElectionFactoryLazySlug(
+            name="Foo local election", election_date="2024-05-02"
+        ),
+        locked=True,
+    )
+    list_ballot = PostElectionFactory(
+        ballot_paper_id="sp.r.glasgow.2021-05-06",
+        post=PostFactory(ynr_id="glasgow", label="Glasgow"),
+        election=ElectionFactoryLazySlug(
+            name="Scottish Parliament elections",
+            election_date="2021-05-06",
+            uses_lists=True,
+        ),
+        voting_system=VotingSystem.objects.create(
+            slug="AMS", name="Additional Member System"
+        ),
+        replaced_by=fptp_ballot,
+    )
+    party = PartyFactory(party_id="PP01", party_name="Test Party")
+    other_party = PartyFactory(party_id="PP02", party_name="Another Party")
+
+    for name, sort_name in [
+        ("Zoë O'Brien", None),
+        ('Jo "JJ" Smith ', "Adams"),
+        ("Ann\u2028Other", None),
+    ]:
+        candidacy = PersonPostFactory(
+            person=PersonFactory(
+                name=name,
+                sort_name=sort_name,
+                email="jo@example.com",
+                photo_url="https://example.com/photo.png",
+            ),
+            post_election=fptp_ballot,
+            post=fptp_ballot.post,
+            election=fptp_ballot.election,
+            party=party if sort_name else None,
+            list_position=1,
+        )
+    candidacy.previous_party_affiliations.add(party, other_party)
+    for leaflet_id in range(6):
+        Leaflet.objects.create(
+            person=candidacy.person,
+            leaflet_id=leaflet_id,
+            thumb_url=f"https://example.com/{leaflet_id}.png",
+            date_uploaded_to_electionleaflets=datetime.datetime(
+                2024, 4, 6 - leaflet_id, tzinfo=datetime.timezone.utc
+            ),
+        )
+    Husting.objects.create(
+        post_election=fptp_ballot,
+        title="Hustings",
+        url="https://example.com/hustings",
+        starts=datetime.datetime(
+            2024, 4, 20, 19, 0, 0, 123456, tzinfo=datetime.timezone.utc
+        ),
+        ends=datetime.datetime(2024, 4, 20, 21, tzinfo=datetime.timezone.utc),
+        location="Town Hall",
+    )
+
+    for position, (party_for_position, votes, elected) in enumerate(
+        [(other_party, 100, True), (party, 50, False), (party, None, None)],
+        start=1,
+    ):
+        PersonPostFactory(
+            post_election=list_ballot,
+            post=list_ballot.post,
+            election=list_ballot.election,
+            party=party_for_position,
+            list_position=position,
+            votes_cast=votes,
+            elected=elected,
+        )
+
+    PostElection.objects.filter(pk=list_ballot.pk).update(
+        modified=datetime.datetime(
+            2021, 5, 7, 12, 0, 0, 5000, tzinfo=datetime.timezone.utc
+        )
+    )
+    return list(
+        CandidatesAndElectionsForBallots()
+        .get_ballots_queryset()
+        .select_related("voting_system")
+        .order_by("pk")
+    )
+
+
+@pytest.mark.django_db
+def test_payload_matches_serializers(ballots):
+    request = Request(APIRequestFactory().get("/api/candidates_for_ballots/"))
+
+    expected = JSONRenderer().render(serializer_payload(request, ballots))
+    payload = ORJSONRenderer().render(
+        CandidatesPayloadBuilder.for_request(request).build(ballots)
+    )
+
+    assert payload == expected
+    # check there's something to compare
+    assert b'"leaflet_id":5' in payload
+    assert b'"uses_party_lists":true' in payload
+    assert b"\\u2028" in payload
+
+
+@pytest.mark.django_db
+def test_payload_queries(ballots, django_assert_num_queries):
+    request = Request(APIRequestFactory().get("/api/candidates_for_ballots/"))
+    # candidacies for each kind of ballot, leaflets, affiliations and the
+    # ballot the list ballot was replaced by
+    with django_assert_num_queries(5):
+        CandidatesPayloadBuilder.for_request(request).build(ballots)
+
+
+def test_renderer_indent():
+    data = {"name": "Zoë", "date": datetime.date(2024, 5, 2)}
+    assert ORJSONRenderer().render(
+        data, "application/json; indent=2"
+    ) == JSONRenderer().render(data, "application/json; indent=2")
@@ -23,4 +23,9 @@ urlpatterns = [
         views.LastUpdatedView.as_view(),
         name="last-updated-timestamps",
     ),
+    path(
+        "current_ballots.ndjson",
+        views.CurrentBallotsExportView.as_view(),
+        name="current-ballots-export",
+    ),
 ]
@@ -1,18 +1,37 @@
 import abc
+import base64
 
 from api import serializers
-from api.serializers import VotingSystemSerializer
+from api.export import (
+    NDJSON_CONTENT_TYPE,
+    aiter_chunks,
+    get_snapshot_path,
+    iter_export_lines,
+    iter_snapshot,
+)
+from api.payloads import CandidatesPayloadBuilder
+from api.renderers import ORJSONRenderer
 from core.helpers import clean_postcode
+from django import http
 from django.conf import settings
+from django.utils.cache import patch_vary_headers
 from django.utils.http import urlencode
-from elections.models import InvalidPostcodeError, PostElection
+from django.utils.text import compress_sequence
+from django.views import View
+from elections.models import (
+    BallotChange,
+    InvalidPostcodeError,
+    PostElection,
+)
 from elections.views import mixins
-from hustings.api.serializers import HustingSerializer
 from people.models import Person
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.exceptions import APIException
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_jsonp.renderers import JSONPRenderer
 
 
 class PostcodeNotProvided(APIException):
@@ -33,6 +52,12 @@ class BallotIdsNotProvided(APIException):
     default_code = "ballot_ids_required"
 
 
+class InvalidCursor(APIException):
+    status_code = 400
+    default_detail = "Invalid cursor"
+    default_code = "cursor_invalid"
+
+
 class PersonViewSet(viewsets.ModelViewSet):
     http_method_names = ["get", "head"]
     queryset = Person.objects.all()
@@ -40,80 +65,56 @@ class PersonViewSet(viewsets.ModelViewSet):
 
 
 class BaseCandidatesAndElectionsViewSet(
-    viewsets.ViewSet, mixins.PostelectionsToPeopleMixin, metaclass=abc.ABCMeta
+    viewsets.ViewSet,
+    mixins.BallotsConditionalGetMixin,
+    metaclass=abc.ABCMeta,
 ):
+    """
+    Responses have an ETag, and conditional requests are answered with a
+    304 Not Modified if none of the ballots or their candidates have
+    changed. Candidacies don't have a modified timestamp, so there's no
+    Last-Modified.
+
+    Responses are built by api.payloads rather than serializers, and
+    rendered with orjson, as these are the busiest endpoints.
+    """
+
     http_method_names = ["get", "head"]
+    renderer_classes = [
+        ORJSONRenderer,
+        BrowsableAPIRenderer,
+        JSONPRenderer,
+    ]
 
     @abc.abstractmethod
     def get_ballots(self, request):
         pass
 
-    def add_hustings(self, postelection: PostElection):
-        hustings = None
-        hustings_qs = postelection.husting_set.all()
-        if hustings_qs:
-            hustings = HustingSerializer(
-                hustings_qs, many=True, read_only=True
-            ).data
-        return hustings
-
     def list(self, request, *args, **kwargs):
-        results = []
-
         ballots = self.get_ballots(request)
-        postelections = ballots["ballots"].select_related("voting_system")
-
-        for postelection in postelections:
-            candidates = []
-            personposts = self.people_for_ballot(postelection, compact=True)
-            for personpost in personposts:
-                candidates.append(
-                    serializers.PersonPostSerializer(
-                        personpost,
-                        context={
-                            "request": request,
-                            "postelection": postelection,
-                        },
-                    ).data
-                )
-
-            election = {
-                "ballot_paper_id": postelection.ballot_paper_id,
-                "absolute_url": self.request.build_absolute_uri(
-                    postelection.get_absolute_url()
-                ),
-                "election_date": postelection.election.election_date,
-                "election_name": postelection.election.nice_election_name,
-                "election_id": postelection.election.slug,
-                "post": {
-                    "post_name": postelection.post.label,
-                    "post_slug": postelection.post.ynr_id,
-                },
-                "cancelled": postelection.cancelled,
-                "ballot_locked": postelection.locked,
-                "replaced_by": postelection.replaced_by,
-                "candidates": candidates,
-                "voting_system": VotingSystemSerializer(
-                    postelection.voting_system
-                ).data,
-                "requires_voter_id": postelection.get_voter_id_requirements,
-                "postal_voting_requirements": postelection.get_postal_voting_requirements,
-                "seats_contested": postelection.winner_count,
-                "organisation_type": postelection.post.organization_type,
-                "hustings": self.add_hustings(postelection),
-                "last_updated": getattr(
-                    postelection, "last_updated", postelection.modified
-                ),
-            }
-            if postelection.replaced_by:
-                election["replaced_by"] = (
-                    postelection.replaced_by.ballot_paper_id
-                )
-            else:
-                election["replaced_by"] = None
+        postelections = list(ballots["ballots"].select_related("voting_system"))
+        builder = CandidatesPayloadBuilder.for_request(request)
+        # the candidates are fetched either way, but are only built and
+        # rendered if they've changed
+        fetched = builder.fetch(postelections)
+        etag, _ = self.get_ballots_version(
+            postelections,
+            request.accepted_media_type,
+            [postelection.voting_system_id for postelection in postelections],
+            fetched,
+        )
+        response = self.get_not_modified_response(request, etag, None)
+        if response:
+            return response
 
-            results.append(election)
-        return Response(results)
+        return self.set_version_headers(
+            Response(builder.build(postelections, fetched)), etag, None
+        )
+
+    def get_results(self, request, postelections):
+        return CandidatesPayloadBuilder.for_request(request).build(
+            postelections
+        )
 
 
 class CandidatesAndElectionsForPostcodeViewSet(
@@ -131,6 +132,20 @@ class CandidatesAndElectionsForPostcodeViewSet(
 
 
 class CandidatesAndElectionsForBallots(BaseCandidatesAndElectionsViewSet):
+    # how many changes are read from the log for each page of changes
+    changes_page_size = 100
+
+    def get_ballots_queryset(self):
+        return (
+            PostElection.objects.all()
+            .select_related(
+                "post",
+                "election",
+                "election__voting_system",
+            )
+            .prefetch_related("husting_set")
+        )
+
     def get_ballots(self, request):
         ballot_ids_str = request.GET.get("ballot_ids", None)
         modified_gt = request.GET.get("modified_gt", None)
@@ -138,12 +153,7 @@ class CandidatesAndElectionsForBallots(BaseCandidatesAndElectionsViewSet):
         if not any((ballot_ids_str, modified_gt)):
             raise BallotIdsNotProvided
 
-        pes = PostElection.objects.all().select_related(
-            "post",
-            "election",
-            "election__voting_system",
-        )
-        pes = pes.prefetch_related("husting_set")
+        pes = self.get_ballots_queryset()
         if ballot_ids_str:
             if "," in ballot_ids_str:
                 ballot_ids_lst = ballot_ids_str.split(",")
@@ -162,6 +172,75 @@ class CandidatesAndElectionsForBallots(BaseCandidatesAndElectionsViewSet):
             pes = pes.order_by(*ordering)
         return {"ballots": pes[:100]}
 
+    def encode_cursor(self, position):
+        transaction_id, pk = position
+        return base64.urlsafe_b64encode(
+            f"c={transaction_id}.{pk}".encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return (0, 0)
+        try:
+            key, position = base64.urlsafe_b64decode(cursor).decode().split("=")
+            if key != "c":
+                raise ValueError(cursor)
+            transaction_id, pk = position.split(".")
+            return (int(transaction_id), int(pk))
+        except ValueError:
+            raise InvalidCursor()
+
+    @action(detail=False)
+    def changes(self, request):
+        """
+        Pages through changes to ballots, oldest first, using the
+        BallotChange log.
+
+        Returns the ballots changed after the `cursor` GET parameter (or
+        since the log started) as they are now, the IDs of any that have
+        since been deleted, and a cursor to get the next page with. Every
+        change is in exactly one page, and a ballot is only included once
+        in a page however many times it changed. If `more` is false the
+        client has caught up, and can use the cursor to poll for changes
+        later.
+        """
+        position = self.decode_cursor(request.GET.get("cursor"))
+        changes = list(
+            BallotChange.objects.after(position).values_list(
+                "transaction_id", "pk", "ballot_paper_id"
+            )[: self.changes_page_size + 1]
+        )
+        more = len(changes) > self.changes_page_size
+        changes = changes[: self.changes_page_size]
+        if changes:
+            position = changes[-1][:2]
+
+        ballot_paper_ids = list(
+            dict.fromkeys(ballot_paper_id for _, _, ballot_paper_id in changes)
+        )
+        ballots = (
+            self.get_ballots_queryset()
+            .select_related("voting_system")
+            .in_bulk(ballot_paper_ids, field_name="ballot_paper_id")
+        )
+        postelections = [
+            ballots[ballot_paper_id]
+            for ballot_paper_id in ballot_paper_ids
+            if ballot_paper_id in ballots
+        ]
+        return Response(
+            {
+                "cursor": self.encode_cursor(position),
+                "more": more,
+                "deleted": [
+                    ballot_paper_id
+                    for ballot_paper_id in ballot_paper_ids
+                    if ballot_paper_id not in ballots
+                ],
+                "results": self.get_results(request, postelections),
+            }
+        )
+
 
 class LastUpdatedView(APIView):
     def get(self, request):
@@ -196,3 +275,41 @@ class LastUpdatedView(APIView):
             pass
 
         return Response(data=data)
+
+
+class CurrentBallotsExportView(View):
+    """
+    Serves the snapshot of every current ballot, with its candidates, as
+    newline delimited JSON, gzipped if the client accepts that. Until a
+    snapshot has been written the ballots are streamed from the database
+    instead. See api.export.
+    """
+
+    def get(self, request, *args, **kwargs):
+        gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+        path = settings.BALLOT_EXPORT_DIR and get_snapshot_path()
+        if path and path.exists():
+            response = self.snapshot_response(path, gzipped)
+        else:
+            lines = iter_export_lines(request.build_absolute_uri("/")[:-1])
+            if gzipped:
+                lines = compress_sequence(lines)
+            response = http.StreamingHttpResponse(
+                aiter_chunks(lines), content_type=NDJSON_CONTENT_TYPE
+            )
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def snapshot_response(self, path, gzipped):
+        # FileResponse closes the file once it's been sent
+        if gzipped:
+            return http.FileResponse(
+                open(path, "rb"),  # noqa: SIM115
+                content_type=NDJSON_CONTENT_TYPE,
+            )
+        return http.StreamingHttpResponse(
+            aiter_chunks(iter_snapshot(path), chunk_size=1),
+            content_type=NDJSON_CONTENT_TYPE,
+        )
@@ -0,0 +1,413 @@
+"""
+Tools for measuring how the busiest pages perform under load, used by the
+benchmark_views management command.
+
+A synthetic dataset is created, postcode lookups are answered by a local
+stand-in for the Devs DC API and every cache is replaced by a private
+in-memory one, so results only depend on our own code and database.
+
+Pages are requested with Django's test Client, which goes through the WSGI
+handler rather than ASGI as the site is served.
+"""
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlencode
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from elections.models import Election, Post, PostElection
+from parties.models import Party
+from people.models import Person, PersonPost
+
+VIEWS = ("postcode", "post", "person", "api")
+# letters that can be used in the inward code of a postcode
+INCODE_LETTERS = "ABDEFGHJLNPQRSTUWXYZ"
+FIRST_NAMES = [
+    "Alex",
+    "Amira",
+    "Ben",
+    "Chloe",
+    "Dev",
+    "Fatima",
+    "George",
+    "Hannah",
+    "Ifan",
+    "Jess",
+    "Kwame",
+    "Leah",
+    "Mohammed",
+    "Niamh",
+    "Oliver",
+    "Priya",
+    "Rhys",
+    "Sophie",
+    "Tom",
+    "Zara",
+]
+LAST_NAMES = [
+    "Ahmed",
+    "Brown",
+    "Campbell",
+    "Davies",
+    "Evans",
+    "Green",
+    "Hughes",
+    "Jones",
+    "Khan",
+    "MacDonald",
+    "Murphy",
+    "O'Brien",
+    "Patel",
+    "Roberts",
+    "Smith",
+    "Taylor",
+    "Thomas",
+    "Walker",
+    "Williams",
+    "Wilson",
+]
+
+
+def make_postcode(index):
+    """
+    Returns a unique, valid looking postcode for each index
+    """
+    outward, index = divmod(index, 4000)
+    digit, index = divmod(index, 400)
+    letters = INCODE_LETTERS[index // 20] + INCODE_LETTERS[index % 20]
+    return f"BM{outward + 1} {digit}{letters}"
+
+
+def seed_dataset(
+    num_ballots=2000,
+    candidates_per_ballot=8,
+    ballots_per_election=200,
+    num_parties=40,
+    seed=0,
+):
+    """
+    Creates a synthetic set of current elections, each with their ballots,
+    and candidates standing for a random selection of parties.
+
+    Every postcode returned covers two ballots in different elections, as
+    most postcodes on a polling day with more than one election do. Returns
+    a dict of the ballot_paper_ids for each postcode.
+    """
+    rng = random.Random(seed)
+    election_date = date.today() + timedelta(days=30)
+
+    parties = Party.objects.bulk_create(
+        [
+            Party(party_id=f"PP{i}", party_name=f"Benchmark Party {i}")
+            for i in range(num_parties)
+        ]
+        + [Party(party_id="ynmp-party:2", party_name="Independent")],
+        ignore_conflicts=True,
+    )
+
+    num_elections = -(-num_ballots // ballots_per_election)
+    elections = Election.objects.bulk_create(
+        Election(
+            slug=f"local.benchmark-{i}.{election_date.isoformat()}",
+            name=f"Benchmark Council {i} local election",
+            election_date=election_date,
+            election_type="local",
+            current=True,
+        )
+        for i in range(num_elections)
+    )
+    posts = Post.objects.bulk_create(
+        Post(
+            ynr_id=f"benchmark:{i}",
+            label=f"Ward {i}",
+            organization=f"Benchmark Council {i // ballots_per_election}",
+            territory="ENG",
+        )
+        for i in range(num_ballots)
+    )
+    ballots = PostElection.objects.bulk_create(
+        PostElection(
+            ballot_paper_id=f"local.benchmark-{i // ballots_per_election}"
+            f".ward-{i}.{election_date.isoformat()}",
+            post=post,
+            election=elections[i // ballots_per_election],
+            winner_count=rng.randint(1, 3),
+            locked=True,
+        )
+        for i, post in enumerate(posts)
+    )
+
+    people = Person.objects.bulk_create(
+        Person(
+            ynr_id=i + 1,
+            name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        )
+        for i in range(num_ballots * candidates_per_ballot)
+    )
+    people = iter(people)
+    PersonPost.objects.bulk_create(
+        [
+            PersonPost(
+                person=next(people),
+                post_election=ballot,
+                post_id=ballot.post_id,
+                election_id=ballot.election_id,
+                party=party,
+                party_name=party.party_name,
+            )
+            for ballot in ballots
+            for party in rng.choices(parties, k=candidates_per_ballot)
+        ],
+        batch_size=5000,
+    )
+    PostElection.objects.all().build_cards()
+
+    half = len(ballots) // 2
+    return {
+        make_postcode(i): [
+            ballots[i].ballot_paper_id,
+            ballots[(i + half) % len(ballots)].ballot_paper_id,
+        ]
+        for i in range(half)
+    }
+
+
+class DevsDCStub:
+    """
+    A local HTTP server that answers postcode lookups in the same format as
+    the Devs DC API, from a dict of the ballot_paper_ids for each postcode.
+    Used as a context manager, which starts and stops the server.
+    """
+
+    def __init__(self, ballots_by_postcode):
+        self.ballots_by_postcode = ballots_by_postcode
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def response_for(self, postcode):
+        ballot_ids = self.ballots_by_postcode.get(postcode)
+        if ballot_ids is None:
+            return 400, {"message": "Could not geocode from any source"}
+        council = {
+            "council_id": "BMK",
+            "name": "Benchmark Council",
+            "email": "elections@example.com",
+            "phone": "01234 567890",
+            "website": "https://example.com/",
+            "postcode": "BM1 1AA",
+            "address": "Electoral Services\nTown Hall",
+            "identifiers": ["E09999999"],
+            "nation": "England",
+        }
+        return 200, {
+            "address_picker": False,
+            "addresses": [],
+            "dates": [
+                {
+                    "date": ballot_ids[0].rsplit(".", 1)[-1],
+                    "polling_station": {"polling_station_known": False},
+                    "ballots": [
+                        {"ballot_paper_id": ballot_id}
+                        for ballot_id in ballot_ids
+                    ],
+                }
+            ],
+            "electoral_services": council,
+            "registration": council,
+        }
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive between requests, as the real API does
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = unquote(self.path.split("?")[0])
+                postcode = path.rstrip("/").rsplit("/", 1)[-1]
+                status, data = stub.response_for(postcode)
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QueryCounter:
+    """
+    Counts the queries made on every database connection, including those
+    opened by other threads, while it is installed
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def add_to_connection(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        self.add_to_connection(connection)
+        connection_created.connect(self.add_to_connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.add_to_connection)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+
+def get_paths(ballots_by_postcode):
+    """
+    Returns the paths to request for each view
+    """
+    postcodes = list(ballots_by_postcode)
+    ballots = PostElection.objects.select_related("post")
+    return {
+        "postcode": [f"/elections/{postcode}/" for postcode in postcodes],
+        "post": [ballot.get_absolute_url() for ballot in ballots],
+        "person": [
+            person.get_absolute_url()
+            for person in Person.objects.all()[: len(postcodes)]
+        ],
+        "api": [
+            "/api/candidates_for_postcode/?"
+            + urlencode({"postcode": postcode, "format": "json"})
+            for postcode in postcodes
+        ],
+    }
+
+
+def percentile(values, percent):
+    """
+    Returns the value at a percentile of a sorted list, using the nearest
+    rank method
+    """
+    if not values:
+        return None
+    rank = max(-(-len(values) * percent // 100), 1)
+    return values[int(rank) - 1]
+
+
+def private_caches():
+    """
+    Returns a CACHES setting with a private in-memory cache in place of each
+    configured one, so that benchmarks neither read from nor fill caches
+    shared with anything else
+    """
+    return {
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"benchmark-{alias}",
+        }
+        for alias in settings.CACHES
+    }
+
+
+def measure(paths, num_requests, concurrency, counter, seed=0):
+    """
+    Requests `num_requests` paths chosen at random from `paths`, with
+    `concurrency` requests in flight at once, and returns a summary of how
+    long they took
+    """
+    rng = random.Random(seed)
+    to_request = [rng.choice(paths) for _ in range(num_requests)]
+    local = threading.local()
+
+    def request(path):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        start = time.perf_counter()
+        response = local.client.get(path)
+        return time.perf_counter() - start, response.status_code
+
+    counter.count = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, to_request))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "requests": num_requests,
+        "errors": sum(1 for _, status in results if status != 200),
+        "requests_per_second": round(num_requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "queries_per_request": round(counter.count / num_requests, 1),
+    }
+
+
+def run_benchmark(paths_by_view, num_requests, concurrency, warmup=10):
+    """
+    Benchmarks each view in turn, returning the summary from `measure` for
+    each. The first `warmup` requests to each view aren't counted, so that
+    the results aren't skewed by things like connections being opened.
+    """
+    results = {}
+    with QueryCounter() as counter:
+        for view, paths in paths_by_view.items():
+            if warmup:
+                measure(paths, warmup, concurrency, counter, seed=1)
+            results[view] = measure(paths, num_requests, concurrency, counter)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    Returns a description of each way the results are worse than the
+    baseline by more than `tolerance`, as a fraction of the baseline value
+    """
+    regressions = []
+    for view, result in results.items():
+        if view not in baseline:
+            continue
+        before = baseline[view]
+        for key in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append(
+                    f"{view}: {key} went from {before[key]} to {result[key]}"
+                )
+        key = "requests_per_second"
+        if result[key] < before[key] * (1 - tolerance):
+            regressions.append(
+                f"{view}: {key} went from {before[key]} to {result[key]}"
+            )
+        if result["errors"] > before["errors"]:
+            regressions.append(
+                f"{view}: errors went from {before['errors']} to "
+                f"{result['errors']}"
+            )
+    return regressions
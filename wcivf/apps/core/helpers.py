@@ -31,6 +31,21 @@ def show_data_on_error(variable_name, data):
         raise
 
 
+def set_changed_fields(instance, values):
+    """
+    Takes a model instance and a dict of field values keyed by attribute
+    name. Sets the values that differ from those on the instance, once
+    converted to the field's Python type, and returns their attribute names.
+    """
+    changed = []
+    for attname, value in values.items():
+        value = instance._meta.get_field(attname).to_python(value)
+        if getattr(instance, attname) != value:
+            setattr(instance, attname, value)
+            changed.append(attname)
+    return changed
+
+
 def first_thursday_in_may_for_year(year):
     d = datetime.strptime("{}-05-01".format(year), "%Y-%m-%d")
     while d.weekday() != 3:
@@ -0,0 +1,141 @@
+import json
+
+from core import benchmark
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from elections.devs_dc_client import CachedDevsDCClient
+from elections.views import mixins
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the latency, throughput and number of queries of the postcode,
+    ballot, person and candidates API pages under concurrent load.
+
+    A new test database is created and seeded with a synthetic dataset,
+    postcode lookups are answered by a local stand-in for the Devs DC API
+    and every cache is replaced by a private in-memory one, cleared before
+    each run. The database is destroyed afterwards, so this is safe to run
+    against any settings. Results can be saved as a baseline, and compared
+    against one to catch regressions.
+
+    Pages are requested with Django's test Client, which goes through the
+    WSGI handler, so this doesn't measure serving them under ASGI.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ballots", type=int, default=2000)
+        parser.add_argument("--candidates-per-ballot", type=int, default=8)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="The number of requests to make to each view",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--views",
+            nargs="+",
+            choices=benchmark.VIEWS,
+            default=benchmark.VIEWS,
+        )
+        parser.add_argument(
+            "--save-baseline",
+            metavar="PATH",
+            help="Write the results to a JSON file to compare future runs to",
+        )
+        parser.add_argument(
+            "--baseline",
+            metavar="PATH",
+            help="Fail if the results are worse than those in this file",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="How much worse than the baseline results can be, as a "
+            "fraction of the baseline value",
+        )
+
+    def handle(self, **options):
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        with override_settings(CACHES=benchmark.private_caches()):
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True
+            )
+            try:
+                results = self.run(options)
+                # before tearing down, so that the results aren't lost if
+                # that fails
+                self.report(results)
+                if options["save_baseline"]:
+                    with open(options["save_baseline"], "w") as f:
+                        json.dump(results, f, indent=4)
+            finally:
+                self.teardown(old_name)
+
+        if baseline:
+            regressions = benchmark.compare_to_baseline(
+                results, baseline, tolerance=options["tolerance"]
+            )
+            if regressions:
+                raise CommandError(
+                    "Worse than the baseline:\n" + "\n".join(regressions)
+                )
+            self.stdout.write("No regressions compared to the baseline")
+
+    def teardown(self, old_name):
+        """
+        Destroys the test database, once every connection to it has been
+        closed, as it can't be dropped while anything is still connected
+        """
+        mixins.ballot_query_executor.close_connections()
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        for cache in caches.all():
+            cache.clear()
+        self.stdout.write("Seeding benchmark data")
+        ballots_by_postcode = benchmark.seed_dataset(
+            num_ballots=options["ballots"],
+            candidates_per_ballot=options["candidates_per_ballot"],
+        )
+        paths = benchmark.get_paths(ballots_by_postcode)
+        paths = {view: paths[view] for view in options["views"]}
+
+        client = mixins.DEVS_DC_CLIENT
+        with benchmark.DevsDCStub(ballots_by_postcode) as stub:
+            mixins.DEVS_DC_CLIENT = CachedDevsDCClient(
+                api_base=stub.url, api_key="benchmark"
+            )
+            try:
+                return benchmark.run_benchmark(
+                    paths,
+                    num_requests=options["requests"],
+                    concurrency=options["concurrency"],
+                )
+            finally:
+                mixins.DEVS_DC_CLIENT = client
+
+    def report(self, results):
+        columns = [
+            "requests",
+            "errors",
+            "requests_per_second",
+            "p50_ms",
+            "p95_ms",
+            "p99_ms",
+            "queries_per_request",
+        ]
+        self.stdout.write("\t".join(["view", *columns]))
+        for view, result in results.items():
+            self.stdout.write(
+                "\t".join([view, *(str(result[column]) for column in columns)])
+            )
@@ -0,0 +1,21 @@
+from core.sitemaps import build_sitemaps
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the sitemap sections that have changed since the last build "
+        "to gzipped XML files in SITEMAP_DIR, for the sitemap views to serve"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rewrite every section, whether or not it has changed",
+        )
+
+    def handle(self, **options):
+        written = build_sitemaps(force=options["force"], stdout=self.stdout)
+        if not written:
+            self.stdout.write("No sitemap sections have changed")
@@ -42,7 +42,7 @@ class Command(BaseCommand):
                 POSTCODE_TO_BALLOT_KEY_FMT,
                 PEOPLE_FOR_BALLOT_KEY_FMT,
             ):
-                cache.delete_pattern(fmt.format("*"))
+                cache.delete_pattern(fmt.replace("{}", "*"))
 
         # Unset dirty file if it exists
         if getattr(settings, "CHECK_HOST_DIRTY", False):
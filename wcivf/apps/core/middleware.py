@@ -12,4 +12,6 @@ class UTMTrackerMiddleware(object):
 
         keys = ("utm_source", "utm_medium", "utm_campaign")
         utm_data = {k: v for k, v in map(_get_value_from_req, keys) if v}
-        request.session["utm_data"] = utm_data
+        # kept on the request rather than the session, so that logging
+        # lookups doesn't load the session
+        request.utm_data = utm_data
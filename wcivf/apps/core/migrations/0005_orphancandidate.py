@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0004_delete_loggedpostcode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrphanCandidate",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("post", "Post"), ("person", "Person")],
+                        max_length=10,
+                    ),
+                ),
+                ("object_id", models.CharField(max_length=100)),
+            ],
+            options={
+                "unique_together": {("kind", "object_id")},
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+from itertools import islice
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+def record_existing_orphans(apps, schema_editor):
+    """
+    Orphans used to be found by checking every Post and Person, but are now
+    only looked for among the OrphanCandidates that imports record. Record
+    the ones that already exist, so that the next imports delete them.
+    """
+    OrphanCandidate = apps.get_model("core", "OrphanCandidate")
+    Post = apps.get_model("elections", "Post")
+    PostElection = apps.get_model("elections", "PostElection")
+    Person = apps.get_model("people", "Person")
+    PersonPost = apps.get_model("people", "PersonPost")
+    orphans = {
+        "post": Post.objects.exclude(
+            Exists(PostElection.objects.filter(post=OuterRef("pk")))
+        ),
+        "person": Person.objects.exclude(
+            Exists(PersonPost.objects.filter(person=OuterRef("pk")))
+        ),
+    }
+    for kind, queryset in orphans.items():
+        object_ids = queryset.values_list("pk", flat=True).iterator()
+        while batch := list(islice(object_ids, 1000)):
+            OrphanCandidate.objects.bulk_create(
+                [
+                    OrphanCandidate(kind=kind, object_id=str(object_id))
+                    for object_id in batch
+                ],
+                ignore_conflicts=True,
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0005_orphancandidate"),
+        ("elections", "0046_ballotchange"),
+        ("people", "0050_personpost_result_ranks"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            record_existing_orphans, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import models
+
+
+class OrphanCandidateQuerySet(models.QuerySet):
+    def record(self, kind, object_ids):
+        """
+        Records objects of a kind that might have been left orphaned
+        """
+        self.bulk_create(
+            [
+                self.model(kind=kind, object_id=str(object_id))
+                for object_id in set(object_ids)
+            ],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+
+
+class OrphanCandidate(models.Model):
+    """
+    A Post or Person that an import may have left without any ballots or
+    candidacies. Imports record these as they go, so that only they need
+    checking when orphans are deleted, rather than every row in the table.
+    See core.orphans.
+    """
+
+    POST = "post"
+    PERSON = "person"
+    KIND_CHOICES = [(POST, "Post"), (PERSON, "Person")]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # the primary key, as a string as Post's are
+    object_id = models.CharField(max_length=100)
+
+    objects = OrphanCandidateQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("kind", "object_id")
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
@@ -0,0 +1,67 @@
+"""
+Deletes the Posts and People that imports have left without any ballots or
+candidacies.
+
+Only the OrphanCandidates that imports recorded are checked, a batch at a
+time, and the orphans in each batch deleted together, along with
+everything that refers to them.
+"""
+
+from core.models import OrphanCandidate
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from elections.models import Post, PostElection
+from people.models import Person, PersonPost
+
+# For each kind of orphan, the model and the foreign key that objects
+# without any rows pointing at them through are orphaned
+ORPHAN_KINDS = {
+    OrphanCandidate.POST: (Post, PostElection._meta.get_field("post")),
+    OrphanCandidate.PERSON: (Person, PersonPost._meta.get_field("person")),
+}
+
+
+def delete_orphans(kind, batch_size=1000):
+    """
+    Checks the recorded candidates of a kind a batch at a time, deleting
+    those that are orphans and then the candidates. Returns the number of
+    orphans deleted.
+    """
+    model, field = ORPHAN_KINDS[kind]
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            candidates = list(
+                OrphanCandidate.objects.filter(kind=kind)
+                .order_by("pk")
+                .values_list("pk", "object_id")[:batch_size]
+            )
+            if not candidates:
+                return deleted
+
+            related = field.model.objects.filter(
+                **{field.attname: OuterRef("pk")}
+            )
+            orphan_ids = list(
+                model.objects.filter(
+                    pk__in=[object_id for _, object_id in candidates]
+                )
+                .exclude(Exists(related))
+                .values_list("pk", flat=True)
+            )
+            if orphan_ids:
+                if kind == OrphanCandidate.POST:
+                    # the post's candidacies are deleted with it, which can
+                    # leave people orphaned
+                    OrphanCandidate.objects.record(
+                        OrphanCandidate.PERSON,
+                        PersonPost.objects.filter(
+                            post_id__in=orphan_ids
+                        ).values_list("person_id", flat=True),
+                    )
+                model.objects.filter(pk__in=orphan_ids).delete()
+                deleted += len(orphan_ids)
+
+            OrphanCandidate.objects.filter(
+                pk__in=[pk for pk, _ in candidates]
+            ).delete()
@@ -0,0 +1,219 @@
+"""
+Writes the sitemap to gzipped XML files, for the sitemap views to serve.
+
+Each section is read from the database in primary key order a page at a
+time (keyset pagination, rather than the OFFSETs Django's sitemap views
+use, which get slower the deeper the page) and written to files of at most
+the sitemap's `limit` URLs. A section is only rewritten if its rows have
+changed since the last build, going by a fingerprint of them stored in a
+manifest alongside the files.
+"""
+
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, Max
+from elections.sitemaps import ElectionSitemap, PostElectionSitemap
+from parties.sitemaps import PartySitemap
+from people.sitemaps import PersonSitemap
+
+SITEMAPS = {
+    "elections": ElectionSitemap,
+    "postelections": PostElectionSitemap,
+    "people": PersonSitemap,
+    "parties": PartySitemap,
+}
+# How many rows are read from the database at once
+CHUNK_SIZE = 2000
+INDEX_FILENAME = "sitemap.xml.gz"
+MANIFEST_FILENAME = "manifest.json"
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def get_sitemap_dir():
+    return Path(settings.SITEMAP_DIR)
+
+
+def section_filename(section, page):
+    return f"sitemap-{section}-{page}.xml.gz"
+
+
+def read_manifest():
+    try:
+        with open(get_sitemap_dir() / MANIFEST_FILENAME) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def iter_keyset(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields the objects in a queryset in primary key order, reading a chunk
+    at a time with `pk > last pk seen` rather than an OFFSET
+    """
+    queryset = queryset.order_by("pk")
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        count = 0
+        for obj in chunk[:chunk_size].iterator():
+            count += 1
+            last_pk = obj.pk
+            yield obj
+        if count < chunk_size:
+            return
+
+
+def get_fingerprint(sitemap):
+    """
+    Returns a string that changes when the URLs in a sitemap section do.
+
+    Sections with a `changed_field` are fingerprinted by their row count,
+    largest primary key and latest change, which the database can work
+    out without reading every row. Others are small enough to hash.
+    """
+    queryset = sitemap.items().order_by()
+    if sitemap.changed_field:
+        values = queryset.aggregate(
+            count=Count("pk"),
+            max_pk=Max("pk"),
+            changed=Max(sitemap.changed_field),
+        )
+        return json.dumps(values, sort_keys=True, default=str)
+    digest = hashlib.sha256()
+    for obj in iter_keyset(queryset):
+        digest.update(f"{sitemap.location(obj)}\n".encode())
+    return digest.hexdigest()
+
+
+def write_gzip(path, lines):
+    """
+    Writes lines of text to a gzipped file, replacing any existing file
+    only once it's complete
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+
+def url_lines(sitemap, objs):
+    yield XML_HEADER
+    yield f"<urlset {XMLNS}>\n"
+    for obj in objs:
+        yield (
+            f"<url><loc>{escape(get_location(sitemap, obj))}</loc>"
+            f"<changefreq>{sitemap.changefreq}</changefreq>"
+            f"<priority>{sitemap.priority}</priority></url>\n"
+        )
+    yield "</urlset>\n"
+
+
+def get_location(sitemap, obj):
+    return f"{settings.CANONICAL_URL}{sitemap.location(obj)}"
+
+
+def build_section(section, sitemap):
+    """
+    Writes the files for a section, returning how many there are
+    """
+    sitemap_dir = get_sitemap_dir()
+    objs = iter_keyset(sitemap.items())
+    page = 0
+    while True:
+        page_objs = itertools.islice(objs, sitemap.limit)
+        first = next(page_objs, None)
+        if first is None and page:
+            break
+        page += 1
+        if first is not None:
+            page_objs = itertools.chain([first], page_objs)
+        # an empty section still gets a file, with no URLs in it
+        write_gzip(
+            sitemap_dir / section_filename(section, page),
+            url_lines(sitemap, page_objs),
+        )
+        if first is None:
+            break
+
+    # remove pages left over from a bigger build
+    stale_page = page + 1
+    while (sitemap_dir / section_filename(section, stale_page)).exists():
+        (sitemap_dir / section_filename(section, stale_page)).unlink()
+        stale_page += 1
+    return page
+
+
+def index_lines(manifest):
+    yield XML_HEADER
+    yield f"<sitemapindex {XMLNS}>\n"
+    for section, built in manifest.items():
+        for page in range(1, built["pages"] + 1):
+            loc = f"{settings.CANONICAL_URL}/sitemap-{section}.xml"
+            if page > 1:
+                loc = f"{loc}?p={page}"
+            yield (
+                f"<sitemap><loc>{escape(loc)}</loc>"
+                f"<lastmod>{built['built_at']}</lastmod></sitemap>\n"
+            )
+    yield "</sitemapindex>\n"
+
+
+def build_sitemaps(force=False, stdout=None):
+    """
+    Writes the files for each section that has changed since the last
+    build, or every section if `force` is set, and then the index. Returns
+    the names of the sections written.
+    """
+    sitemap_dir = get_sitemap_dir()
+    sitemap_dir.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest()
+
+    written = []
+    for section, sitemap_class in SITEMAPS.items():
+        sitemap = sitemap_class()
+        fingerprint = get_fingerprint(sitemap)
+        built = manifest.get(section)
+        if (
+            not force
+            and built
+            and built["fingerprint"] == fingerprint
+            and (sitemap_dir / section_filename(section, 1)).exists()
+        ):
+            continue
+        pages = build_section(section, sitemap)
+        manifest[section] = {
+            "fingerprint": fingerprint,
+            "pages": pages,
+            "built_at": datetime.datetime.now(datetime.timezone.utc)
+            .replace(microsecond=0)
+            .isoformat(),
+        }
+        written.append(section)
+        if stdout:
+            stdout.write(f"Wrote {pages} file(s) for {section}")
+
+    # drop sections that are no longer in the sitemap
+    manifest = {
+        section: built
+        for section, built in manifest.items()
+        if section in SITEMAPS
+    }
+    if written or not (sitemap_dir / INDEX_FILENAME).exists():
+        write_gzip(sitemap_dir / INDEX_FILENAME, index_lines(manifest))
+    tmp_path = sitemap_dir / f".{MANIFEST_FILENAME}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, sitemap_dir / MANIFEST_FILENAME)
+    return written
@@ -0,0 +1,167 @@
+import json
+from io import StringIO
+
+import pytest
+import requests
+from core import benchmark
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from elections.models import PostElection
+from elections.views import mixins
+from people.models import PersonPost
+
+
+def test_make_postcode():
+    postcodes = [benchmark.make_postcode(i) for i in range(10000)]
+    assert len(set(postcodes)) == 10000
+    assert postcodes[0] == "BM1 0AA"
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([5], 95) == 5
+    assert benchmark.percentile([], 50) is None
+
+
+def test_compare_to_baseline():
+    baseline = {
+        "postcode": {
+            "requests": 100,
+            "errors": 0,
+            "requests_per_second": 100,
+            "p50_ms": 10,
+            "p95_ms": 20,
+            "p99_ms": 30,
+            "queries_per_request": 10,
+        }
+    }
+    results = {
+        "postcode": {
+            **baseline["postcode"],
+            "p95_ms": 23,
+            "queries_per_request": 13,
+            "requests_per_second": 70,
+        },
+        "api": baseline["postcode"],
+    }
+    assert benchmark.compare_to_baseline(results, baseline, tolerance=0.2) == [
+        "postcode: queries_per_request went from 10 to 13",
+        "postcode: requests_per_second went from 100 to 70",
+    ]
+    assert benchmark.compare_to_baseline(baseline, baseline) == []
+
+
+def test_devs_dc_stub():
+    ballots = {"BM1 0AA": ["local.a.2024-05-02", "local.b.2024-05-02"]}
+    with benchmark.DevsDCStub(ballots) as stub:
+        response = requests.get(f"{stub.url}/api/v1/postcode/BM1%200AA/")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["address_picker"] is False
+        assert data["dates"][0]["ballots"] == [
+            {"ballot_paper_id": "local.a.2024-05-02"},
+            {"ballot_paper_id": "local.b.2024-05-02"},
+        ]
+
+        response = requests.get(f"{stub.url}/api/v1/postcode/XX1%201XX/")
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_seed_dataset():
+    ballots_by_postcode = benchmark.seed_dataset(
+        num_ballots=10, candidates_per_ballot=3, ballots_per_election=5
+    )
+    assert PostElection.objects.count() == 10
+    assert PostElection.objects.values("election").distinct().count() == 2
+    assert PersonPost.objects.count() == 30
+    assert len(ballots_by_postcode) == 5
+    for ballot_ids in ballots_by_postcode.values():
+        ballots = PostElection.objects.filter(ballot_paper_id__in=ballot_ids)
+        assert ballots.values("election").distinct().count() == 2
+
+    paths = benchmark.get_paths(ballots_by_postcode)
+    assert paths["postcode"][0] == "/elections/BM1 0AA/"
+    assert len(paths["post"]) == 10
+
+
+@pytest.mark.django_db
+def test_query_counter():
+    with benchmark.QueryCounter() as counter:
+        PostElection.objects.count()
+        PostElection.objects.count()
+    PostElection.objects.count()
+    assert counter.count == 2
+    assert counter not in connection.execute_wrappers
+
+
+def test_private_caches(settings):
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        },
+        "local": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+    caches["local"].set("key", "shared")
+
+    with override_settings(CACHES=benchmark.private_caches()):
+        assert set(caches) == {"default", "local"}
+        for cache in caches.all():
+            assert isinstance(cache, LocMemCache)
+        assert caches["local"].get("key") is None
+        caches["local"].set("key", "benchmark")
+
+    assert caches["local"].get("key") == "shared"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_views_command(mocker, tmp_path):
+    """
+    Runs the postcode view through the real ballot query executor, and
+    saves the results even if the test database can't be destroyed
+    """
+    mocker.patch.object(
+        connection.creation, "create_test_db", return_value="old"
+    )
+    close_connections = mocker.spy(
+        mixins.ballot_query_executor, "close_connections"
+    )
+    people_for_ballot = mocker.spy(
+        mixins.PostelectionsToPeopleMixin, "people_for_ballot_in_thread"
+    )
+
+    def destroy_test_db(old_name, verbosity):
+        # every connection is closed first
+        assert close_connections.call_count == 1
+        raise DatabaseError("database is being accessed by other users")
+
+    mocker.patch.object(
+        connection.creation, "destroy_test_db", side_effect=destroy_test_db
+    )
+    baseline = tmp_path / "baseline.json"
+    stdout = StringIO()
+
+    with pytest.raises(DatabaseError):
+        call_command(
+            "benchmark_views",
+            ballots=4,
+            candidates_per_ballot=2,
+            requests=3,
+            concurrency=2,
+            views=["postcode"],
+            save_baseline=str(baseline),
+            stdout=stdout,
+        )
+
+    results = json.loads(baseline.read_text())
+    assert results["postcode"]["requests"] == 3
+    assert results["postcode"]["errors"] == 0
+    assert people_for_ballot.called
+    assert "postcode\t3\t0\t" in stdout.getvalue()
@@ -0,0 +1,75 @@
+from importlib import import_module
+
+import pytest
+from core.models import OrphanCandidate
+from core.orphans import delete_orphans
+from django.apps import apps
+from elections.models import Post
+from elections.tests.factories import PostElectionFactory, PostFactory
+from leaflets.models import Leaflet
+from parties.tests.factories import PartyFactory
+from people.models import Person, PersonPost
+from people.tests.factories import PersonFactory, PersonPostFactory
+
+
+@pytest.mark.django_db
+def test_delete_orphan_people():
+    ballot = PostElectionFactory()
+    candidate = PersonPostFactory(
+        post_election=ballot, post=ballot.post, election=ballot.election
+    ).person
+    orphan = PersonFactory(name="Orphan")
+    Leaflet.objects.create(person=orphan, leaflet_id=1)
+    unchecked = PersonFactory(name="Unchecked")
+    OrphanCandidate.objects.record(
+        OrphanCandidate.PERSON, [candidate.pk, orphan.pk, orphan.pk, 999]
+    )
+
+    assert delete_orphans(OrphanCandidate.PERSON, batch_size=2) == 1
+    assert set(Person.objects.all()) == {candidate, unchecked}
+    assert not Leaflet.objects.exists()
+    assert not OrphanCandidate.objects.exists()
+
+
+@pytest.mark.django_db
+def test_delete_orphan_posts_records_people():
+    post = PostFactory(ynr_id="orphan")
+    ballot = PostElectionFactory()
+    # a candidacy for a post that no longer has the ballot
+    person_post = PersonPostFactory(
+        post=post, post_election=ballot, election=ballot.election
+    )
+    person_post.previous_party_affiliations.add(PartyFactory())
+    OrphanCandidate.objects.record(OrphanCandidate.POST, [post.pk])
+
+    assert delete_orphans(OrphanCandidate.POST) == 1
+    assert not Post.objects.filter(pk=post.pk).exists()
+    assert not PersonPost.objects.exists()
+    assert list(OrphanCandidate.objects.values_list("kind", "object_id")) == [
+        (OrphanCandidate.PERSON, str(person_post.person_id))
+    ]
+
+    assert delete_orphans(OrphanCandidate.PERSON) == 1
+    assert not Person.objects.exists()
+
+
+@pytest.mark.django_db
+def test_existing_orphans_recorded():
+    record_existing_orphans = import_module(
+        "core.migrations.0006_record_existing_orphans"
+    ).record_existing_orphans
+    ballot = PostElectionFactory()
+    candidate = PersonPostFactory(
+        post_election=ballot, post=ballot.post, election=ballot.election
+    ).person
+    orphan_post = PostFactory(ynr_id="orphan")
+    orphan = PersonFactory(name="Orphan")
+
+    record_existing_orphans(apps, None)
+
+    assert set(OrphanCandidate.objects.values_list("kind", "object_id")) == {
+        (OrphanCandidate.POST, orphan_post.pk),
+        (OrphanCandidate.PERSON, str(orphan.pk)),
+    }
+    assert delete_orphans(OrphanCandidate.PERSON) == 1
+    assert list(Person.objects.all()) == [candidate]
@@ -0,0 +1,164 @@
+import gzip
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from core.sitemaps import (
+    INDEX_FILENAME,
+    MANIFEST_FILENAME,
+    build_sitemaps,
+    iter_keyset,
+)
+from core.views import SitemapFileView
+from django.test import AsyncClient
+from django.utils import timezone
+from people.models import Person
+from people.sitemaps import PersonSitemap
+from people.tests.factories import PersonFactory
+
+
+@pytest.fixture
+def sitemap_dir(settings, tmp_path):
+    settings.SITEMAP_DIR = tmp_path
+    return tmp_path
+
+
+def read_gzip(path):
+    with gzip.open(path, "rt") as f:
+        return f.read()
+
+
+@pytest.mark.django_db
+def test_iter_keyset():
+    people = PersonFactory.create_batch(5)
+    assert list(iter_keyset(Person.objects.all(), chunk_size=2)) == sorted(
+        people, key=lambda person: person.pk
+    )
+
+
+@pytest.mark.django_db
+def test_build_sitemaps(sitemap_dir):
+    person = PersonFactory()
+
+    assert build_sitemaps() == [
+        "elections",
+        "postelections",
+        "people",
+        "parties",
+    ]
+
+    people_xml = read_gzip(sitemap_dir / "sitemap-people-1.xml.gz")
+    assert (
+        f"<loc>https://whocanivotefor.co.uk{person.get_absolute_url()}</loc>"
+        in people_xml
+    )
+    # empty sections are still written
+    assert "<url>" not in read_gzip(sitemap_dir / "sitemap-parties-1.xml.gz")
+    index_xml = read_gzip(sitemap_dir / INDEX_FILENAME)
+    assert (
+        "<loc>https://whocanivotefor.co.uk/sitemap-people.xml</loc>"
+        in index_xml
+    )
+    manifest = json.loads((sitemap_dir / MANIFEST_FILENAME).read_text())
+    assert manifest["people"]["pages"] == 1
+
+
+@pytest.mark.django_db
+def test_build_sitemaps_only_writes_changed_sections(sitemap_dir):
+    person = PersonFactory()
+    build_sitemaps()
+
+    assert build_sitemaps() == []
+
+    person.last_updated = timezone.now()
+    person.save()
+    assert build_sitemaps() == ["people"]
+    assert build_sitemaps(force=True) == [
+        "elections",
+        "postelections",
+        "people",
+        "parties",
+    ]
+
+
+@pytest.mark.django_db
+def test_build_sitemaps_pages(sitemap_dir, mocker):
+    mocker.patch.object(PersonSitemap, "limit", 2)
+    PersonFactory.create_batch(5)
+    build_sitemaps()
+
+    for page in (1, 2, 3):
+        assert (sitemap_dir / f"sitemap-people-{page}.xml.gz").exists()
+    assert not (sitemap_dir / "sitemap-people-4.xml.gz").exists()
+    index_xml = read_gzip(sitemap_dir / INDEX_FILENAME)
+    assert "/sitemap-people.xml?p=3</loc>" in index_xml
+
+    # pages left over from a bigger build are removed
+    Person.objects.order_by("-pk")[0].delete()
+    Person.objects.order_by("-pk")[0].delete()
+    assert build_sitemaps() == ["people"]
+    assert not (sitemap_dir / "sitemap-people-3.xml.gz").exists()
+
+
+@pytest.mark.django_db
+class TestSitemapViews:
+    def test_serves_gzip(self, client, sitemap_dir):
+        PersonFactory()
+        build_sitemaps()
+
+        response = client.get(
+            "/sitemap-people.xml", HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        assert response.status_code == 200
+        assert response["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response["Vary"]
+        assert (
+            gzip.decompress(b"".join(response.streaming_content))
+            .decode()
+            .startswith("<?xml")
+        )
+
+    def test_serves_plain(self, sitemap_dir):
+        build_sitemaps()
+
+        async def get_sitemap():
+            response = await AsyncClient().get("/sitemap.xml")
+            return response, b"".join(
+                [chunk async for chunk in response.streaming_content]
+            )
+
+        response, content = async_to_sync(get_sitemap)()
+        assert response.status_code == 200
+        assert not response.has_header("Content-Encoding")
+        # decompressed as it's sent, rather than all at once
+        assert response.is_async
+        assert "<sitemapindex" in content.decode()
+
+    def test_falls_back_to_dynamic_sitemap(self, client, sitemap_dir):
+        person = PersonFactory()
+
+        response = client.get("/sitemap-people.xml")
+        assert response.status_code == 200
+        assert person.get_absolute_url() in response.content.decode()
+
+    def test_unknown_section(self, client, sitemap_dir):
+        build_sitemaps()
+
+        assert client.get("/sitemap-foo.xml").status_code == 404
+        assert client.get("/sitemap-people.xml?p=foo").status_code == 404
+
+    def test_missing_page_once_built(self, client, sitemap_dir):
+        PersonFactory()
+        build_sitemaps()
+
+        assert client.get("/sitemap-people.xml?p=2").status_code == 404
+        (sitemap_dir / "sitemap-people-1.xml.gz").unlink()
+        assert client.get("/sitemap-people.xml").status_code == 404
+
+    def test_file_view_must_say_what_to_serve(self):
+        class IncompleteSitemapView(SitemapFileView):
+            def get_filename(self):
+                return INDEX_FILENAME
+
+        with pytest.raises(TypeError, match="fallback"):
+            IncompleteSitemapView()
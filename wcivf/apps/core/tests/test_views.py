@@ -1,5 +1,10 @@
+from unittest import mock
+
+from core.benchmark import DevsDCStub
 from django.shortcuts import reverse
 from django.test import TestCase
+from elections.devs_dc_client import DevsDCClient
+from elections.postcode_logger import BufferedPostcodeLogger
 
 
 class TestPostcodeFormView(TestCase):
@@ -29,3 +34,57 @@ class TestPostcodeFormView(TestCase):
         response = self.client.get("/?postcode=TE11ST&invalid_postcode=1")
 
         assert response.status_code == 200
+
+
+class TestStatusCheckView(TestCase):
+    def test_devs_dc_connection_stats(self):
+        with DevsDCStub({"BM1 0AA": ["local.a.2024-05-02"]}) as stub:
+            client = DevsDCClient(api_base=stub.url, api_key="x")
+            client.make_request("BM1 0AA")
+            client.make_request("BM1 0AA")
+        postcode_logger = BufferedPostcodeLogger(
+            max_size=10, batch_size=10, flush_interval=60
+        )
+        with mock.patch(
+            "elections.views.mixins.DEVS_DC_CLIENT", client
+        ), mock.patch(
+            "elections.views.mixins.postcode_logger", postcode_logger
+        ):
+            response = self.client.get(reverse("status_check_view"))
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "ready_to_serve": True,
+            "devs_dc_connections": {
+                "requests": 2,
+                "new_connections": 1,
+                "reused_connections": 1,
+                "retries": 0,
+                "circuit_open": False,
+            },
+            "postcode_logger": {
+                "queued": 0,
+                "written": 0,
+                "failed": 0,
+                "dropped": 0,
+            },
+        }
+
+    def test_postcode_logger_stats(self):
+        postcode_logger = BufferedPostcodeLogger(
+            max_size=10, batch_size=10, flush_interval=60
+        )
+        postcode_logger.entries.append({"postcode": "BM1 0AA"})
+        postcode_logger.written = 5
+        postcode_logger.dropped = 2
+        with mock.patch(
+            "elections.views.mixins.postcode_logger", postcode_logger
+        ):
+            response = self.client.get(reverse("status_check_view"))
+
+        assert response.json()["postcode_logger"] == {
+            "queued": 1,
+            "written": 5,
+            "failed": 0,
+            "dropped": 2,
+        }
@@ -1,6 +1,6 @@
 from urllib.parse import urlencode
 
-from django.db.models import BLANK_CHOICE_DASH, Transform
+from django.db.models import BLANK_CHOICE_DASH, BigIntegerField, Func, Transform
 from django.utils.encoding import force_str
 from django.utils.safestring import mark_safe
 from django_filters.widgets import LinkWidget
@@ -25,6 +25,26 @@ class LastWord(Transform):
         return self.as_sql(compiler, connection)
 
 
+class CurrentTransactionId(Func):
+    """
+    The ID of the current transaction, giving it one if it hasn't got one
+    yet
+    """
+
+    template = "pg_current_xact_id()::text::bigint"
+    output_field = BigIntegerField()
+
+
+class OldestRunningTransactionId(Func):
+    """
+    The ID of the oldest transaction still running as of the current
+    statement. Every transaction with a lower ID has committed or rolled back.
+    """
+
+    template = "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+    output_field = BigIntegerField()
+
+
 class DSLinkWidget(LinkWidget):
     """
     The LinkWidget doesn't allow iterating over choices in the template layer
@@ -1,13 +1,25 @@
+import abc
 import datetime
 import os
 
+from api.export import aiter_chunks, iter_snapshot
 from core.helpers import may_election_day_this_year
+from core.sitemaps import (
+    INDEX_FILENAME,
+    SITEMAPS,
+    get_sitemap_dir,
+    section_filename,
+)
 from django import http
 from django.conf import settings
+from django.contrib.sitemaps import views as sitemap_views
 from django.urls import reverse
 from django.utils import timezone, translation
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.cache import cache_page
 from django.views.generic import FormView, TemplateView, View
 from elections.models import PostElection
+from elections.views import mixins
 
 from .forms import PostcodeLookupForm
 
@@ -141,4 +153,74 @@ class StatusCheckView(View):
             status = 200
             data["ready_to_serve"] = True
 
+        # for this process, so varies between requests
+        data["devs_dc_connections"] = mixins.DEVS_DC_CLIENT.connection_stats
+        data["postcode_logger"] = mixins.postcode_logger.stats
+
         return http.JsonResponse(data, status=status)
+
+
+class SitemapFileView(View, metaclass=abc.ABCMeta):
+    """
+    Serves a file written by the build_sitemaps command, gzipped if the
+    client accepts that. Until the first build, falls back to working out
+    the sitemap on each (cached) request. After that, files that weren't
+    built (such as pages past the end of a section) are a 404.
+    """
+
+    @abc.abstractmethod
+    def get_filename(self):
+        pass
+
+    @abc.abstractmethod
+    def fallback(self, request, *args, **kwargs):
+        pass
+
+    def get(self, request, *args, **kwargs):
+        sitemap_dir = get_sitemap_dir()
+        path = sitemap_dir / self.get_filename()
+        if not path.exists():
+            if not (sitemap_dir / INDEX_FILENAME).exists():
+                return self.fallback(request, *args, **kwargs)
+            raise http.Http404("No sitemap available for page")
+
+        # the responses close the files once they've been sent
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = http.FileResponse(
+                open(path, "rb"),  # noqa: SIM115
+                content_type="application/xml",
+            )
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = http.StreamingHttpResponse(
+                aiter_chunks(iter_snapshot(path), chunk_size=1),
+                content_type="application/xml",
+            )
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+
+class SitemapIndexView(SitemapFileView):
+    fallback_view = staticmethod(cache_page(86400)(sitemap_views.index))
+
+    def get_filename(self):
+        return INDEX_FILENAME
+
+    def fallback(self, request, *args, **kwargs):
+        return self.fallback_view(request, sitemaps=SITEMAPS)
+
+
+class SitemapSectionView(SitemapFileView):
+    fallback_view = staticmethod(cache_page(86400)(sitemap_views.sitemap))
+
+    def get_filename(self):
+        if self.kwargs["section"] not in SITEMAPS:
+            raise http.Http404("No sitemap available for section")
+        try:
+            page = int(self.request.GET.get("p", 1))
+        except ValueError:
+            raise http.Http404("Page is not an integer")
+        return section_filename(self.kwargs["section"], page)
+
+    def fallback(self, request, *args, **kwargs):
+        return self.fallback_view(request, sitemaps=SITEMAPS, **kwargs)
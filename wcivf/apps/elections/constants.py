@@ -1,6 +1,8 @@
 POSTCODE_TO_BALLOT_KEY_FMT = "postcode_to_ballot_{}"
-PEOPLE_FOR_BALLOT_KEY_FMT = "people_for_ballot_{}_compact_{}"
+POSTCODE_TO_BALLOT_GENERATION_KEY = "postcode_to_ballot_generation"
+PEOPLE_FOR_BALLOT_KEY_FMT = "people_for_ballot_{}_compact_{}_modified_{}"
 POLLING_STATIONS_KEY_FMT = "pollingstations_{}"
+ICAL_KEY_FMT = "ical_{}"
 
 UPDATED_SLUGS = {
     "2010": "parl.2010-05-06",
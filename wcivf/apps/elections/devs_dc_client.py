@@ -1,8 +1,18 @@
+import random
+import time
 from json import JSONDecodeError
 from urllib.parse import urljoin
 
 import requests
 from django.conf import settings
+from django.core.cache import cache, caches
+from elections.constants import (
+    POSTCODE_TO_BALLOT_GENERATION_KEY,
+    POSTCODE_TO_BALLOT_KEY_FMT,
+)
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 
 class DevsDCAPIException(Exception):
@@ -15,23 +25,248 @@ class DevsDCAPIException(Exception):
         self.response = response
 
 
+class DevsDCAPIUnavailable(DevsDCAPIException):
+    """
+    Raised when the API couldn't be reached, or without trying when the
+    circuit breaker is open
+    """
+
+    def __init__(self, message="Devs DC API unavailable"):
+        self.message = {"error": message}
+        self.status = 503
+        self.response = None
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive upstream failures. Once `failure_threshold` is
+    reached the circuit opens and callers should fail fast for
+    `reset_timeout` seconds, after which requests are let through again to
+    check if upstream has recovered. A single failure at that point opens
+    the circuit again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        if self.opened_at is None:
+            return False
+        return time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
 class DevsDCClient:
-    def __init__(self, api_base=None, api_key=None):
+    def __init__(
+        self,
+        api_base=None,
+        api_key=None,
+        pool_size=None,
+        timeout=None,
+        max_retries=None,
+        backoff_factor=0.2,
+    ):
         if not api_base:
             api_base = settings.DEVS_DC_BASE
         self.API_BASE = api_base
         if not api_key:
             api_key = settings.DEVS_DC_API_KEY
         self.API_KEY = api_key
+        self.timeout = timeout or (
+            settings.DEVS_DC_CONNECT_TIMEOUT,
+            settings.DEVS_DC_READ_TIMEOUT,
+        )
+        if max_retries is None:
+            max_retries = settings.DEVS_DC_MAX_RETRIES
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retries = 0
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=settings.DEVS_DC_CIRCUIT_BREAKER_THRESHOLD,
+            reset_timeout=settings.DEVS_DC_CIRCUIT_BREAKER_RESET_TIMEOUT,
+        )
+
+        # One session per client, so connections (and TLS sessions) are
+        # kept alive and reused between lookups
+        pool_size = pool_size or settings.DEVS_DC_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def make_request(self, postcode, uprn=None):
         path = f"/api/v1/postcode/{postcode}/"
         if uprn:
             path = f"/api/v1/address/{uprn}/"
         url = urljoin(self.API_BASE, path)
-        req = requests.get(
-            url, params={"auth_token": self.API_KEY, "include_current": 1}
-        )
+
+        if self.circuit_breaker.is_open:
+            raise DevsDCAPIUnavailable()
+
+        try:
+            req = self.get_with_retries(
+                url, params={"auth_token": self.API_KEY, "include_current": 1}
+            )
+        except requests.RequestException:
+            self.circuit_breaker.record_failure()
+            raise DevsDCAPIUnavailable()
+
+        if req.status_code in RETRY_STATUS_CODES:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
         if req.status_code >= 400:
             raise DevsDCAPIException(response=req)
         return req.json()
+
+    def get_with_retries(self, url, params):
+        """
+        GETs the URL, retrying connection errors, timeouts and responses
+        with a status code in RETRY_STATUS_CODES with jittered exponential
+        backoff. Returns the last response if retries run out.
+        """
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                req = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+            else:
+                if last_attempt or req.status_code not in RETRY_STATUS_CODES:
+                    return req
+            self.retries += 1
+            time.sleep(
+                self.backoff_factor * (2**attempt) * random.uniform(0.5, 1.5)
+            )
+        return None
+
+    @property
+    def connection_stats(self):
+        """
+        Counts of requests made through the pooled session, split into those
+        that needed a new connection (and so a TCP/TLS handshake) and those
+        that reused a pooled one
+        """
+        requests_made = 0
+        new_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            # urllib3's pool container doesn't support iterating directly
+            for key in pools.keys():  # noqa: SIM118
+                pool = pools[key]
+                requests_made += pool.num_requests
+                new_connections += pool.num_connections
+        return {
+            "requests": requests_made,
+            "new_connections": new_connections,
+            "reused_connections": requests_made - new_connections,
+            "retries": self.retries,
+            "circuit_open": self.circuit_breaker.is_open,
+        }
+
+
+def invalidate_postcode_lookups():
+    """
+    Marks every cached postcode lookup as out of date by bumping the
+    generation number stored alongside them. Called by the importers when
+    ballots are added or removed, as that can change which ballots a
+    postcode maps to.
+    """
+    try:
+        cache.incr(POSTCODE_TO_BALLOT_GENERATION_KEY)
+    except ValueError:
+        cache.set(POSTCODE_TO_BALLOT_GENERATION_KEY, 1, timeout=None)
+
+
+class CachedDevsDCClient(DevsDCClient):
+    """
+    A DevsDCClient that caches responses, first in a small in-process LRU
+    (the `local` cache) and then in the shared default cache.
+
+    Entries in the shared cache are fresh for POSTCODE_LOOKUP_CACHE_TTL
+    seconds. After that they are served stale for up to
+    POSTCODE_LOOKUP_CACHE_STALE_TTL seconds while a single request
+    revalidates them, and are also used if revalidation fails because the
+    upstream API is having problems.
+    """
+
+    def cache_key(self, postcode, uprn=None):
+        key = POSTCODE_TO_BALLOT_KEY_FMT.format(
+            postcode.replace(" ", "").upper()
+        )
+        if uprn:
+            key = f"{key}_{uprn}"
+        return key
+
+    @property
+    def local_cache(self):
+        return caches["local"]
+
+    def make_request(self, postcode, uprn=None):
+        key = self.cache_key(postcode, uprn)
+
+        entry = self.local_cache.get(key)
+        if entry:
+            return entry["data"]
+
+        cached = cache.get_many([key, POSTCODE_TO_BALLOT_GENERATION_KEY])
+        generation = cached.get(POSTCODE_TO_BALLOT_GENERATION_KEY, 0)
+        entry = cached.get(key)
+        if not entry or entry["generation"] != generation:
+            return self.fetch_and_store(key, generation, postcode, uprn)
+
+        if entry["fresh_until"] > time.time():
+            self.store_locally(key, entry)
+            return entry["data"]
+
+        # The entry is stale. Only one request revalidates it, everyone
+        # else carries on using the stale copy in the meantime
+        lock_key = f"{key}_lock"
+        if not cache.add(lock_key, 1, timeout=30):
+            return entry["data"]
+        try:
+            return self.fetch_and_store(key, generation, postcode, uprn)
+        except DevsDCAPIException as exception:
+            if exception.status not in RETRY_STATUS_CODES:
+                raise
+            return entry["data"]
+        finally:
+            cache.delete(lock_key)
+
+    def fetch_and_store(self, key, generation, postcode, uprn=None):
+        data = super().make_request(postcode=postcode, uprn=uprn)
+        fresh_ttl = settings.POSTCODE_LOOKUP_CACHE_TTL
+        entry = {
+            "data": data,
+            "generation": generation,
+            "fresh_until": time.time() + fresh_ttl,
+        }
+        cache.set(
+            key,
+            entry,
+            timeout=fresh_ttl + settings.POSTCODE_LOOKUP_CACHE_STALE_TTL,
+        )
+        self.store_locally(key, entry)
+        return data
+
+    def store_locally(self, key, entry):
+        timeout = min(
+            settings.POSTCODE_LOOKUP_LOCAL_CACHE_TTL,
+            entry["fresh_until"] - time.time(),
+        )
+        if timeout > 0:
+            self.local_cache.set(key, entry, timeout=timeout)
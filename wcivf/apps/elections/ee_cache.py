@@ -0,0 +1,190 @@
+"""
+A bounded cache of EveryElection API responses, used by EEHelper.
+
+Entries are kept in memory in least recently used order, up to a maximum
+number, and expire after a TTL. Optionally, every entry is also written to
+a SQLite snapshot on disk, so that later imports (including in a new
+process) can reuse what earlier ones downloaded.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+# Entries in the snapshot that haven't been fetched or revalidated for this
+# many seconds are deleted when it is opened, so it doesn't grow forever
+SNAPSHOT_MAX_AGE = 60 * 60 * 24 * 7
+
+
+class CacheEntry(NamedTuple):
+    # None if EE doesn't know about the election
+    data: Optional[dict]
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class EECache:
+    def __init__(self, max_entries, ttl, missing_ttl, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.entries = OrderedDict()
+        self.meta = {}
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = self.open_snapshot(path)
+
+    @classmethod
+    def from_settings(cls):
+        path = None
+        if settings.EE_CACHE_DIR:
+            path = Path(settings.EE_CACHE_DIR) / "ee_cache.sqlite3"
+        return cls(
+            max_entries=settings.EE_CACHE_MAX_ENTRIES,
+            ttl=settings.EE_CACHE_TTL,
+            missing_ttl=settings.EE_CACHE_MISSING_TTL,
+            path=path,
+        )
+
+    def open_snapshot(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+        with db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    election_id TEXT PRIMARY KEY,
+                    data TEXT,
+                    fetched_at REAL NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT
+                )
+                """
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)"
+            )
+            db.execute(
+                "DELETE FROM entries WHERE fetched_at < ?",
+                (time.time() - SNAPSHOT_MAX_AGE,),
+            )
+        self.meta = dict(db.execute("SELECT key, value FROM meta"))
+        return db
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_fresh(self, entry):
+        ttl = self.ttl if entry.data is not None else self.missing_ttl
+        return time.time() - entry.fetched_at < ttl
+
+    def get(self, election_id):
+        """
+        Returns the CacheEntry for an election, whether or not it's fresh,
+        or None if there isn't one
+        """
+        with self.lock:
+            entry = self.entries.get(election_id)
+            if entry is not None:
+                self.entries.move_to_end(election_id)
+                return entry
+            if not self.db:
+                return None
+            row = self.db.execute(
+                """
+                SELECT data, fetched_at, etag, last_modified
+                FROM entries WHERE election_id = ?
+                """,
+                (election_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        data, *rest = row
+        entry = CacheEntry(json.loads(data), *rest)
+        self.remember({election_id: entry})
+        return entry
+
+    def set(self, election_id, data, etag=None, last_modified=None):
+        entry = CacheEntry(data, time.time(), etag, last_modified)
+        self.set_entries({election_id: entry})
+        return entry
+
+    def set_many(self, data_by_election_id):
+        now = time.time()
+        self.set_entries(
+            {
+                election_id: CacheEntry(data, now)
+                for election_id, data in data_by_election_id.items()
+            }
+        )
+
+    def set_entries(self, entries):
+        self.remember(entries)
+        if not self.db:
+            return
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        election_id,
+                        json.dumps(entry.data),
+                        entry.fetched_at,
+                        entry.etag,
+                        entry.last_modified,
+                    )
+                    for election_id, entry in entries.items()
+                ],
+            )
+
+    def remember(self, entries):
+        """
+        Adds entries to the in memory cache, evicting the least recently
+        used ones if it's full
+        """
+        with self.lock:
+            for election_id, entry in entries.items():
+                self.entries[election_id] = entry
+                self.entries.move_to_end(election_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def touch(self, since, fetched_at):
+        """
+        Marks every entry fetched at or after `since` as if it was fetched
+        at `fetched_at`. Used once we know nothing has changed in EE since.
+        """
+        with self.lock:
+            for election_id, entry in list(self.entries.items()):
+                if entry.fetched_at >= since:
+                    self.entries[election_id] = entry._replace(
+                        fetched_at=fetched_at
+                    )
+            if not self.db:
+                return
+            with self.db:
+                self.db.execute(
+                    "UPDATE entries SET fetched_at = ? WHERE fetched_at >= ?",
+                    (fetched_at, since),
+                )
+
+    def get_meta(self, key):
+        return self.meta.get(key)
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+        if not self.db:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+            )
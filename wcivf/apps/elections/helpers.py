@@ -1,18 +1,38 @@
+import re
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import update_wrapper
 
+import ijson
 import requests
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.http import urlencode
+from elections.ee_cache import EECache
 from uk_election_timetables.calendars import Country
 from uk_election_timetables.election_ids import from_election_id
 
 
 class EEHelper:
-    ee_cache = {}
+    _ee_cache = None
+    # How far (in seconds) before the last prewarm to look for modified
+    # elections, to allow for clocks not agreeing
+    PREWARM_OVERLAP = 60 * 5
+
+    @property
+    def ee_cache(self):
+        """
+        The cache is shared by every instance, so that elections fetched
+        while importing ballots are reused when importing people
+        """
+        if EEHelper._ee_cache is None:
+            EEHelper._ee_cache = EECache.from_settings()
+        return EEHelper._ee_cache
 
     @property
     def base_elections_url(self):
@@ -24,9 +44,8 @@ class EEHelper:
     @cached_property
     def deleted_election_ids(self):
         """
-        Returns a generator object that retreives ids for elections that have
-        been deleted in Every Election. Accepts optional date arg, otherwise
-        defaults to objects with a Poll Open date within the last fifty days
+        Returns the ids of elections that have been deleted in Every Election,
+        with a Poll Open date within the last fifty days
         """
         params = {
             "deleted": 1,
@@ -36,91 +55,253 @@ class EEHelper:
         querystring = urlencode(params)
         url = f"{self.base_elections_url}?{querystring}"
         pages = JsonPaginator(page1=url, stdout=sys.stdout)
-        for page in pages:
-            return [result["election_id"] for result in page["results"]]
-        return None
+        return [
+            result["election_id"]
+            for page in pages
+            for result in page["results"]
+        ]
 
     @transaction.atomic
     def delete_deleted_elections(self):
         """
         Deletes Election and PostElection objects that were soft-deleted in
-        EveryElection
+        EveryElection. Returns the number of elections deleted, and the
+        number of ballots deleted either directly or with their election.
         """
         from elections.models import (
             Election,
             PostElection,
         )
 
+        deleted_ballots = PostElection.objects.filter(
+            Q(ballot_paper_id__in=self.deleted_election_ids)
+            | Q(election__slug__in=self.deleted_election_ids)
+        )
+        deleted_ballots.record_orphan_candidates()
+        deleted_ballots.record_changes()
+        post_elections_count = deleted_ballots.count()
+
         elections_count, _ = Election.objects.filter(
             slug__in=self.deleted_election_ids,
         ).delete()
 
-        post_elections_count, _ = PostElection.objects.filter(
+        PostElection.objects.filter(
             ballot_paper_id__in=self.deleted_election_ids,
         ).delete()
 
         return elections_count, post_elections_count
 
     def prewarm_cache(self, current=False):
+        """
+        Fills the cache with elections from EE, or only the current ones.
+
+        If that has been done before, by this process or one that left a
+        snapshot in EE_CACHE_DIR, only elections modified since then are
+        downloaded, and everything cached since then is marked as fresh.
+        """
+        scopes = ["all", "current"] if current else ["all"]
+        prewarmed_at = [
+            self.ee_cache.get_meta(f"prewarmed_at:{scope}") for scope in scopes
+        ]
+        since = max(filter(None, prewarmed_at), default=None)
+
+        started = time.time()
         page1 = self.base_elections_url
-        if current:
+        if since:
+            modified = timezone.datetime.fromtimestamp(
+                since - self.PREWARM_OVERLAP, tz=timezone.utc
+            )
+            page1 = f"{page1}?{urlencode({'modified': modified.isoformat()})}"
+        elif current:
             page1 = f"{page1}?current=True"
+
         pages = JsonPaginator(page1, sys.stdout)
         for page in pages:
-            for result in page["results"]:
-                self.ee_cache[result["election_id"]] = result
+            self.ee_cache.set_many(
+                {result["election_id"]: result for result in page["results"]}
+            )
+
+        if since:
+            self.ee_cache.touch(since=since, fetched_at=started)
+        self.ee_cache.set_meta(f"prewarmed_at:{scopes[-1]}", started)
 
     def get_data(self, election_id):
-        if election_id in self.ee_cache:
-            return self.ee_cache[election_id]
-        req = requests.get(f"{self.base_elections_url}{election_id}/")
+        """
+        Returns the EE data for an election, or None if EE doesn't know
+        about it. Cached data is revalidated with a conditional request once
+        it has expired.
+        """
+        entry = self.ee_cache.get(election_id)
+        if entry and self.ee_cache.is_fresh(entry):
+            return entry.data
+
+        headers = {}
+        if entry and entry.data is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        req = requests.get(
+            f"{self.base_elections_url}{election_id}/", headers=headers
+        )
+        if req.status_code == 304:
+            entry = self.ee_cache.set(
+                election_id, entry.data, entry.etag, entry.last_modified
+            )
+            return entry.data
         if req.status_code == 200:
-            self.ee_cache[election_id] = req.json()
-            return self.ee_cache[election_id]
-
-        self.ee_cache[election_id] = None
+            entry = self.ee_cache.set(
+                election_id,
+                req.json(),
+                etag=req.headers.get("ETag"),
+                last_modified=req.headers.get("Last-Modified"),
+            )
+            return entry.data
+        if req.status_code >= 500 and entry:
+            # Better to use what we had than nothing while EE is down
+            return entry.data
+
+        self.ee_cache.set(election_id, None)
         return None
 
-    def iter_recently_modified_election_ids(self):
-        params = {
-            "modified": timezone.datetime.now().date()
-            - timezone.timedelta(hours=1),
-        }
-        querystring = urlencode(params)
-        url = f"{self.base_elections_url}?{querystring}"
+    def iter_modified_elections(self, since, deleted=False):
+        """
+        Yields a list of the elections on each page of those modified in EE
+        since a datetime, or of those deleted since then if `deleted` is set.
+        Modified elections are added to the cache.
+        """
+        params = {"modified": since.isoformat()}
+        if deleted:
+            params["deleted"] = 1
+        url = f"{self.base_elections_url}?{urlencode(params)}"
         pages = JsonPaginator(page1=url, stdout=sys.stdout)
         for page in pages:
-            for result in page["results"]:
-                self.ee_cache[result["election_id"]] = result
-                if result["group_type"] == "election":
-                    continue
-                yield result["election_id"]
+            if not deleted:
+                self.ee_cache.set_many(
+                    {
+                        result["election_id"]: result
+                        for result in page["results"]
+                    }
+                )
+            yield page["results"]
 
 
 class JsonPaginator:
-    def __init__(self, page1, stdout):
+    """
+    Iterates over the pages of a paginated JSON API, following the `next`
+    URL in each page.
+
+    If `prefetch` is set and the page URLs end in a page number, like the
+    files in YNR's cached API, up to that many of the following pages are
+    downloaded on a thread pool while the current page is being processed.
+    Pages are still yielded in order, and a downloaded page is only used if
+    the previous page's `next` URL points to it.
+    """
+
+    def __init__(self, page1, stdout, prefetch=0):
         self.next_page = page1
         self.stdout = stdout
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        if not self.prefetch:
+            while self.next_page:
+                self.stdout.write(f"{self.next_page}\n")
+                yield self.get_data(requests.get(self.next_page))
+            return
+
+        yield from self.iter_prefetched()
+
+    def iter_prefetched(self):
+        executor = ThreadPoolExecutor(max_workers=self.prefetch)
+        # (url, future) pairs in page order. Holds at most prefetch + 1
+        # pages, to bound how many responses are held in memory at once
+        pending = deque()
+        try:
+            while self.next_page:
+                if not pending or pending[0][0] != self.next_page:
+                    # the next page isn't the one predicted, so start again
+                    # from the URL given to us
+                    for _, future in pending:
+                        future.cancel()
+                    pending.clear()
+                    pending.append(
+                        (
+                            self.next_page,
+                            executor.submit(requests.get, self.next_page),
+                        )
+                    )
+
+                while len(pending) <= self.prefetch:
+                    url = self.predict_next_page(pending[-1][0])
+                    if not url:
+                        break
+                    pending.append((url, executor.submit(requests.get, url)))
+
+                url, future = pending.popleft()
+                self.stdout.write(f"{url}\n")
+                yield self.get_data(future.result())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def predict_next_page(self, url):
+        """
+        Returns the URL of the JSON file with the next page number, or None
+        if the URL isn't for a numbered JSON file
+        """
+        match = re.search(r"(\d+)\.json$", url)
+        if not match:
+            return None
+        number = match.group(1)
+        next_number = str(int(number) + 1).zfill(len(number))
+        return f"{url[: match.start(1)]}{next_number}{url[match.end(1) :]}"
+
+    def get_data(self, r):
+        if r.status_code != 200:
+            self.stdout.write("crashing with response:")
+            self.stdout.write(r.text)
+        r.raise_for_status()
+        data = r.json()
+
+        try:
+            self.next_page = data["next"]
+        except KeyError:
+            self.next_page = None
+
+        return data
+
+
+class StreamingJsonPaginator(JsonPaginator):
+    """
+    Iterates over the items in the `results` of each page of a paginated
+    JSON API. Responses are parsed incrementally as they are downloaded,
+    so only a single result is held in memory at a time, however big the
+    pages are.
+    """
 
     def __iter__(self):
         while self.next_page:
             self.stdout.write(f"{self.next_page}\n")
-
-            r = requests.get(self.next_page)
-            if r.status_code != 200:
-                self.stdout.write("crashing with response:")
-                self.stdout.write(r.text)
-            r.raise_for_status()
-            data = r.json()
-
-            try:
-                self.next_page = data["next"]
-            except KeyError:
+            with requests.get(self.next_page, stream=True) as r:
+                if r.status_code != 200:
+                    self.stdout.write("crashing with response:")
+                    self.stdout.write(r.text)
+                r.raise_for_status()
+                # transparently decompress gzipped responses
+                r.raw.decode_content = True
                 self.next_page = None
+                yield from ijson.items(self.parse_events(r.raw), "results.item")
 
-            yield data
-
-        return
+    def parse_events(self, stream):
+        """
+        Passes on the parser events for the stream, picking out the URL of
+        the next page wherever it appears in the page
+        """
+        for prefix, event, value in ijson.parse(stream, use_float=True):
+            if prefix == "next":
+                self.next_page = value
+            yield prefix, event, value
 
 
 class ElectionIDSwitcher:
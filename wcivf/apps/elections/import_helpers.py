@@ -1,16 +1,37 @@
-import contextlib
 import re
 import sys
+from datetime import timedelta
 from urllib.parse import urlencode
 
+from core.helpers import set_changed_fields
+from core.models import OrphanCandidate
+from core.orphans import delete_orphans
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from elections.devs_dc_client import invalidate_postcode_lookups
 from elections.helpers import EEHelper, JsonPaginator
-from elections.models import Election, Post, PostElection, VotingSystem
+from elections.models import (
+    BallotChange,
+    Election,
+    Post,
+    PostElection,
+    SyncCursor,
+    VotingSystem,
+)
 from parties.models import Party
 from people.models import Person, PersonPost
 
+# The SyncCursor for changes to elections in EE
+EE_CHANGES_CURSOR_NAME = "ee-elections"
+# How far back to look for changes the first time, when there's no cursor
+EE_CHANGES_FIRST_SYNC = timedelta(hours=1)
+# Changes from a little before the cursor are applied again, to allow for
+# clocks not agreeing
+EE_CHANGES_OVERLAP = timedelta(minutes=5)
+
 
 def time_function_length(func):
     """
@@ -90,6 +111,11 @@ class YNRElectionImporter:
         election_weight = self.ballot_order(ballot_dict)
         if slug not in self.election_cache:
             election_type = slug.split(".")[0]
+            uses_lists = (
+                Election.objects.filter(slug=slug)
+                .values_list("uses_lists", flat=True)
+                .first()
+            )
 
             election, created = Election.objects.update_or_create(
                 slug=slug,
@@ -102,10 +128,20 @@ class YNRElectionImporter:
                     "uses_lists": ballot_dict["election"]["party_lists_in_use"],
                 },
             )
+            if not created and election.uses_lists != uses_lists:
+                # the order of the candidates on every ballot, and how
+                # they're counted, depend on this
+                ballots = PostElection.objects.filter(election=election)
+                ballots.update(modified=timezone.now())
+                ballots.record_changes()
+                ballots.build_cards()
             self.import_metadata_from_ee(election)
             self.election_cache[election.slug] = election
         return self.election_cache[slug]
 
+    # The stored fields import_metadata_from_ee can change
+    METADATA_FIELDS = ["metadata", "description", "voting_system_id"]
+
     def import_metadata_from_ee(self, election):
         """
         There are various things we don't have in YNR, have in EE and want here
@@ -114,26 +150,24 @@ class YNRElectionImporter:
         """
         ee_data = self.ee_helper.get_data(election.slug)
         if ee_data:
-            updated = False
+            before = [
+                getattr(election, field) for field in self.METADATA_FIELDS
+            ]
             metadata = ee_data["metadata"]
             if metadata:
                 election.metadata = metadata
-                updated = True
 
             description = ee_data["explanation"]
             if description:
                 election.description = description
-                updated = True
 
             requires_voter_id = ee_data["requires_voter_id"]
             if requires_voter_id:
                 election.requires_voter_id = requires_voter_id
-                updated = True
 
             cancellation_reason = ee_data["cancellation_reason"]
             if cancellation_reason:
                 election.cancellation_reason = cancellation_reason
-                updated = True
 
             voting_system = ee_data["voting_system"]
             if voting_system:
@@ -141,10 +175,16 @@ class YNRElectionImporter:
                     slug=voting_system["slug"],
                     defaults={"name": voting_system["name"]},
                 )[0]
-                updated = True
 
-            if updated:
+            if [
+                getattr(election, field) for field in self.METADATA_FIELDS
+            ] != before:
                 election.save()
+                # these are shown with every ballot in the election
+                ballots = PostElection.objects.filter(election=election)
+                ballots.update(modified=timezone.now())
+                ballots.record_changes()
+                ballots.build_cards()
 
 
 class YNRPostImporter:
@@ -154,9 +194,50 @@ class YNRPostImporter:
         self.ee_helper = ee_helper
         self.post_cache = {}
 
-    def update_or_create_from_ballot_dict(self, ballot_dict):
+    def get_post_id(self, ballot_dict):
         # fall back to slug here as some temp ballots don't have an ID set
-        post_id = ballot_dict["post"]["id"] or ballot_dict["post"]["slug"]
+        return ballot_dict["post"]["id"] or ballot_dict["post"]["slug"]
+
+    def update_or_create_from_ballot_dicts(self, ballot_dicts):
+        """
+        Creates or updates the posts for a list of ballots from YNR in bulk,
+        only writing posts that are new or have a changed label, and adds
+        them all to the cache
+        """
+        labels = {}
+        for ballot_dict in ballot_dicts:
+            post_id = self.get_post_id(ballot_dict)
+            if post_id and post_id not in self.post_cache:
+                labels[post_id] = ballot_dict["post"]["label"]
+        if not labels:
+            return
+
+        posts = Post.objects.in_bulk(list(labels))
+        to_write = []
+        relabelled = []
+        for post_id, label in labels.items():
+            post = posts.get(post_id) or Post(ynr_id=post_id)
+            if post._state.adding or post.label != label:
+                if not post._state.adding:
+                    relabelled.append(post_id)
+                post.label = label
+                to_write.append(post)
+            self.post_cache[post_id] = post
+        Post.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=["ynr_id"],
+            update_fields=["label"],
+        )
+        if relabelled:
+            # the label is shown with, and in the URL of, each ballot
+            ballots = PostElection.objects.filter(post__in=relabelled)
+            ballots.update(modified=timezone.now())
+            ballots.record_changes()
+            ballots.build_cards()
+
+    def update_or_create_from_ballot_dict(self, ballot_dict):
+        post_id = self.get_post_id(ballot_dict)
         if not post_id:
             # if no id to use return None to indicate to skip this ballot
             return None
@@ -208,10 +289,20 @@ class YNRBallotImporter:
         self.base_url = base_url or settings.YNR_BASE
         self.api_key = api_key or settings.YNR_API_KEY
         self.default_params = default_params or {"page_size": 200}
+        # set when a ballot is added, meaning cached postcode lookups may
+        # no longer list every ballot for that postcode
+        self.new_ballots_added = False
+        # ballot_paper_ids of ballots replaced by ballots in this import,
+        # and the primary keys of the ballots that replace them
+        self.replaced_ballot_ids = {}
+        # cancelled ballots in this import to find the replacements for
+        self.cancelled_ballot_ids = set()
 
     @time_function_length
     def get_paginator(self, page1):
-        return JsonPaginator(page1, self.stdout)
+        return JsonPaginator(
+            page1, self.stdout, prefetch=settings.IMPORT_PREFETCH_PAGES
+        )
 
     @time_function_length
     def get_last_updated(self):
@@ -296,6 +387,9 @@ class YNRBallotImporter:
         for page in pages:
             self.add_ballots(page)
 
+        if self.recently_updated:
+            self.link_replaced_ballots()
+
         if self.should_run_post_ballot_import_tasks:
             self.attach_cancelled_ballot_info()
 
@@ -304,37 +398,63 @@ class YNRBallotImporter:
 
         self.delete_orphan_posts()
 
+        if self.new_ballots_added:
+            invalidate_postcode_lookups()
+
     @time_function_length
     def delete_orphan_posts(self):
         """
-        This method cleans orphan posts.
+        Deletes the posts this or earlier imports left without any ballots.
         This typically gets called at the end of the import process.
         """
-        return Post.objects.filter(postelection=None).delete()
+        count = delete_orphans(OrphanCandidate.POST)
+        self.stdout.write(f"Deleted {count} orphaned Post objects\n")
+        return count
 
-    def add_replaced_ballot(self, ballot, replaced_ballot_id):
+    def link_replaced_ballots(self):
         """
-        Takes a ballot object and a ballot_paper_id for a ballot that
-        has been replaced. If the replaced ballot is found, adds this
-        relationship. Explicity return True or False to represent if
-        the lookup was a success and help with testing.
+        Sets replaced_by on the ballots replaced by those in this import,
+        with one query to find them and one to update those that changed
         """
-        if not replaced_ballot_id:
-            return False
-
-        try:
-            replaced_ballot = PostElection.objects.get(
-                ballot_paper_id=replaced_ballot_id,
-            )
-        except PostElection.DoesNotExist:
-            return False
-
-        ballot.replaces.add(replaced_ballot)
-        return True
+        if not self.replaced_ballot_ids:
+            return
+        replaced_ballots = PostElection.objects.filter(
+            ballot_paper_id__in=list(self.replaced_ballot_ids)
+        ).only("ballot_paper_id", "replaced_by_id")
+        changed = []
+        now = timezone.now()
+        for replaced_ballot in replaced_ballots:
+            replaced_by_id = self.replaced_ballot_ids[
+                replaced_ballot.ballot_paper_id
+            ]
+            if replaced_ballot.replaced_by_id != replaced_by_id:
+                replaced_ballot.replaced_by_id = replaced_by_id
+                replaced_ballot.modified = now
+                changed.append(replaced_ballot)
+        PostElection.objects.bulk_update(
+            changed, ["replaced_by", "modified"], batch_size=500
+        )
+        BallotChange.objects.record(
+            ballot.ballot_paper_id for ballot in changed
+        )
 
     @time_function_length
     @transaction.atomic()
     def add_ballots(self, results):
+        """
+        Creates or updates the ballots in a page of results from YNR, along
+        with their candidacies.
+
+        Existing rows for the whole page are fetched up front and only new
+        or changed rows are written, in bulk, so the number of queries made
+        doesn't grow with the number of ballots or candidates on the page.
+        """
+        self.post_importer.update_or_create_from_ballot_dicts(
+            results["results"]
+        )
+
+        ballot_dicts = {}
+        ballot_values = {}
         for ballot_dict in results["results"]:
             print(ballot_dict["ballot_paper_id"])
 
@@ -349,27 +469,95 @@ class YNRBallotImporter:
                 # cant create a ballot without a post so skip to the next one
                 continue
 
-            defaults = {
-                "election": election,
-                "post": post,
-                "winner_count": ballot_dict["winner_count"] or 1,
-                "cancelled": ballot_dict["cancelled"],
-                "locked": ballot_dict["candidates_locked"],
-            }
+            ballot_paper_id = ballot_dict["ballot_paper_id"]
+            ballot_dicts[ballot_paper_id] = ballot_dict
+            ballot_values[ballot_paper_id] = self.get_ballot_values(
+                ballot_dict, election=election, post=post
+            )
 
-            if (
-                ballot_dict["candidates_locked"] or ballot_dict["cancelled"]
-            ) and ballot_dict["winner_count"]:
-                defaults["contested"] = not ballot_dict["uncontested"]
+        ballots, created_ids, written_ids = self.update_or_create_ballots(
+            ballot_values
+        )
+        BallotChange.objects.record(written_ids)
+
+        if not self.exclude_candidacies:
+            changed_ballot_ids = self.update_candidacies(ballots, ballot_dicts)
+            if changed_ballot_ids:
+                # changes to candidacies count as changes to the ballot
+                changed_ballots = PostElection.objects.filter(
+                    pk__in=changed_ballot_ids
+                )
+                changed_ballots.update(modified=timezone.now())
+                changed_ballots.record_changes()
+                # worked out here, once per ballot, so that results pages
+                # don't need to
+                PersonPost.objects.filter(
+                    post_election_id__in=changed_ballot_ids
+                ).update_result_ranks()
+
+        for ballot_paper_id, ballot in ballots.items():
+            replaced_ballot_id = ballot_dicts[ballot_paper_id].get("replaces")
+            if self.recently_updated and replaced_ballot_id:
+                # linked by link_replaced_ballots once every page has been
+                # imported, as the replaced ballot could be on a later page
+                self.replaced_ballot_ids[replaced_ballot_id] = ballot.pk
+
+            # cancelled ballots that haven't changed, in past elections,
+            # were already checked by an earlier import
+            if ballot.cancelled and (
+                ballot_paper_id in written_ids
+                or ballot.election.current
+                or self.force_metadata
+            ):
+                self.cancelled_ballot_ids.add(ballot.pk)
+
+            if ballot_paper_id in created_ids:
+                self.new_ballots_added = True
+                self.stdout.write(
+                    "Added new ballot: {0}".format(ballot.ballot_paper_id)
+                )
 
-            # only update this when using the recently_updated flag as otherwise
-            # the timestamp will only be the modifed timestamp on the ballot
-            # see BallotSerializer.get_last_updated in YNR
-            if self.recently_updated:
-                defaults["ynr_modified"] = ballot_dict["last_updated"]
+        ballots_for_metadata = [
+            ballot
+            for ballot in ballots.values()
+            if ballot.election.current or self.force_metadata
+        ]
+        if ballots_for_metadata:
+            self.import_metadata_from_ee_for_ballots(ballots_for_metadata)
+
+        # other ballots for the same posts are included, as a new ballot can
+        # change what they show as the next ballot
+        PostElection.objects.filter(
+            post__in={ballot.post_id for ballot in ballots.values()}
+        ).build_cards()
+
+    def get_ballot_values(self, ballot_dict, election, post):
+        """
+        Returns a dict of the field values for a ballot in YNR, keyed by
+        attribute name
+        """
+        values = {
+            "election_id": election.pk,
+            "post_id": post.pk,
+            "winner_count": ballot_dict["winner_count"] or 1,
+            "cancelled": ballot_dict["cancelled"],
+            "locked": ballot_dict["candidates_locked"],
+        }
 
-            if ballot_dict["results"]:
-                results_defaults = {
+        if (
+            ballot_dict["candidates_locked"] or ballot_dict["cancelled"]
+        ) and ballot_dict["winner_count"]:
+            values["contested"] = not ballot_dict["uncontested"]
+
+        # only update this when using the recently_updated flag as otherwise
+        # the timestamp will only be the modifed timestamp on the ballot
+        # see BallotSerializer.get_last_updated in YNR
+        if self.recently_updated:
+            values["ynr_modified"] = ballot_dict["last_updated"]
+
+        if ballot_dict["results"]:
+            values.update(
+                {
                     "ballot_papers_issued": ballot_dict["results"][
                         "num_turnout_reported"
                     ],
@@ -379,88 +567,319 @@ class YNRBallotImporter:
                         "num_spoilt_ballots"
                     ],
                 }
+            )
+        return values
 
-                defaults = {**defaults, **results_defaults}
+    def update_or_create_ballots(self, ballot_values):
+        """
+        Takes a dict of ballot field values keyed by ballot_paper_id and
+        upserts the ballots that are new or have changed in a single query.
 
-            ballot, created = PostElection.objects.update_or_create(
-                ballot_paper_id=ballot_dict["ballot_paper_id"],
-                defaults=defaults,
+        Returns a dict of all the ballots keyed by ballot_paper_id, the set
+        of ballot_paper_ids that were created, and the set of those that
+        were created or changed.
+        """
+        ballots = PostElection.objects.select_related(
+            "election", "post"
+        ).in_bulk(list(ballot_values), field_name="ballot_paper_id")
+
+        to_write = []
+        update_fields = {"modified"}
+        created_ids = set()
+        moved_from_post_ids = set()
+        for ballot_paper_id, values in ballot_values.items():
+            # fields not in the values for this ballot keep their current
+            # value, or the default for new ballots
+            update_fields.update(values)
+            ballot = ballots.get(ballot_paper_id)
+            if not ballot:
+                ballot = PostElection(ballot_paper_id=ballot_paper_id)
+                created_ids.add(ballot_paper_id)
+            elif ballot.post_id != values["post_id"]:
+                moved_from_post_ids.add(ballot.post_id)
+            if set_changed_fields(ballot, values) or not ballot.pk:
+                to_write.append(ballot)
+
+        OrphanCandidate.objects.record(
+            OrphanCandidate.POST, moved_from_post_ids
+        )
+        written_ids = {ballot.ballot_paper_id for ballot in to_write}
+        if not to_write:
+            return ballots, created_ids, written_ids
+
+        PostElection.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=["ballot_paper_id"],
+            update_fields=sorted(update_fields),
+        )
+        if created_ids:
+            # bulk_create doesn't set primary keys when updating conflicts
+            ballots.update(
+                PostElection.objects.select_related("election", "post").in_bulk(
+                    list(created_ids), field_name="ballot_paper_id"
+                )
             )
+        return ballots, created_ids, written_ids
 
-            if self.recently_updated:
-                # we can do this as the older ballot will be known.
-                # if the ballot is does not replace another ballot,
-                # nothing happens
-                self.add_replaced_ballot(
-                    ballot=ballot,
-                    replaced_ballot_id=ballot_dict.get("replaces"),
-                )
+    def update_or_create_people(self, names):
+        """
+        Takes a dict of names keyed by YNR person ID and creates any
+        people that don't exist, or updates those whose name has changed
+        """
+        existing = dict(
+            Person.objects.filter(pk__in=list(names)).values_list("pk", "name")
+        )
+        people = [
+            Person(ynr_id=person_id, name=name)
+            for person_id, name in names.items()
+            if existing.get(person_id) != name
+        ]
+        Person.objects.bulk_create(
+            people,
+            update_conflicts=True,
+            unique_fields=["ynr_id"],
+            update_fields=["name"],
+        )
 
-            if ballot.election.current or self.force_metadata:
-                self.import_metadata_from_ee(ballot)
-
-            if not self.exclude_candidacies:
-                # Now set the nominations up for this ballot
-                # First, remove any old candidates, this is to flush out candidates
-                # that have changed. We just delete the `person_post`
-                # (`membership` in YNR), not the person profile.
-                ballot.personpost_set.all().delete()
-                for candidate in ballot_dict["candidacies"]:
-                    person, person_created = Person.objects.update_or_create(
-                        ynr_id=candidate["person"]["id"],
-                        defaults={"name": candidate["person"]["name"]},
-                    )
-                    result = candidate["result"] or {}
-                    # if we dont have a result, get the "elected" value from
-                    # the main candidacy data
-                    elected = result.get("elected", candidate["elected"])
-                    person_post = PersonPost.objects.create(
-                        post_election=ballot,
-                        person=person,
-                        party_id=candidate["party"]["legacy_slug"],
-                        party_name=candidate["party_name"],
-                        party_description_text=candidate[
-                            "party_description_text"
-                        ],
-                        list_position=candidate["party_list_position"],
-                        deselected=candidate["deselected"],
-                        deselected_source=candidate["deselected_source"],
-                        elected=elected,
-                        votes_cast=result.get("num_ballots", None),
-                        post=ballot.post,
-                        election=ballot.election,
-                    )
+    def get_candidacy_values(self, ballot, candidate):
+        """
+        Returns a dict of the field values for a candidacy in YNR, keyed by
+        attribute name
+        """
+        result = candidate["result"] or {}
+        return {
+            "post_id": ballot.post_id,
+            "election_id": ballot.election_id,
+            "party_id": candidate["party"]["legacy_slug"],
+            "party_name": candidate["party_name"],
+            "party_description_text": candidate["party_description_text"],
+            "list_position": candidate["party_list_position"],
+            "deselected": candidate["deselected"],
+            "deselected_source": candidate["deselected_source"],
+            # if we dont have a result, get the "elected" value from
+            # the main candidacy data
+            "elected": result.get("elected", candidate["elected"]),
+            "votes_cast": result.get("num_ballots", None),
+        }
+
+    def update_candidacies(self, ballots, ballot_dicts):
+        """
+        Makes the candidacies (`PersonPost`, or `membership` in YNR) and
+        their previous party affiliations for a page of ballots match those
+        in YNR. Candidacies that are no longer in YNR are deleted, but not
+        the person profile.
+
+        Returns the set of IDs of ballots with candidacies that changed.
+        """
+        ballot_ids = [ballot.pk for ballot in ballots.values()]
+        existing = {
+            (person_post.person_id, person_post.post_election_id): person_post
+            for person_post in PersonPost.objects.filter(
+                post_election_id__in=ballot_ids
+            )
+        }
+        Affiliation = PersonPost.previous_party_affiliations.through
+        existing_affiliations = {
+            (person_post_id, party_id): pk
+            for pk, person_post_id, party_id in Affiliation.objects.filter(
+                personpost__post_election_id__in=ballot_ids
+            ).values_list("pk", "personpost_id", "party_id")
+        }
+
+        names = {}
+        candidacies = {}
+        affiliations = {}
+        for ballot_paper_id, ballot_dict in ballot_dicts.items():
+            ballot = ballots[ballot_paper_id]
+            for candidate in ballot_dict["candidacies"]:
+                person_id = int(candidate["person"]["id"])
+                names[person_id] = candidate["person"]["name"]
+                key = (person_id, ballot.pk)
+                values = self.get_candidacy_values(ballot, candidate)
+                candidacies[key] = values
+                # skip previous party affiliations that are the same as the
+                # party on the candidacy
+                affiliations[key] = {
+                    party["legacy_slug"]
                     for party in candidate.get(
                         "previous_party_affiliations", []
-                    ):
-                        # if the previous party affiliation is the
-                        # same as the party on the candidacy skip it
-                        party_id = party["legacy_slug"]
-                        if party_id == person_post.party_id:
-                            continue
-
-                        try:
-                            party = Party.objects.get(party_id=party_id)
-                        except Party.DoesNotExist:
-                            continue
-                        person_post.previous_party_affiliations.add(party)
-
-            if created:
-                self.stdout.write(
-                    "Added new ballot: {0}".format(ballot.ballot_paper_id)
+                    )
+                } - {values["party_id"]}
+
+        self.update_or_create_people(names)
+
+        changed_ballot_ids = set()
+        removed = {
+            person_post.pk: key[1]
+            for key, person_post in existing.items()
+            if key not in candidacies
+        }
+        if removed:
+            PersonPost.objects.filter(pk__in=list(removed)).delete()
+            changed_ballot_ids.update(removed.values())
+            OrphanCandidate.objects.record(
+                OrphanCandidate.PERSON,
+                [key[0] for key in existing if key not in candidacies],
+            )
+
+        new = []
+        changed = []
+        changed_fields = set()
+        for key, values in candidacies.items():
+            person_post = existing.get(key)
+            if not person_post:
+                person_post = PersonPost(
+                    person_id=key[0], post_election_id=key[1], **values
                 )
+                existing[key] = person_post
+                new.append(person_post)
+                changed_ballot_ids.add(key[1])
+                continue
+            fields = set_changed_fields(person_post, values)
+            if fields:
+                changed.append(person_post)
+                changed_fields.update(fields)
+                changed_ballot_ids.add(key[1])
+        PersonPost.objects.bulk_create(new)
+        if changed:
+            PersonPost.objects.bulk_update(changed, sorted(changed_fields))
+
+        party_ids = set().union(*affiliations.values())
+        known_party_ids = set(
+            Party.objects.filter(party_id__in=party_ids).values_list(
+                "party_id", flat=True
+            )
+        )
+        wanted = {}
+        for key, party_ids in affiliations.items():
+            for party_id in party_ids & known_party_ids:
+                wanted[(existing[key].pk, party_id)] = key[1]
+        stale = [pair for pair in existing_affiliations if pair not in wanted]
+        if stale:
+            Affiliation.objects.filter(
+                pk__in=[existing_affiliations[pair] for pair in stale]
+            ).delete()
+            ballot_ids_by_person_post = {
+                person_post.pk: key[1] for key, person_post in existing.items()
+            }
+            changed_ballot_ids.update(
+                ballot_ids_by_person_post[person_post_id]
+                for person_post_id, _ in stale
+            )
+        added = [pair for pair in wanted if pair not in existing_affiliations]
+        Affiliation.objects.bulk_create(
+            [
+                Affiliation(personpost_id=person_post_id, party_id=party_id)
+                for person_post_id, party_id in added
+            ]
+        )
+        changed_ballot_ids.update(wanted[pair] for pair in added)
+        return changed_ballot_ids
+
+    # The fields the set_* methods below can change
+    BALLOT_METADATA_FIELDS = [
+        "voting_system_id",
+        "metadata",
+        "requires_voter_id",
+        "cancellation_reason",
+    ]
+    POST_METADATA_FIELDS = ["territory", "organization_type", "division_type"]
 
     def import_metadata_from_ee(self, ballot):
-        # First, grab the data from EE
+        self.import_metadata_from_ee_for_ballots([ballot])
+
+    def import_metadata_from_ee_for_ballots(self, ballots):
+        """
+        Sets the fields on each ballot, and its post, that come from EE.
+
+        The set_* methods only change the objects in memory. Once they have
+        run for every ballot, the fields that changed are written with one
+        bulk_update for the ballots and one for the posts.
+        """
+        changed_ballots = {}
+        ballot_fields = set()
+        changed_posts = {}
+        post_fields = set()
+        for ballot in ballots:
+            ballot_before = [
+                getattr(ballot, field) for field in self.BALLOT_METADATA_FIELDS
+            ]
+            post_before = [
+                getattr(ballot.post, field)
+                for field in self.POST_METADATA_FIELDS
+            ]
 
-        self.set_territory(ballot)
-        self.set_voting_system(ballot)
-        self.set_metadata(ballot)
-        self.set_requires_voter_id(ballot)
-        self.set_cancellation_reason(ballot)
-        self.set_organisation_type(ballot)
-        self.set_division_type(ballot)
-        ballot.save()
+            self.set_territory(ballot)
+            self.set_voting_system(ballot)
+            self.set_metadata(ballot)
+            self.set_requires_voter_id(ballot)
+            self.set_cancellation_reason(ballot)
+            self.set_organisation_type(ballot)
+            self.set_division_type(ballot)
+
+            for field, before in zip(
+                self.BALLOT_METADATA_FIELDS, ballot_before
+            ):
+                if getattr(ballot, field) != before:
+                    changed_ballots[ballot.pk] = ballot
+                    ballot_fields.add(field)
+            for field, before in zip(self.POST_METADATA_FIELDS, post_before):
+                if getattr(ballot.post, field) != before:
+                    changed_posts[ballot.post.pk] = ballot.post
+                    post_fields.add(field)
+                    # the post is shown with the ballot
+                    changed_ballots[ballot.pk] = ballot
+
+        if "division_type" in post_fields:
+            self.validate_division_types(changed_posts.values())
+
+        if changed_posts:
+            Post.objects.bulk_update(
+                list(changed_posts.values()), sorted(post_fields)
+            )
+        if changed_ballots:
+            # bulk_update doesn't set modified like save() does
+            now = timezone.now()
+            for ballot in changed_ballots.values():
+                ballot.modified = now
+            PostElection.objects.bulk_update(
+                list(changed_ballots.values()),
+                sorted(ballot_fields | {"modified"}),
+            )
+            BallotChange.objects.record(
+                ballot.ballot_paper_id for ballot in changed_ballots.values()
+            )
+        if changed_posts:
+            # the posts are shown with their other ballots too
+            other_ballots = PostElection.objects.filter(
+                post__in=list(changed_posts)
+            ).exclude(pk__in=list(changed_ballots))
+            if other_ballots.update(modified=timezone.now()):
+                other_ballots.record_changes()
+                other_ballots.build_cards()
+
+    def validate_division_types(self, posts):
+        """
+        Raises a ValidationError if any of the posts have a division_type
+        that isn't one of the choices
+        """
+        valid = {""} | {choice for choice, _ in Post.DIVISION_TYPE_CHOICES}
+        invalid = {
+            post.ynr_id: post.division_type
+            for post in posts
+            if post.division_type not in valid
+        }
+        if invalid:
+            raise ValidationError(
+                {
+                    "division_type": [
+                        f"{division_type!r} is not a valid division type "
+                        f"for {ynr_id}"
+                        for ynr_id, division_type in invalid.items()
+                    ]
+                }
+            )
 
     def set_territory(self, ballot):
         if ballot.post.territory and not self.force_update:
@@ -477,7 +896,6 @@ class YNRBallotImporter:
             territory = "-"
 
         ballot.post.territory = territory
-        ballot.post.save()
 
     def set_voting_system(self, ballot):
         if ballot.voting_system_id and not self.force_update:
@@ -493,7 +911,6 @@ class YNRBallotImporter:
                 self.voting_systems[voting_system_slug] = voting_system
 
             ballot.voting_system = self.voting_systems[voting_system_slug]
-            ballot.save()
 
     def set_metadata(self, ballot):
         if (
@@ -512,7 +929,6 @@ class YNRBallotImporter:
         ee_data = self.ee_helper.get_data(ballot.ballot_paper_id)
         if ee_data:
             ballot.requires_voter_id = ee_data["requires_voter_id"]
-            ballot.save()
 
     def set_cancellation_reason(self, ballot):
         if ballot.cancellation_reason and not self.force_update:
@@ -520,7 +936,6 @@ class YNRBallotImporter:
         ee_data = self.ee_helper.get_data(ballot.ballot_paper_id)
         if ee_data:
             ballot.cancellation_reason = ee_data["cancellation_reason"]
-            ballot.save()
 
     def set_organisation_type(self, ballot):
         if ballot.post.organization_type and not self.force_update:
@@ -530,11 +945,11 @@ class YNRBallotImporter:
             ballot.post.organization_type = ee_data["organisation"][
                 "organisation_type"
             ]
-            ballot.post.save()
 
     def set_division_type(self, ballot):
         """
-        Attempts to set the division_type field from EveryElection
+        Attempts to set the division_type field from EveryElection. It's
+        validated by import_metadata_from_ee_for_ballots before it's saved.
         """
         if ballot.post.division_type and not self.force_update:
             return
@@ -545,81 +960,145 @@ class YNRBallotImporter:
             return
 
         ballot.post.division_type = ee_data["division"].get("division_type")
-        # ensures the division_type is valid, or will raise a ValidationError
-        ballot.post.full_clean()
-        ballot.post.save()
 
-    def get_replacement_ballot(self, ballot_id):
-        replacement_ballot = None
-        ee_data = self.ee_helper.get_data(ballot_id)
-        if ee_data:
-            replacement_ballot_id = ee_data["replaced_by"]
-            if replacement_ballot_id:
-                with contextlib.suppress(PostElection.DoesNotExist):
-                    replacement_ballot = PostElection.objects.get(
-                        ballot_paper_id=replacement_ballot_id
-                    )
+    def attach_cancelled_ballot_info(self):
+        """
+        Links the cancelled ballots in this import to the ballots EE says
+        replace them, and updates their metadata. This is done once every
+        page has been imported, so that both ballots exist.
 
-        return replacement_ballot
+        The replacements are found with one query, and only the ballots
+        that changed are written, with a bulk_update.
+        """
+        cancelled_ballots = list(
+            PostElection.objects.filter(pk__in=self.cancelled_ballot_ids)
+        )
+        ee_data = {
+            ballot.pk: self.ee_helper.get_data(ballot.ballot_paper_id)
+            for ballot in cancelled_ballots
+        }
+        replacement_ids = dict(
+            PostElection.objects.filter(
+                ballot_paper_id__in={
+                    data["replaced_by"]
+                    for data in ee_data.values()
+                    if data and data["replaced_by"]
+                }
+            ).values_list("ballot_paper_id", "pk")
+        )
 
-    def attach_cancelled_ballot_info(self):
-        # we need to do this as a post-process instead of in the manager
-        # because if we're going to link 2 PostElection objects together
-        # we need to be sure that both of them already exist in our DB
-        cancelled_ballots = PostElection.objects.filter(cancelled=True)
-        if self.current_only:
-            cancelled_ballots = cancelled_ballots.filter(election__current=True)
-        for cb in cancelled_ballots:
-            cb.replaced_by = self.get_replacement_ballot(cb.ballot_paper_id)
+        changed = []
+        now = timezone.now()
+        for ballot in cancelled_ballots:
+            before = (ballot.replaced_by_id, ballot.metadata)
+            data = ee_data[ballot.pk]
+            ballot.replaced_by_id = (
+                replacement_ids.get(data["replaced_by"]) if data else None
+            )
             # Always get metadata, even if we might have it already.
             # This is because is self.force_update is False, it might not have
             # been imported already
-            self.set_metadata(cb)
-            cb.save()
+            self.set_metadata(ballot)
+            if (ballot.replaced_by_id, ballot.metadata) != before:
+                ballot.modified = now
+                changed.append(ballot)
+        PostElection.objects.bulk_update(
+            changed, ["replaced_by", "metadata", "modified"], batch_size=500
+        )
+        BallotChange.objects.record(
+            ballot.ballot_paper_id for ballot in changed
+        )
+        PostElection.objects.filter(
+            pk__in=[ballot.pk for ballot in changed]
+        ).build_cards()
 
     def check_for_ee_updates(self):
-        print("checking for recently updated EE")
-        elections_with_children = set()
-        for election_id in self.ee_helper.iter_recently_modified_election_ids():
-            print(election_id)
-            if self.ee_helper.ee_cache[election_id]["group_type"]:
-                # Only the ones with group_type == "organisation" match Election objects in WCIVF directly
-                if (
-                    self.ee_helper.ee_cache[election_id]["group_type"]
-                    == "organisation"
-                ):
-                    election = Election.objects.get(slug=election_id)
-                    print(
-                        f"importing metadata from EE for Election: {election}"
-                    )
-                    self.election_importer.import_metadata_from_ee(election)
-                # for those that any other group_type, we need to get the children and try to match an Election
-                else:
-                    elections_with_children.add(election_id)
-            # if there is no group_type, the election_id is for a PostElection object, and possibly
-            # an Election object as well as is the case with pcc.<region>.2024-05-02, for example
-            # it's possible the Election update is covered in the previous else block,
-            # but try here as well to be sure
-            else:
-                ballot = PostElection.objects.get(ballot_paper_id=election_id)
-                print(f"importing metadata from EE for PostElection: {ballot}")
-                self.import_metadata_from_ee(ballot)
-                try:
-                    election = Election.objects.get(slug=election_id)
-                    print(
-                        f"importing metadata from EE for Election: {election}"
-                    )
-                    self.election_importer.import_metadata_from_ee(election)
-                except Election.DoesNotExist:
-                    print(f"Election {election_id} not found in WCIVF")
-                    continue
-            for election_id in elections_with_children:
-                try:
-                    election = Election.objects.get(slug=election_id)
-                    print(
-                        f"importing metadata from EE for Election: {election}"
-                    )
-                    self.election_importer.import_metadata_from_ee(election)
-                except Election.DoesNotExist:
-                    print(f"Election {election_id} not found in WCIVF")
-                    continue
+        """
+        Applies the changes made to elections in EE since this last ran,
+        using the position stored in a SyncCursor. The cursor is only moved
+        on once every change has been applied, so a failed sync is retried
+        from the same place.
+        """
+        cursor, _ = SyncCursor.objects.get_or_create(
+            name=EE_CHANGES_CURSOR_NAME
+        )
+        started = timezone.now()
+        since = cursor.position or started - EE_CHANGES_FIRST_SYNC
+        since -= EE_CHANGES_OVERLAP
+        self.stdout.write(f"Checking for changes in EE since {since}\n")
+
+        for elections in self.ee_helper.iter_modified_elections(since):
+            self.apply_ee_changes(elections)
+        for elections in self.ee_helper.iter_modified_elections(
+            since, deleted=True
+        ):
+            self.apply_ee_deletions(elections)
+
+        cursor.position = started
+        cursor.save()
+
+    def apply_ee_changes(self, ee_elections):
+        """
+        Imports the metadata for a page of elections that changed in EE.
+        IDs with a group_type of "election" are for the parents of
+        everything else, so don't match anything here. Any other ID can
+        match an Election, and IDs without a group_type can also match a
+        PostElection.
+        """
+        election_ids = [
+            ee_election["election_id"]
+            for ee_election in ee_elections
+            if ee_election["group_type"] != "election"
+        ]
+        ballot_ids = [
+            ee_election["election_id"]
+            for ee_election in ee_elections
+            if not ee_election["group_type"]
+        ]
+        elections = Election.objects.in_bulk(election_ids, field_name="slug")
+        ballots = PostElection.objects.select_related(
+            "election", "post"
+        ).in_bulk(ballot_ids, field_name="ballot_paper_id")
+
+        for election in elections.values():
+            self.stdout.write(
+                f"importing metadata from EE for Election: {election}\n"
+            )
+            self.election_importer.import_metadata_from_ee(election)
+        if ballots:
+            self.stdout.write(
+                f"importing metadata from EE for {len(ballots)} ballots\n"
+            )
+            self.import_metadata_from_ee_for_ballots(list(ballots.values()))
+            PostElection.objects.filter(
+                post__in={ballot.post_id for ballot in ballots.values()}
+            ).build_cards()
+
+    @transaction.atomic
+    def apply_ee_deletions(self, ee_elections):
+        """
+        Deletes the Elections and PostElections for a page of elections
+        that were deleted in EE
+        """
+        election_ids = [
+            ee_election["election_id"] for ee_election in ee_elections
+        ]
+        deleted_ballots = PostElection.objects.filter(
+            Q(ballot_paper_id__in=election_ids)
+            | Q(election__slug__in=election_ids)
+        )
+        deleted_ballots.record_orphan_candidates()
+        deleted_ballots.record_changes()
+        # counted first, as ballots deleted with their election aren't
+        # included in either delete's count of ballots
+        ballots_count = deleted_ballots.count()
+        elections_count, _ = Election.objects.filter(
+            slug__in=election_ids
+        ).delete()
+        PostElection.objects.filter(ballot_paper_id__in=election_ids).delete()
+        self.stdout.write(
+            f"Deleted {elections_count} Election and {ballots_count} "
+            "PostElection objects and relations\n"
+        )
+        if ballots_count:
+            invalidate_postcode_lookups()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from elections.models import PostElection
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuilds the precomputed card for every ballot. The importers keep cards
+    up to date for the ballots they change, so this is only needed to fill
+    them in for the first time or after changing what they contain
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--current",
+            action="store_true",
+            help="Only build cards for ballots in current elections",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, **options):
+        ballots = PostElection.objects.order_by("pk")
+        if options["current"]:
+            ballots = ballots.filter(election__current=True)
+
+        batch_size = options["batch_size"]
+        ballot_ids = list(ballots.values_list("pk", flat=True))
+        for start in range(0, len(ballot_ids), batch_size):
+            PostElection.objects.filter(
+                pk__in=ballot_ids[start : start + batch_size]
+            ).build_cards()
+        self.stdout.write(f"Built cards for {len(ballot_ids)} ballots")
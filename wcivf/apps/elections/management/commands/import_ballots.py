@@ -1,4 +1,6 @@
+from api.export import write_snapshot
 from django.core.management.base import BaseCommand
+from elections.devs_dc_client import invalidate_postcode_lookups
 from elections.import_helpers import (
     EEHelper,
     YNRBallotImporter,
@@ -76,6 +78,8 @@ class Command(BaseCommand):
         self.stdout.write(
             f"Deleted {post_elections} PostElection objects and relations\n"
         )
+        if post_elections:
+            invalidate_postcode_lookups()
 
     def handle(self, **options):
         importer = YNRBallotImporter(
@@ -89,3 +93,4 @@ class Command(BaseCommand):
         importer.do_import()
         self.populate_any_non_by_elections_field()
         self.delete_deleted_elections()
+        write_snapshot()
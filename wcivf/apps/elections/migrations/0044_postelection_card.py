@@ -0,0 +1,21 @@
+# Generated by Django 4.2.11 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("elections", "0043_remove_election_ballot_papers_issued_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postelection",
+            name="card",
+            field=models.JSONField(
+                blank=True,
+                help_text="Values derived from this ballot and related objects, precomputed by the importers so pages don't work them out on every request",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-17 12:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("elections", "0045_synccursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BallotChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("ballot_paper_id", models.CharField(max_length=800)),
+                (
+                    "created",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("transaction_id", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["transaction_id", "id"],
+                        include=("created", "ballot_paper_id"),
+                        name="ballotchange_feed_idx",
+                    )
+                ],
+            },
+        ),
+    ]
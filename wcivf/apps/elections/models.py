@@ -1,12 +1,23 @@
 import datetime
 import re
+from collections import defaultdict
 
 import pytz
+from core.models import OrphanCandidate
+from core.utils import CurrentTransactionId, OldestRunningTransactionId
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import apnumber
 from django.db import models
-from django.db.models import DateTimeField, JSONField
-from django.db.models.functions import Greatest
+from django.db.models import (
+    Count,
+    DateTimeField,
+    IntegerField,
+    JSONField,
+    OuterRef,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.template.defaultfilters import pluralize
 from django.urls import reverse
 from django.utils import timezone
@@ -37,6 +48,49 @@ class ElectionCancellationReason(models.TextChoices):
     CANDIDATE_DEATH = "CANDIDATE_DEATH", "Death of a candidate"
 
 
+INDEPENDENT_PARTY_ID = "ynmp-party:2"
+
+
+def describe_party_ballot_count(party_ids, uses_lists):
+    """
+    Given the party IDs of the candidacies on a ballot, returns a
+    description of how many candidates, or for list elections parties and
+    independent candidates, there are to choose from
+    """
+    return describe_ballot_stats(
+        candidate_count=len(party_ids),
+        independent_count=party_ids.count(INDEPENDENT_PARTY_ID),
+        party_count=len(set(party_ids) - {INDEPENDENT_PARTY_ID}),
+        uses_lists=uses_lists,
+    )
+
+
+def describe_ballot_stats(
+    candidate_count, independent_count, party_count, uses_lists
+):
+    """
+    As describe_party_ballot_count, from the counts of candidates,
+    independent candidates and other parties on a ballot
+    """
+    if not candidate_count:
+        return None
+
+    if uses_lists:
+        ind_and_parties = independent_count + party_count
+        ind_and_parties_apnumber = apnumber(ind_and_parties)
+        ind_and_parties_pluralized = pluralize(ind_and_parties)
+        value = f"{ind_and_parties_apnumber} parties"
+        if independent_count:
+            value = (
+                f"{value} or independent candidate{ind_and_parties_pluralized}"
+            )
+        return value
+
+    candidates_apnumber = apnumber(candidate_count)
+    candidates_pluralized = pluralize(candidate_count)
+    return f"{candidates_apnumber} candidate{candidates_pluralized}"
+
+
 def utc_to_local(utc_dt):
     return utc_dt.replace(tzinfo=pytz.utc).astimezone(LOCAL_TZ)
 
@@ -383,6 +437,109 @@ class PostElectionQuerySet(models.QuerySet):
             .order_by("last_updated")
         )
 
+    def with_ballot_stats(self):
+        """
+        Annotates each ballot with the number of candidates on it
+        (`candidate_count`), how many of them are independents
+        (`independent_count`) and how many other parties are standing
+        (`party_count`), so that party_ballot_count doesn't need to query
+        for them. Each is a subquery, so they can be combined with other
+        aggregates.
+        """
+        from people.models import PersonPost
+
+        candidacies = (
+            PersonPost.objects.filter(post_election=OuterRef("pk"))
+            .order_by()
+            .values("post_election")
+        )
+        is_independent = Q(party_id=INDEPENDENT_PARTY_ID)
+
+        def count(aggregate):
+            return Coalesce(
+                Subquery(
+                    candidacies.annotate(count=aggregate).values("count"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+
+        return self.annotate(
+            candidate_count=count(Count("pk")),
+            independent_count=count(Count("pk", filter=is_independent)),
+            party_count=count(
+                Count("party_id", filter=~is_independent, distinct=True)
+            ),
+        )
+
+    def build_cards(self):
+        """
+        Rebuilds the card for each ballot in the queryset, see
+        PostElection.card. Only cards that have changed are written. Returns
+        the number of ballots updated.
+        """
+        from people.models import PersonPost
+
+        ballots = list(self.select_related("post", "election"))
+
+        party_ids = defaultdict(list)
+        candidacies = PersonPost.objects.filter(
+            post_election__in=[ballot.pk for ballot in ballots]
+        ).values_list("post_election_id", "party_id")
+        for ballot_id, party_id in candidacies:
+            party_ids[ballot_id].append(party_id)
+
+        post_ballots = defaultdict(list)
+        other_ballots = PostElection.objects.filter(
+            post__in={ballot.post_id for ballot in ballots}
+        ).values_list(
+            "post_id",
+            "ballot_paper_id",
+            "election__election_date",
+            "election__election_type",
+        )
+        for post_id, *other_ballot in other_ballots:
+            post_ballots[post_id].append(other_ballot)
+
+        changed = []
+        for ballot in ballots:
+            card = ballot.build_card(
+                party_ids=party_ids[ballot.pk],
+                post_ballots=post_ballots[ballot.post_id],
+            )
+            if card != ballot.card:
+                ballot.card = card
+                changed.append(ballot)
+        # bulk_update doesn't change modified, so the cards stay current
+        return PostElection.objects.bulk_update(
+            changed, ["card"], batch_size=500
+        )
+
+    def record_changes(self):
+        """
+        Records that these ballots have changed, see BallotChange
+        """
+        BallotChange.objects.record(
+            self.values_list("ballot_paper_id", flat=True)
+        )
+
+    def record_orphan_candidates(self):
+        """
+        Records the posts and candidates of these ballots as possible
+        orphans, for when the ballots are about to be deleted
+        """
+        from people.models import PersonPost
+
+        OrphanCandidate.objects.record(
+            OrphanCandidate.POST, self.values_list("post_id", flat=True)
+        )
+        OrphanCandidate.objects.record(
+            OrphanCandidate.PERSON,
+            PersonPost.objects.filter(post_election__in=self).values_list(
+                "person_id", flat=True
+            ),
+        )
+
 
 class PostElection(TimeStampedModel):
     ballot_paper_id = models.CharField(blank=True, max_length=800, unique=True)
@@ -422,6 +579,13 @@ class PostElection(TimeStampedModel):
     electorate = models.IntegerField(blank=True, null=True)
     turnout = models.IntegerField(blank=True, null=True)
     spoilt_ballots = models.IntegerField(blank=True, null=True)
+    card = JSONField(
+        null=True,
+        blank=True,
+        help_text="Values derived from this ballot and related objects, "
+        "precomputed by the importers so pages don't work them out on "
+        "every request",
+    )
 
     objects = PostElectionQuerySet.as_manager()
 
@@ -441,8 +605,61 @@ class PostElection(TimeStampedModel):
             or self.personpost_set.filter(elected=True)
         )
 
+    @cached_property
+    def current_card(self):
+        """
+        Returns the card if it was built from the ballot as it is now, or
+        None if there is no card or the ballot has changed since it was built.
+        Only changes that update `modified` are noticed, so the importers
+        update it when a ballot's post or election changes in a way the card
+        depends on too.
+        """
+        if not self.card or self.modified is None:
+            return None
+        if self.card.get("built_from") != self.modified.timestamp():
+            return None
+        return self.card
+
+    def build_card(self, party_ids, post_ballots):
+        """
+        Returns the values to store as the card for this ballot.
+
+        `party_ids` is the party ID of each candidacy on the ballot and
+        `post_ballots` is a (ballot_paper_id, election_date, election_type)
+        tuple for each ballot for the same post.
+        """
+        # lists rather than tuples, as they are once stored as JSON, so
+        # that cards can be compared with the stored ones
+        later_ballots = sorted(
+            [election_date.isoformat(), ballot_paper_id]
+            for ballot_paper_id, election_date, election_type in post_ballots
+            if election_date > self.election.election_date
+            and election_type == self.election.election_type
+        )
+        expected_sopn_date = self.get_expected_sopn_date()
+        return {
+            "built_from": self.modified.timestamp(),
+            "party_ballot_count": describe_party_ballot_count(
+                party_ids, self.election.uses_lists
+            ),
+            "expected_sopn_date": expected_sopn_date.isoformat()
+            if expected_sopn_date
+            else None,
+            "voter_id_requirements": self.get_id_requirements(),
+            "postal_voting_requirements": self.get_postal_requirements(),
+            "later_ballots": later_ballots,
+        }
+
     @property
     def expected_sopn_date(self):
+        if self.current_card:
+            expected_sopn_date = self.current_card["expected_sopn_date"]
+            if not expected_sopn_date:
+                return None
+            return datetime.date.fromisoformat(expected_sopn_date)
+        return self.get_expected_sopn_date()
+
+    def get_expected_sopn_date(self):
         try:
             return get_election_timetable(
                 self.ballot_paper_id, self.post.territory
@@ -627,6 +844,25 @@ class PostElection(TimeStampedModel):
         if self.election.current:
             return None
 
+        if self.current_card:
+            today = datetime.date.today().isoformat()
+            later_ballots = [
+                ballot_paper_id
+                for election_date, ballot_paper_id in self.current_card[
+                    "later_ballots"
+                ]
+                if election_date >= today
+            ]
+            if not later_ballots:
+                return None
+            try:
+                return PostElection.objects.select_related(
+                    "post", "election"
+                ).get(ballot_paper_id=later_ballots[-1])
+            except PostElection.DoesNotExist:
+                # deleted since the card was built
+                pass
+
         try:
             return self.post.postelection_set.filter(
                 election__election_date__gt=self.election.election_date,
@@ -638,30 +874,18 @@ class PostElection(TimeStampedModel):
 
     @property
     def party_ballot_count(self):
-        if self.personpost_set.exists():
-            people = self.personpost_set
-            if self.election.uses_lists:
-                ind_candidates = people.filter(party_id="ynmp-party:2").count()
-                num_other_parties = (
-                    people.exclude(party_id="ynmp-party:2")
-                    .values("party_id")
-                    .distinct()
-                    .count()
-                )
-                ind_and_parties = ind_candidates + num_other_parties
-                ind_and_parties_apnumber = apnumber(ind_and_parties)
-                ind_and_parties_pluralized = pluralize(ind_and_parties)
-                value = f"{ind_and_parties_apnumber} parties"
-                if ind_candidates:
-                    value = f"{value} or independent candidate{ind_and_parties_pluralized}"
-                return value
-
-            num_candidates = people.count()
-            candidates_apnumber = apnumber(num_candidates)
-            candidates_pluralized = pluralize(num_candidates)
-            return f"{candidates_apnumber} candidate{candidates_pluralized}"
-
-        return None
+        if self.current_card:
+            return self.current_card["party_ballot_count"]
+        if hasattr(self, "candidate_count"):
+            # annotated by with_ballot_stats
+            return describe_ballot_stats(
+                candidate_count=self.candidate_count,
+                independent_count=self.independent_count,
+                party_count=self.party_count,
+                uses_lists=self.election.uses_lists,
+            )
+        party_ids = list(self.personpost_set.values_list("party_id", flat=True))
+        return describe_party_ballot_count(party_ids, self.election.uses_lists)
 
     @property
     def should_display_sopn_info(self):
@@ -695,6 +919,11 @@ class PostElection(TimeStampedModel):
 
     @property
     def get_voter_id_requirements(self):
+        if self.current_card:
+            return self.current_card["voter_id_requirements"]
+        return self.get_id_requirements()
+
+    def get_id_requirements(self):
         try:
             matcher = IDRequirementsMatcher(
                 self.ballot_paper_id, nation=self.post.territory
@@ -705,6 +934,11 @@ class PostElection(TimeStampedModel):
 
     @property
     def get_postal_voting_requirements(self):
+        if self.current_card:
+            return self.current_card["postal_voting_requirements"]
+        return self.get_postal_requirements()
+
+    def get_postal_requirements(self):
         try:
             matcher = PostalVotingRequirementsMatcher(
                 self.ballot_paper_id, nation=self.post.territory
@@ -714,6 +948,103 @@ class PostElection(TimeStampedModel):
             return None
 
 
+class SyncCursor(models.Model):
+    """
+    Records how far through a feed of changes from another service we've
+    got, so that the next sync can carry on from there
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField(null=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+
+class BallotChangeQuerySet(models.QuerySet):
+    def record(self, ballot_paper_ids):
+        """
+        Records that the ballots, or something shown with them, have changed
+        """
+        self.bulk_create(
+            [
+                self.model(
+                    ballot_paper_id=ballot_paper_id,
+                    transaction_id=CurrentTransactionId(),
+                )
+                for ballot_paper_id in set(ballot_paper_ids)
+            ],
+            batch_size=1000,
+        )
+
+    def settled(self):
+        """
+        Leaves out changes made by transactions at or after the oldest one
+        still running. Transactions get their IDs in the order they first
+        write, not the order they commit, so any transaction that hasn't
+        committed yet will have a higher ID than every settled change.
+        """
+        return self.filter(transaction_id__lt=OldestRunningTransactionId())
+
+    def after(self, position):
+        """
+        Returns the settled changes after a position (the transaction_id
+        and pk of the last change seen) oldest first
+        """
+        transaction_id, pk = position
+        return (
+            self.settled()
+            .filter(transaction_id__gte=transaction_id)
+            .exclude(transaction_id=transaction_id, pk__lte=pk)
+            .order_by("transaction_id", "pk")
+        )
+
+    def latest_position(self):
+        """
+        Returns the position of the last settled change. Changes that
+        commit later will always be after it.
+        """
+        return self.settled().order_by("-transaction_id", "-pk").values_list(
+            "transaction_id", "pk"
+        ).first() or (0, 0)
+
+
+class BallotChange(models.Model):
+    """
+    An append only log of changes to ballots and their candidacies,
+    hustings and local parties, for API clients to follow. Added to by the
+    importers and when the models are saved, see elections.signals.
+
+    Changes are ordered by the transaction that made them, then pk, so
+    that clients following the log don't miss changes from long running
+    transactions that commit after later ones.
+
+    Ballots are recorded by ID rather than a foreign key so that deleted
+    ballots stay in the log.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    ballot_paper_id = models.CharField(max_length=800)
+    created = models.DateTimeField(default=timezone.now)
+    transaction_id = models.BigIntegerField(default=0)
+
+    objects = BallotChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # lets pages of the log be read with an index only scan
+            models.Index(
+                fields=["transaction_id", "id"],
+                include=["created", "ballot_paper_id"],
+                name="ballotchange_feed_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.pk}: {self.ballot_paper_id}"
+
+
 class VotingSystem(models.Model):
     slug = models.SlugField(primary_key=True)
     name = models.CharField(blank=True, max_length=100)
@@ -0,0 +1,149 @@
+"""
+Logs postcode lookups to POSTCODE_LOGGER without holding up the request.
+
+Requests only append the details of a lookup to an in-process queue. A
+background thread, started the first time something's logged in each
+process, builds the log entries and writes them in batches every
+POSTCODE_LOG_FLUSH_INTERVAL seconds, or sooner once a batch is waiting.
+Whatever's queued is written when the process exits.
+
+If the queue is full, because the logger is slow or failing, new lookups
+aren't logged rather than making requests wait, and are counted in
+`stats`.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedPostcodeLogger:
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None):
+        self.max_size = max_size or settings.POSTCODE_LOG_QUEUE_SIZE
+        self.batch_size = batch_size or settings.POSTCODE_LOG_BATCH_SIZE
+        if flush_interval is None:
+            flush_interval = settings.POSTCODE_LOG_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+
+        # appending to and popping from a deque is thread safe, so requests
+        # don't need to take a lock
+        self.entries = deque()
+        self.wakeup = threading.Event()
+        # held while entries are being written, so only one thread writes
+        # at a time
+        self.write_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def log(self, **kwargs):
+        """
+        Queues a lookup to be logged, with the keyword arguments for the
+        log entry. Returns False if the queue is full and it was dropped.
+        """
+        if self.pid != os.getpid():
+            self.start()
+        if len(self.entries) >= self.max_size:
+            self.dropped += 1
+            return False
+        self.entries.append(kwargs)
+        if len(self.entries) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def start(self):
+        """
+        Starts the background thread. Threads don't survive a fork, so this
+        is done again in each process that logs anything.
+        """
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # anything queued before the fork was the parent's to write
+            self.entries.clear()
+            self.stopping = False
+            self.thread = threading.Thread(
+                target=self.run, name="postcode-logger", daemon=True
+            )
+            self.thread.start()
+            if self.pid is None:
+                atexit.register(self.close)
+            self.pid = os.getpid()
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Writes everything that's queued, returning once it has been
+        """
+        with self.write_lock:
+            while self.entries:
+                batch = [
+                    self.entries.popleft()
+                    for _ in range(min(self.batch_size, len(self.entries)))
+                ]
+                self.write(batch)
+
+    def write(self, batch):
+        postcode_logger = settings.POSTCODE_LOGGER
+        failed = 0
+        for kwargs in batch:
+            try:
+                postcode_logger.log(
+                    postcode_logger.entry_class(
+                        dc_product=postcode_logger.dc_product.wcivf,
+                        calls_devs_dc_api=True,
+                        **kwargs,
+                    )
+                )
+            except Exception:
+                failed += 1
+        self.written += len(batch) - failed
+        self.failed += failed
+        if failed:
+            logger.warning(
+                "Failed to write %s of %s postcode log entries",
+                failed,
+                len(batch),
+            )
+
+    def close(self, timeout=5):
+        """
+        Stops the background thread and writes anything still queued
+        """
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread and self.pid == os.getpid():
+            self.thread.join(timeout)
+        self.flush()
+
+    @property
+    def stats(self):
+        """
+        Counts of the lookups waiting to be written, and those written,
+        failed or dropped (because the queue was full) by this process
+        """
+        return {
+            "queued": len(self.entries),
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+postcode_logger = BufferedPostcodeLogger()
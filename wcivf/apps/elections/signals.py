@@ -0,0 +1,25 @@
+"""
+Records changes made by saving ballots and the models shown with them in
+the BallotChange log. Importers that write in bulk, which doesn't send
+these signals, record their changes themselves.
+"""
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from hustings.models import Husting
+from parties.models import LocalParty
+from people.models import PersonPost
+
+from .models import BallotChange, PostElection
+
+
+@receiver(post_save, sender=PostElection)
+def record_ballot_change(sender, instance, **kwargs):
+    BallotChange.objects.record([instance.ballot_paper_id])
+
+
+@receiver(post_save, sender=PersonPost)
+@receiver(post_save, sender=Husting)
+@receiver(post_save, sender=LocalParty)
+def record_related_change(sender, instance, **kwargs):
+    BallotChange.objects.record([instance.post_election.ballot_paper_id])
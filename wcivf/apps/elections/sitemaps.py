@@ -8,6 +8,7 @@ class ElectionSitemap(Sitemap):
     changefreq = "weekly"
     priority = 0.5
     protocol = "https"
+    changed_field = None
 
     def items(self):
         return Election.objects.all()
@@ -17,13 +18,20 @@ class PostElectionSitemap(Sitemap):
     changefreq = "weekly"
     priority = 0.9
     protocol = "https"
+    # changes whenever a URL would, as importing a new label for a post
+    # updates its ballots' modified too, see core.sitemaps
+    changed_field = "modified"
 
     # Only include posts for general elections, since
     # otherwise the sitemap gets close to the Google limit.
     # of 50,000 URLs.
     def items(self):
-        return PostElection.objects.filter(
-            Q(election__election_type="parl")
-            | Q(election__election_type="2010")
-            | Q(election__election_type="2015")
-        ).order_by("-election__election_date")
+        return (
+            PostElection.objects.filter(
+                Q(election__election_type="parl")
+                | Q(election__election_type="2010")
+                | Q(election__election_type="2015")
+            )
+            .select_related("post")
+            .order_by("-election__election_date")
+        )
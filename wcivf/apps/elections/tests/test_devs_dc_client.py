@@ -0,0 +1,234 @@
+from unittest import mock
+
+import pytest
+import requests
+from core.benchmark import DevsDCStub
+from django.core.cache import cache, caches
+from elections.devs_dc_client import (
+    CachedDevsDCClient,
+    CircuitBreaker,
+    DevsDCAPIException,
+    DevsDCAPIUnavailable,
+    DevsDCClient,
+    invalidate_postcode_lookups,
+)
+
+
+def mock_response(status_code, json=None):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = json or {}
+    return response
+
+
+class TestDevsDCClient:
+    @pytest.fixture
+    def client(self, mocker):
+        mocker.patch("elections.devs_dc_client.time.sleep")
+        return DevsDCClient(
+            api_base="https://example.com", api_key="x", max_retries=2
+        )
+
+    @pytest.fixture
+    def session_get(self, client, mocker):
+        return mocker.patch.object(client.session, "get")
+
+    def test_uses_pooled_session_with_timeout(self, client, session_get):
+        session_get.return_value = mock_response(200, {"dates": []})
+        assert client.make_request("SW1A1AA") == {"dates": []}
+        session_get.assert_called_once_with(
+            "https://example.com/api/v1/postcode/SW1A1AA/",
+            params={"auth_token": "x", "include_current": 1},
+            timeout=client.timeout,
+        )
+
+    def test_retries_server_errors(self, client, session_get):
+        session_get.side_effect = [
+            mock_response(503),
+            mock_response(429),
+            mock_response(200, {"dates": []}),
+        ]
+        assert client.make_request("SW1A1AA") == {"dates": []}
+        assert session_get.call_count == 3
+        assert client.retries == 2
+
+    def test_does_not_retry_client_errors(self, client, session_get):
+        session_get.return_value = mock_response(400)
+        with pytest.raises(DevsDCAPIException):
+            client.make_request("INVALID")
+        session_get.assert_called_once()
+        assert client.circuit_breaker.failures == 0
+
+    def test_connection_errors_raise_unavailable(self, client, session_get):
+        session_get.side_effect = requests.ConnectionError
+        with pytest.raises(DevsDCAPIUnavailable):
+            client.make_request("SW1A1AA")
+        assert session_get.call_count == 3
+        assert client.circuit_breaker.failures == 1
+
+    def test_open_circuit_fails_fast(self, client, session_get):
+        client.circuit_breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout=30
+        )
+        session_get.return_value = mock_response(500)
+        with pytest.raises(DevsDCAPIException):
+            client.make_request("SW1A1AA")
+        session_get.reset_mock()
+
+        with pytest.raises(DevsDCAPIUnavailable):
+            client.make_request("SW1A1AA")
+        session_get.assert_not_called()
+
+    def test_connection_stats(self, client):
+        assert client.connection_stats == {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "retries": 0,
+            "circuit_open": False,
+        }
+
+    def test_connection_stats_after_requests(self):
+        ballots = {"BM1 0AA": ["local.a.2024-05-02"]}
+        with DevsDCStub(ballots) as stub:
+            client = DevsDCClient(api_base=stub.url, api_key="x")
+            for _ in range(3):
+                client.make_request("BM1 0AA")
+            with pytest.raises(DevsDCAPIException):
+                client.make_request("XX1 1XX")
+
+        assert client.connection_stats == {
+            "requests": 4,
+            "new_connections": 1,
+            "reused_connections": 3,
+            "retries": 0,
+            "circuit_open": False,
+        }
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        assert breaker.is_open is False
+        breaker.record_failure()
+        assert breaker.is_open is True
+
+    def test_success_closes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        assert breaker.is_open is False
+        assert breaker.failures == 0
+
+    def test_lets_requests_through_after_reset_timeout(self, mocker):
+        monotonic = mocker.patch("elections.devs_dc_client.time.monotonic")
+        monotonic.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        assert breaker.is_open is True
+        monotonic.return_value = 131
+        assert breaker.is_open is False
+
+
+class TestCachedDevsDCClient:
+    @pytest.fixture(autouse=True)
+    def caches(self, settings):
+        settings.CACHES = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "test-default",
+            },
+            "local": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "test-local",
+            },
+        }
+        settings.POSTCODE_LOOKUP_CACHE_TTL = 600
+        settings.POSTCODE_LOOKUP_CACHE_STALE_TTL = 3600
+        settings.POSTCODE_LOOKUP_LOCAL_CACHE_TTL = 60
+        cache.clear()
+        caches["local"].clear()
+
+    @pytest.fixture
+    def client(self):
+        return CachedDevsDCClient(api_base="https://example.com", api_key="x")
+
+    @pytest.fixture
+    def upstream(self, mocker):
+        return mocker.patch.object(
+            DevsDCClient, "make_request", return_value={"dates": []}
+        )
+
+    def test_cache_key_is_normalised(self, client):
+        assert client.cache_key("sw1a 1aa") == client.cache_key("SW1A1AA")
+        assert client.cache_key("SW1A1AA", uprn="123") == (
+            "postcode_to_ballot_SW1A1AA_123"
+        )
+
+    def test_repeat_lookups_only_call_upstream_once(self, client, upstream):
+        assert client.make_request("SW1A 1AA") == {"dates": []}
+        assert client.make_request("sw1a1aa") == {"dates": []}
+        upstream.assert_called_once_with(postcode="SW1A 1AA", uprn=None)
+
+    def test_uprn_lookups_cached_separately(self, client, upstream):
+        client.make_request("SW1A 1AA")
+        client.make_request("SW1A 1AA", uprn="123")
+        assert upstream.call_count == 2
+
+    def test_shared_cache_used_when_local_cache_empty(self, client, upstream):
+        client.make_request("SW1A 1AA")
+        client.local_cache.clear()
+        client.make_request("SW1A 1AA")
+        upstream.assert_called_once()
+
+    def test_invalidate_postcode_lookups(self, client, upstream):
+        client.make_request("SW1A 1AA")
+        invalidate_postcode_lookups()
+        client.local_cache.clear()
+        client.make_request("SW1A 1AA")
+        assert upstream.call_count == 2
+
+    def expire(self, client, postcode):
+        key = client.cache_key(postcode)
+        entry = cache.get(key)
+        entry["fresh_until"] = 0
+        cache.set(key, entry)
+        client.local_cache.clear()
+
+    def test_stale_entry_revalidated(self, client, upstream):
+        client.make_request("SW1A 1AA")
+        self.expire(client, "SW1A 1AA")
+        upstream.return_value = {"dates": ["new"]}
+
+        assert client.make_request("SW1A 1AA") == {"dates": ["new"]}
+        assert upstream.call_count == 2
+
+    def test_stale_entry_served_when_upstream_errors(
+        self, client, upstream, mocker
+    ):
+        client.make_request("SW1A 1AA")
+        self.expire(client, "SW1A 1AA")
+        upstream.side_effect = DevsDCAPIException(
+            response=mocker.Mock(status_code=503)
+        )
+
+        assert client.make_request("SW1A 1AA") == {"dates": []}
+
+    def test_stale_entry_served_while_revalidating(self, client, upstream):
+        client.make_request("SW1A 1AA")
+        self.expire(client, "SW1A 1AA")
+        cache.add(f"{client.cache_key('SW1A 1AA')}_lock", 1)
+        upstream.return_value = {"dates": ["new"]}
+
+        assert client.make_request("SW1A 1AA") == {"dates": []}
+        upstream.assert_called_once()
+
+    def test_client_errors_not_cached(self, client, upstream, mocker):
+        upstream.side_effect = DevsDCAPIException(
+            response=mocker.Mock(status_code=400)
+        )
+        with pytest.raises(DevsDCAPIException):
+            client.make_request("INVALID")
+        with pytest.raises(DevsDCAPIException):
+            client.make_request("INVALID")
+        assert upstream.call_count == 2
@@ -3,9 +3,10 @@ from random import shuffle
 
 import factory
 import pytest
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from elections.models import Post
 from elections.tests.factories import (
     ElectionFactory,
@@ -53,6 +54,24 @@ class ElectionViewTests(TestCase):
         self.assertTemplateUsed(response, "elections/election_view.html")
         self.assertContains(response, self.election.nice_election_name)
 
+    def test_election_detail_queries_dont_depend_on_ballots(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    self.election.get_absolute_url(), follow=True
+                )
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        num_queries = count_queries()
+        for i in range(3):
+            PostElectionFactory(
+                election=self.election,
+                post=PostFactory(ynr_id=f"post-{i}", label=f"Post {i}"),
+                ballot_paper_id=f"local.city-of-london.post-{i}.2017-03-23",
+            )
+        self.assertEqual(count_queries(), num_queries)
+
     @pytest.mark.freeze_time("2017-03-23")
     def test_election_detail_day_of_election(self):
         """
@@ -760,3 +779,50 @@ class TestPostelectionsToPeopleMixin(TestCase):
             # resolve queryset to execute the queries
             candidates = list(queryset)
             self.assertEqual(len(candidates), 10)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "people-for-ballot",
+            }
+        }
+    )
+    def test_cached_people_for_ballot_makes_no_queries(self):
+        """
+        Test that once cached the candidates, and everything prefetched for
+        them, are used without making any queries
+        """
+        self.mixin.people_for_ballot(self.post_election)
+
+        with self.assertNumQueries(0):
+            queryset = self.mixin.people_for_ballot(self.post_election)
+            for candidate in queryset:
+                self.assertEqual(
+                    list(candidate.previous_party_affiliations.all()), []
+                )
+                self.assertEqual(list(candidate.person.pledges.all()), [])
+                self.assertEqual(candidate.person.ordered_leaflets, [])
+                self.assertEqual(candidate.party.party_name, "Test Party")
+                self.assertEqual(
+                    candidate.post_election.ballot_paper_id,
+                    self.post_election.ballot_paper_id,
+                )
+            self.assertEqual(queryset.count(), 10)
+            self.assertFalse(queryset.contains_delisted_person())
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "people-for-ballot-modified",
+            }
+        }
+    )
+    def test_people_for_ballot_cache_replaced_when_ballot_modified(self):
+        self.mixin.people_for_ballot(self.post_election)
+        self.candidates[0].delete()
+        self.post_election.save()
+
+        queryset = self.mixin.people_for_ballot(self.post_election)
+        self.assertEqual(len(queryset), 9)
@@ -1,24 +1,44 @@
+import io
 import sys
 from datetime import date
 
 import pytest
+import requests
+from core.models import OrphanCandidate
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from elections.ee_cache import EECache
 from elections.helpers import (
     EEHelper,
     JsonPaginator,
+    StreamingJsonPaginator,
     get_election_timetable,
 )
-from elections.import_helpers import YNRBallotImporter, YNRPostImporter
-from elections.models import Election, Post, PostElection
+from elections.import_helpers import (
+    YNRBallotImporter,
+    YNRElectionImporter,
+    YNRPostImporter,
+)
+from elections.models import (
+    BallotChange,
+    Election,
+    Post,
+    PostElection,
+    PostElectionQuerySet,
+    SyncCursor,
+    VotingSystem,
+)
 from elections.tests.factories import (
     ElectionFactory,
     PostElectionFactory,
     PostFactory,
 )
-from parties.models import Party
-from people.models import PersonPost
+from parties.tests.factories import PartyFactory
+from people.models import Person, PersonPost
 
 
 class GetElectionTimetable(TestCase):
@@ -69,6 +89,7 @@ class TestEEHelper:
         """
         mock_data = [
             {"results": [{"election_id": "foo_id"}, {"election_id": "bar_id"}]},
+            {"results": [{"election_id": "baz_id"}]},
         ]
         paginator = mocker.MagicMock(spec=JsonPaginator)
         paginator.return_value.__iter__.return_value = iter(mock_data)
@@ -76,7 +97,7 @@ class TestEEHelper:
 
         result = ee_helper.deleted_election_ids
 
-        assert result == ["foo_id", "bar_id"]
+        assert result == ["foo_id", "bar_id", "baz_id"]
         paginator.assert_called_once_with(
             page1="https://elections.democracyclub.org.uk/api/elections/?deleted=1&poll_open_date__gte=2021-01-01",
             stdout=sys.stdout,
@@ -110,11 +131,286 @@ class TestEEHelper:
 
         election_filter.assert_called_once_with(slug__in=["foo_id", "bar_id"])
         election_filter.return_value.delete.assert_called_once()
-        postelection_filter.assert_called_once_with(
+        postelection_filter.assert_called_with(
             ballot_paper_id__in=["foo_id", "bar_id"]
         )
+        postelection_filter.return_value.record_orphan_candidates.assert_called_once()
+        postelection_filter.return_value.record_changes.assert_called_once()
         postelection_filter.return_value.delete.assert_called_once()
 
+    @pytest.mark.django_db
+    def test_deleted_elections_counts_their_ballots(self, ee_helper, mocker):
+        mocker.patch.object(
+            EEHelper,
+            "deleted_election_ids",
+            new_callable=mocker.PropertyMock,
+            return_value=["local.foo.2024-05-02"],
+        )
+        election = ElectionFactory(slug="local.foo.2024-05-02")
+        PostElectionFactory(
+            election=election, ballot_paper_id="local.foo.bar.2024-05-02"
+        )
+        # the ballot is deleted with its election
+        assert ee_helper.delete_deleted_elections() == (2, 1)
+        assert not PostElection.objects.exists()
+
+    @pytest.fixture
+    def ee_cache(self, mocker, tmp_path):
+        ee_cache = EECache(
+            max_entries=2,
+            ttl=60,
+            missing_ttl=10,
+            path=tmp_path / "ee_cache.sqlite3",
+        )
+        mocker.patch.object(EEHelper, "_ee_cache", ee_cache)
+        return ee_cache
+
+    @pytest.fixture
+    def ee_get(self, mocker):
+        responses = {}
+
+        def get(url, headers):
+            election_id = url.rstrip("/").rsplit("/", 1)[-1]
+            if election_id not in responses:
+                return mocker.Mock(status_code=404)
+            if headers.get("If-None-Match") == '"v1"':
+                return mocker.Mock(status_code=304)
+            response = mocker.Mock(status_code=200, headers={"ETag": '"v1"'})
+            response.json.return_value = responses[election_id]
+            return response
+
+        mocker.patch("elections.helpers.requests.get", side_effect=get)
+        return responses
+
+    def test_get_data_revalidates_expired_entries(
+        self, ee_helper, ee_cache, ee_get, freezer
+    ):
+        ee_get["local.foo.2024-05-02"] = {"election_id": "local.foo.2024-05-02"}
+
+        assert ee_helper.get_data("local.foo.2024-05-02") == {
+            "election_id": "local.foo.2024-05-02"
+        }
+        assert ee_helper.get_data("missing.2024-05-02") is None
+        assert requests.get.call_count == 2
+
+        freezer.tick(30)
+        ee_helper.get_data("local.foo.2024-05-02")
+        ee_helper.get_data("missing.2024-05-02")
+        assert requests.get.call_count == 3
+
+        freezer.tick(60)
+        assert ee_helper.get_data("local.foo.2024-05-02") == {
+            "election_id": "local.foo.2024-05-02"
+        }
+        requests.get.assert_called_with(
+            "https://elections.democracyclub.org.uk/api/elections/"
+            "local.foo.2024-05-02/",
+            headers={"If-None-Match": '"v1"'},
+        )
+        ee_helper.get_data("local.foo.2024-05-02")
+        assert requests.get.call_count == 4
+
+    def test_cache_is_bounded_and_persisted(self, ee_cache, tmp_path):
+        ee_cache.set_many({"a": {"id": "a"}, "b": {"id": "b"}})
+        ee_cache.get("a")
+        ee_cache.set("c", None)
+        assert list(ee_cache.entries) == ["a", "c"]
+
+        ee_cache = EECache(
+            max_entries=2,
+            ttl=60,
+            missing_ttl=10,
+            path=tmp_path / "ee_cache.sqlite3",
+        )
+        assert len(ee_cache) == 0
+        assert ee_cache.get("b").data == {"id": "b"}
+        assert ee_cache.get("c").data is None
+
+    def test_prewarm_bigger_than_memory_cache(
+        self, ee_helper, ee_cache, ee_get, mocker
+    ):
+        paginator = mocker.patch("elections.helpers.JsonPaginator")
+        paginator.return_value = [
+            {"results": [{"election_id": "a"}, {"election_id": "b"}]},
+            {"results": [{"election_id": "c"}]},
+        ]
+        ee_helper.prewarm_cache()
+        assert list(ee_cache.entries) == ["b", "c"]
+
+        # evicted entries are read back from the snapshot, not EE
+        for election_id in ["a", "b", "c"]:
+            assert ee_helper.get_data(election_id) == {
+                "election_id": election_id
+            }
+        requests.get.assert_not_called()
+
+    def test_cache_snapshot_in_cache_dir(self, settings, tmp_path):
+        settings.EE_CACHE_DIR = str(tmp_path)
+        EECache.from_settings().set("a", {"id": "a"})
+        assert EECache.from_settings().get("a").data == {"id": "a"}
+        assert (tmp_path / "ee_cache.sqlite3").exists()
+
+    def test_prewarm_cache_only_fetches_modified(
+        self, ee_helper, ee_cache, mocker, freezer
+    ):
+        paginator = mocker.patch("elections.helpers.JsonPaginator")
+        paginator.return_value = [
+            {"results": [{"election_id": "a"}, {"election_id": "b"}]}
+        ]
+        freezer.move_to("2024-04-01 12:00:00")
+        ee_helper.prewarm_cache(current=True)
+        paginator.assert_called_once_with(
+            "https://elections.democracyclub.org.uk/api/elections/"
+            "?current=True",
+            sys.stdout,
+        )
+
+        freezer.tick(120)
+        paginator.return_value = [
+            {"results": [{"election_id": "b", "modified": True}]}
+        ]
+        ee_helper.prewarm_cache(current=True)
+        paginator.assert_called_with(
+            "https://elections.democracyclub.org.uk/api/elections/"
+            "?modified=2024-04-01T11%3A55%3A00%2B00%3A00",
+            sys.stdout,
+        )
+        assert ee_cache.get("a").fetched_at == ee_cache.get("b").fetched_at
+        assert ee_cache.get("b").data == {"election_id": "b", "modified": True}
+
+        # prewarming every election still needs them all
+        ee_helper.prewarm_cache(current=False)
+        paginator.assert_called_with(
+            "https://elections.democracyclub.org.uk/api/elections/",
+            sys.stdout,
+        )
+
+
+class TestJsonPaginator:
+    BASE = "https://example.com/media/cached-api/latest"
+
+    @pytest.fixture
+    def pages(self):
+        return {
+            f"{self.BASE}/ballots-000001.json": {
+                "next": f"{self.BASE}/ballots-000002.json",
+                "results": [1],
+            },
+            f"{self.BASE}/ballots-000002.json": {
+                "next": f"{self.BASE}/ballots-000003.json",
+                "results": [2],
+            },
+            f"{self.BASE}/ballots-000003.json": {"next": None, "results": [3]},
+        }
+
+    @pytest.fixture
+    def requests_get(self, mocker, pages):
+        def get(url):
+            if url not in pages:
+                return mocker.Mock(status_code=404, text="Not found")
+            response = mocker.Mock(status_code=200)
+            response.json.return_value = pages[url]
+            return response
+
+        return mocker.patch("elections.helpers.requests.get", side_effect=get)
+
+    def test_predict_next_page(self, mocker):
+        paginator = JsonPaginator(page1=None, stdout=mocker.Mock(), prefetch=1)
+        assert paginator.predict_next_page(
+            f"{self.BASE}/ballots-000009.json"
+        ) == (f"{self.BASE}/ballots-000010.json")
+        assert (
+            paginator.predict_next_page(
+                "https://example.com/api/next/ballots/?page=2"
+            )
+            is None
+        )
+
+    @pytest.mark.parametrize("prefetch", [0, 1, 2, 5])
+    def test_yields_pages_in_order(self, requests_get, prefetch, mocker):
+        stdout = mocker.Mock()
+        paginator = JsonPaginator(
+            page1=f"{self.BASE}/ballots-000001.json",
+            stdout=stdout,
+            prefetch=prefetch,
+        )
+        assert [page["results"] for page in paginator] == [[1], [2], [3]]
+        assert stdout.write.call_args_list == [
+            mocker.call(f"{self.BASE}/ballots-00000{i}.json\n")
+            for i in (1, 2, 3)
+        ]
+
+    def test_prefetched_pages_used(self, requests_get, mocker):
+        paginator = JsonPaginator(
+            page1=f"{self.BASE}/ballots-000001.json",
+            stdout=mocker.Mock(),
+            prefetch=2,
+        )
+        list(paginator)
+        requested = [call.args[0] for call in requests_get.call_args_list]
+        for i in (1, 2, 3):
+            assert requested.count(f"{self.BASE}/ballots-00000{i}.json") == 1
+
+    def test_follows_next_when_not_predicted(self, requests_get, pages, mocker):
+        pages[f"{self.BASE}/ballots-000002.json"][
+            "next"
+        ] = f"{self.BASE}/other.json"
+        pages[f"{self.BASE}/other.json"] = {"next": None, "results": ["other"]}
+        paginator = JsonPaginator(
+            page1=f"{self.BASE}/ballots-000001.json",
+            stdout=mocker.Mock(),
+            prefetch=2,
+        )
+        assert [page["results"] for page in paginator] == [
+            [1],
+            [2],
+            ["other"],
+        ]
+
+    def test_raises_for_status(self, requests_get, mocker):
+        requests_get.side_effect = None
+        requests_get.return_value.status_code = 500
+        requests_get.return_value.raise_for_status.side_effect = (
+            requests.HTTPError
+        )
+        paginator = JsonPaginator(
+            page1=f"{self.BASE}/ballots-000001.json",
+            stdout=mocker.Mock(),
+            prefetch=2,
+        )
+        with pytest.raises(requests.HTTPError):
+            list(paginator)
+
+
+class TestStreamingJsonPaginator:
+    @pytest.fixture
+    def requests_get(self, mocker):
+        pages = {
+            "https://example.com/people-000001.json": b'{"count": 3, "next": "https://example.com/people-000002.json", "results": [{"id": 1}, {"id": 2}]}',
+            "https://example.com/people-000002.json": b'{"count": 3, "results": [{"id": 3, "score": 1.5}], "next": null}',
+        }
+
+        def get(url, stream):
+            response = mocker.MagicMock(status_code=200)
+            response.__enter__.return_value = response
+            response.raw = io.BytesIO(pages[url])
+            return response
+
+        return mocker.patch("elections.helpers.requests.get", side_effect=get)
+
+    def test_yields_results_from_every_page(self, requests_get, mocker):
+        stdout = mocker.Mock()
+        paginator = StreamingJsonPaginator(
+            page1="https://example.com/people-000001.json", stdout=stdout
+        )
+        assert list(paginator) == [
+            {"id": 1},
+            {"id": 2},
+            {"id": 3, "score": 1.5},
+        ]
+        assert requests_get.call_count == 2
+        stdout.write.assert_any_call("https://example.com/people-000002.json\n")
+
 
 class TestYNRBallotImporter:
     @pytest.fixture
@@ -138,13 +434,20 @@ class TestYNRBallotImporter:
         self.orphan_post = PostFactory(
             label="Adur local election", ynr_id="foo"
         )
+        # only posts recorded as candidates are checked
+        unchecked_post = PostFactory(ynr_id="bar")
+        OrphanCandidate.objects.record(
+            OrphanCandidate.POST, [self.post.pk, self.orphan_post.pk]
+        )
 
-        deleted_posts, _ = importer.delete_orphan_posts()
+        deleted_posts = importer.delete_orphan_posts()
         query_set = Post.objects.all()
         assert deleted_posts == 1
-        assert query_set.count() == 1
+        assert query_set.count() == 2
         assert self.post in query_set
+        assert unchecked_post in query_set
         assert self.orphan_post not in query_set
+        assert not OrphanCandidate.objects.exists()
 
     def test_do_import_no_params(self, importer):
         """
@@ -307,44 +610,104 @@ class TestYNRBallotImporter:
                 expected = f"{settings.YNR_BASE}{case['url']}"
                 assert importer.import_url == expected
 
-    def test_add_replaced_ballot(self, importer, mocker, subtests):
-        ballot = mocker.Mock()
-        test_cases = [
-            {
-                "side_effect": PostElection.DoesNotExist,
-                "expected": False,
-                "assert": ballot.replaces.add.assert_not_called,
-                "replaced_ballot_id": None,
-            },
-            {
-                "side_effect": PostElection.DoesNotExist,
-                "expected": False,
-                "assert": ballot.replaces.add.assert_not_called,
-                "replaced_ballot_id": "not.a.valid.ballot.paper.id",
-            },
-            {
-                "side_effect": None,
-                "expected": True,
-                "assert": ballot.replaces.add.assert_called_once,
-                "replaced_ballot_id": "local.sheffield.fulwood.2020-05-07",
+    @pytest.mark.django_db
+    def test_link_replaced_ballots(self, importer):
+        replaced = PostElectionFactory(
+            ballot_paper_id="local.sheffield.fulwood.2020-05-07"
+        )
+        ballot = PostElectionFactory(
+            post=PostFactory(ynr_id="other"),
+            ballot_paper_id="local.sheffield.fulwood.2021-05-06",
+        )
+        importer.replaced_ballot_ids = {
+            replaced.ballot_paper_id: ballot.pk,
+            "not.a.valid.ballot.paper.id": ballot.pk,
+        }
+        importer.link_replaced_ballots()
+        assert list(ballot.replaces.all()) == [replaced]
+
+        with CaptureQueriesContext(connection) as queries:
+            importer.link_replaced_ballots()
+        # nothing changed, so nothing is written
+        assert len(queries) == 1
+
+    @pytest.mark.django_db
+    def test_attach_cancelled_ballot_info(self, mocker):
+        importer = YNRBallotImporter()
+        cancelled = PostElectionFactory(
+            ballot_paper_id="local.sheffield.fulwood.2021-05-06",
+            cancelled=True,
+        )
+        replacement = PostElectionFactory(
+            post=PostFactory(ynr_id="other"),
+            ballot_paper_id="local.sheffield.fulwood.2021-06-10",
+        )
+        ee_data = {
+            cancelled.ballot_paper_id: {
+                "replaced_by": replacement.ballot_paper_id,
+                "metadata": {"cancelled_election": {"title": "Cancelled"}},
             },
-        ]
-        for test_case in test_cases:
-            with subtests.test(msg=str(test_case)):
-                mocker.patch.object(
-                    PostElection.objects,
-                    "get",
-                    side_effect=test_case["side_effect"],
-                )
-                result = importer.add_replaced_ballot(
-                    ballot=ballot,
-                    replaced_ballot_id=test_case["replaced_ballot_id"],
-                )
-                assert result is test_case["expected"]
-                test_case["assert"]()
+        }
+        mocker.patch.object(
+            importer.ee_helper, "get_data", side_effect=ee_data.get
+        )
+        importer.cancelled_ballot_ids = {cancelled.pk}
+        BallotChange.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            importer.attach_cancelled_ballot_info()
+        cancelled.refresh_from_db()
+        assert cancelled.replaced_by == replacement
+        assert cancelled.metadata == {
+            "cancelled_election": {"title": "Cancelled"}
+        }
+        assert cancelled.modified > replacement.modified
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [cancelled.ballot_paper_id]
+
+        # the bulk_update, then rebuilding the changed ballot's card
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        assert len(updates) == 2
 
 
 class TestYNRImporterAddBallots:
+    @pytest.fixture
+    def candidacy(self):
+        return {
+            "person": {"name": "Joe Bloggs", "id": "9876"},
+            "result": None,
+            "elected": False,
+            "deselected": False,
+            "deselected_source": None,
+            "party_list_position": None,
+            "party": {
+                "url": "http://candidates.democracyclub.org.uk/api/next/parties/PP53/",
+                "ec_id": "PP53",
+                "name": "Labour Party",
+                "legacy_slug": "party:53",
+                "created": "2022-02-16T16:23:03.962770Z",
+                "modified": "2022-03-10T10:12:26.510945Z",
+            },
+            "party_name": "Labour Party",
+            "party_description_text": "Labour Party",
+            "created": "2022-03-16T11:25:42.328768Z",
+            "modified": "2022-03-17T12:36:20.946155Z",
+            "ballot": {
+                "url": "http://candidates.democracyclub.org.uk/api/next/ballots/local.cardiff.gabalfa.2022-05-05/",
+                "ballot_paper_id": "local.cardiff.gabalfa.2022-05-05",
+            },
+            "previous_party_affiliations": [
+                {
+                    "url": "http://candidates.democracyclub.org.uk/api/next/parties/ynmp-party:2/",
+                    "ec_id": "ynmp-party:2",
+                    "name": "Independent",
+                    "legacy_slug": "ynmp-party:2",
+                    "created": "2022-02-16T15:39:15.647123Z",
+                    "modified": "2022-02-16T17:13:11.323855Z",
+                }
+            ],
+        }
+
     @pytest.fixture
     def ballot_dict(self):
         return {
@@ -359,21 +722,22 @@ class TestYNRImporterAddBallots:
         }
 
     @pytest.fixture
-    def post(self, mocker):
-        return mocker.MagicMock(spec=Post)
+    def post(self, db):
+        return PostFactory(ynr_id="LBW:E05010817", label="Fulwood")
 
     @pytest.fixture
-    def election(self, mocker):
-        return mocker.MagicMock(spec=Election)
+    def election(self, db):
+        return ElectionFactory(slug="local.sheffield.2021-05-06", current=False)
 
     @pytest.fixture
-    def ballot(self, mocker):
-        ballot = mocker.MagicMock(spec=PostElection)
-        ballot.election.current = False
-        return ballot
+    def parties(self, db):
+        return [
+            PartyFactory(party_id="party:53", party_name="Labour Party"),
+            PartyFactory(party_id="ynmp-party:2", party_name="Independent"),
+        ]
 
     @pytest.fixture
-    def importer(self, post, election, ballot, mocker):
+    def importer(self, post, election, mocker):
         importer = YNRBallotImporter()
         importer.exclude_candidacies = True
         mocker.patch.object(
@@ -381,18 +745,15 @@ class TestYNRImporterAddBallots:
             "update_or_create_from_ballot_dict",
             return_value=election,
         )
+        mocker.patch.object(
+            importer.post_importer, "update_or_create_from_ballot_dicts"
+        )
         mocker.patch.object(
             importer.post_importer,
             "update_or_create_from_ballot_dict",
             return_value=post,
         )
-        mocker.patch.object(importer, "add_replaced_ballot")
-        mocker.patch.object(importer, "import_metadata_from_ee")
-        mocker.patch.object(
-            PostElection.objects,
-            "update_or_create",
-            return_value=(ballot, False),
-        )
+        mocker.patch.object(importer, "import_metadata_from_ee_for_ballots")
         return importer
 
     @pytest.mark.django_db
@@ -401,7 +762,7 @@ class TestYNRImporterAddBallots:
     ):
         """
         Test that the methods to update or create Election and Post
-        objects are called, and that a PostElection is updated with
+        objects are called, and that a PostElection is created with
         those objects and data from the the ballot dict
         """
         results = {"results": [ballot_dict]}
@@ -414,53 +775,93 @@ class TestYNRImporterAddBallots:
         importer.post_importer.update_or_create_from_ballot_dict.assert_called_once_with(
             ballot_dict
         )
-        PostElection.objects.update_or_create.assert_called_once_with(
-            ballot_paper_id="local.sheffield.fulwood.2021-05-06",
-            defaults={
-                "election": election,
-                "post": post,
-                "winner_count": 1,
-                "cancelled": False,
-                "locked": False,
-                "ynr_modified": "2021-10-12T00:00:00+00:00",
-            },
+        ballot = PostElection.objects.get(
+            ballot_paper_id="local.sheffield.fulwood.2021-05-06"
         )
+        assert ballot.election == election
+        assert ballot.post == post
+        assert ballot.winner_count == 1
+        assert ballot.cancelled is False
+        assert ballot.locked is False
+        assert ballot.ynr_modified.isoformat() == "2021-10-12T00:00:00+00:00"
+        assert importer.new_ballots_added is True
+
+    @pytest.mark.django_db
+    def test_add_ballots_updates_changed_ballots(self, importer, ballot_dict):
+        """
+        Test that existing ballots are updated, and that ballots that
+        haven't changed aren't written to
+        """
+        importer.add_ballots(results={"results": [ballot_dict]})
+        importer.new_ballots_added = False
+        ballot = PostElection.objects.get()
+
+        importer.add_ballots(results={"results": [ballot_dict]})
+        unchanged = PostElection.objects.get()
+        assert unchanged.modified == ballot.modified
+
+        ballot_dict["candidates_locked"] = True
+        ballot_dict["uncontested"] = True
+        importer.add_ballots(results={"results": [ballot_dict]})
+        updated = PostElection.objects.get()
+        assert updated.pk == ballot.pk
+        assert updated.locked is True
+        assert updated.contested is False
+        assert updated.modified > ballot.modified
+        assert importer.new_ballots_added is False
 
     @pytest.mark.django_db
     def test_add_ballots_not_recently_updated(self, importer, ballot_dict):
         """
-        Test that when not using recently_updated that the method to
-        add the replaced ballot relationship is not called
+        Test that when not using recently_updated that the replaced
+        ballot isn't recorded
         """
         results = {"results": [ballot_dict]}
         importer.recently_updated = False
         importer.add_ballots(results=results)
 
-        importer.add_replaced_ballot.assert_not_called()
+        assert importer.replaced_ballot_ids == {}
 
     @pytest.mark.django_db
     def test_add_ballots_is_recently_updated(
         self,
         importer,
         ballot_dict,
-        ballot,
     ):
         """
-        Test that when using recently_updated that the method to add
-        the replaced ballot relationship is called
+        Test that when using recently_updated that the replaced ballot is
+        recorded, to be linked once every page has been imported
         """
         results = {"results": [ballot_dict]}
         importer.recently_updated = True
         importer.add_ballots(results=results)
 
-        importer.add_replaced_ballot.assert_called_once_with(
-            ballot=ballot,
-            replaced_ballot_id="local.sheffield.fulwood.2020-05-07",
-        )
+        assert importer.replaced_ballot_ids == {
+            "local.sheffield.fulwood.2020-05-07": PostElection.objects.get().pk
+        }
+
+    @pytest.mark.django_db
+    def test_add_ballots_records_cancelled_ballots(
+        self, importer, ballot_dict, election
+    ):
+        """
+        Test that cancelled ballots are only checked for replacements when
+        they've changed or are current
+        """
+        Election.objects.filter(pk=election.pk).update(current=False)
+        ballot_dict["cancelled"] = True
+        ballot_dict["uncontested"] = False
+        importer.add_ballots(results={"results": [ballot_dict]})
+        ballot = PostElection.objects.get()
+        assert importer.cancelled_ballot_ids == {ballot.pk}
+
+        importer.cancelled_ballot_ids = set()
+        importer.add_ballots(results={"results": [ballot_dict]})
+        assert importer.cancelled_ballot_ids == set()
 
     @pytest.mark.django_db
     def test_import_metadata_from_ee(
-        self, importer, ballot_dict, ballot, subtests
+        self, importer, ballot_dict, election, subtests
     ):
         """
         For each test case, make sure that metadata is or is not
@@ -468,100 +869,159 @@ class TestYNRImporterAddBallots:
         """
         results = {"results": [ballot_dict]}
 
+        import_metadata = importer.import_metadata_from_ee_for_ballots
         test_cases = [
             {
                 "force_metadata": False,
                 "current": False,
-                "assert": importer.import_metadata_from_ee.assert_not_called,
+                "assert": import_metadata.assert_not_called,
             },
             {
                 "force_metadata": True,
                 "current": False,
-                "assert": importer.import_metadata_from_ee.assert_called_once,
+                "assert": import_metadata.assert_called_once,
             },
             {
                 "force_metadata": False,
                 "current": True,
-                "assert": importer.import_metadata_from_ee.assert_called_once,
+                "assert": import_metadata.assert_called_once,
             },
             {
                 "force_metadata": True,
                 "current": True,
-                "assert": importer.import_metadata_from_ee.assert_called_once,
+                "assert": import_metadata.assert_called_once,
             },
         ]
         for test_case in test_cases:
             # clear old calls before each test
-            importer.import_metadata_from_ee.reset_mock()
+            import_metadata.reset_mock()
             with subtests.test(msg=str(test_case)):
-                ballot.election.current = test_case["current"]
+                Election.objects.filter(pk=election.pk).update(
+                    current=test_case["current"]
+                )
                 importer.force_metadata = test_case["force_metadata"]
                 importer.add_ballots(results=results)
                 test_case["assert"]()
 
     @pytest.mark.django_db
     def test_import_ballots_adds_candidacies(
-        self, mocker, importer, ballot_dict, ballot
+        self, importer, ballot_dict, candidacy, parties
     ):
         """
         Tests that if candidacies are included the importer will create them
         """
-        ballot_dict["candidacies"] = [
-            {
-                "person": {"name": "Joe Bloggs", "id": "9876"},
-                "result": None,
-                "elected": False,
-                "deselected": False,
-                "deselected_source": None,
-                "party_list_position": None,
-                "party": {
-                    "url": "http://candidates.democracyclub.org.uk/api/next/parties/PP53/",
-                    "ec_id": "PP53",
-                    "name": "Labour Party",
-                    "legacy_slug": "party:53",
-                    "created": "2022-02-16T16:23:03.962770Z",
-                    "modified": "2022-03-10T10:12:26.510945Z",
-                },
-                "party_name": "Labour Party",
-                "party_description_text": "Labour Party",
-                "created": "2022-03-16T11:25:42.328768Z",
-                "modified": "2022-03-17T12:36:20.946155Z",
-                "ballot": {
-                    "url": "http://candidates.democracyclub.org.uk/api/next/ballots/local.cardiff.gabalfa.2022-05-05/",
-                    "ballot_paper_id": "local.cardiff.gabalfa.2022-05-05",
-                },
-                "previous_party_affiliations": [
-                    {
-                        "url": "http://candidates.democracyclub.org.uk/api/next/parties/ynmp-party:2/",
-                        "ec_id": "ynmp-party:2",
-                        "name": "Independent",
-                        "legacy_slug": "ynmp-party:2",
-                        "created": "2022-02-16T15:39:15.647123Z",
-                        "modified": "2022-02-16T17:13:11.323855Z",
-                    }
-                ],
-            },
-        ]
+        ballot_dict["candidacies"] = [candidacy]
 
         results = {"results": [ballot_dict]}
         importer.exclude_candidacies = False
         importer.recently_updated = True
+        importer.add_ballots(results=results)
 
-        person_post = mocker.MagicMock(spec=PersonPost)
-        mocker.patch.object(
-            PersonPost.objects, "create", return_value=person_post
+        person_post = PersonPost.objects.get()
+        assert person_post.person.ynr_id == 9876
+        assert person_post.person.name == "Joe Bloggs"
+        assert person_post.post_election.ballot_paper_id == (
+            "local.sheffield.fulwood.2021-05-06"
         )
-        party = mocker.MagicMock(spec=Party)
-        mocker.patch.object(Party.objects, "get", return_value=party)
-        importer.add_ballots(results=results)
+        assert person_post.party_id == "party:53"
+        assert person_post.elected is False
+        assert list(person_post.previous_party_affiliations.all()) == [
+            parties[1]
+        ]
 
-        ballot.personpost_set.all.return_value.delete.assert_called_once()
+    @pytest.mark.django_db
+    def test_import_ballots_updates_candidacies(
+        self, importer, ballot_dict, candidacy, parties
+    ):
+        """
+        Tests that candidacies that have changed are updated in place,
+        those no longer in YNR are removed and unchanged ones are left alone
+        """
+        other_candidacy = {
+            **candidacy,
+            "person": {"name": "Jane Smith", "id": "1234"},
+            "previous_party_affiliations": [],
+        }
+        ballot_dict["candidacies"] = [candidacy, other_candidacy]
+        importer.exclude_candidacies = False
+        importer.add_ballots(results={"results": [ballot_dict]})
+        person_post = PersonPost.objects.get(person_id=9876)
+        person_post.rank = 1
+        person_post.save()
+        ballot_modified = person_post.post_election.modified
+
+        candidacy["person"]["name"] = "Joseph Bloggs"
+        candidacy["result"] = {"elected": True, "num_ballots": 1000}
+        candidacy["previous_party_affiliations"] = []
+        ballot_dict["candidacies"] = [candidacy]
+        importer.add_ballots(results={"results": [ballot_dict]})
+
+        updated = PersonPost.objects.get()
+        assert updated.pk == person_post.pk
+        # fields that don't come from YNR are kept
+        assert updated.rank == 1
+        assert updated.person.name == "Joseph Bloggs"
+        assert updated.elected is True
+        assert updated.votes_cast == 1000
+        # ranked now that there's a result
+        assert updated.get_results_rank == "1st / 1 candidate"
+        assert updated.previous_party_affiliations.count() == 0
+        assert Person.objects.filter(ynr_id=1234).exists()
+        assert updated.post_election.modified > ballot_modified
 
-        PersonPost.objects.create.assert_called_once()
-        Party.objects.get.assert_called_once_with(party_id="ynmp-party:2")
-        person_post.previous_party_affiliations.add.assert_called_once_with(
-            party
-        )
+    @pytest.mark.django_db
+    def test_add_ballots_builds_cards(
+        self, importer, ballot_dict, candidacy, parties
+    ):
+        ballot_dict["candidacies"] = [candidacy]
+        importer.exclude_candidacies = False
+        importer.add_ballots(results={"results": [ballot_dict]})
+        ballot = PostElection.objects.get()
+        assert ballot.current_card["party_ballot_count"] == "one candidate"
+
+        ballot_dict["candidacies"] = [
+            candidacy,
+            {**candidacy, "person": {"name": "Jane Smith", "id": "1234"}},
+        ]
+        importer.add_ballots(results={"results": [ballot_dict]})
+        ballot = PostElection.objects.get()
+        assert ballot.current_card["party_ballot_count"] == "two candidates"
+
+    @pytest.mark.django_db
+    def test_add_ballots_queries_dont_grow_with_page_size(
+        self, importer, ballot_dict, candidacy, parties
+    ):
+        """
+        Tests that importing a page makes the same number of queries
+        regardless of how many ballots and candidacies are on it
+        """
+        importer.exclude_candidacies = False
+
+        def import_page(size):
+            page = []
+            posts = []
+            for i in range(size):
+                # each ballot needs its own post
+                posts.append(PostFactory(ynr_id=f"post-{size}-{i}"))
+                page.append(
+                    {
+                        **ballot_dict,
+                        "ballot_paper_id": f"local.sheffield.{size}-{i}.2021-05-06",
+                        "candidacies": [
+                            {
+                                **candidacy,
+                                "person": {"name": "A", "id": size * 100 + i},
+                            }
+                        ],
+                    }
+                )
+            post_importer = importer.post_importer
+            post_importer.update_or_create_from_ballot_dict.side_effect = posts
+            with CaptureQueriesContext(connection) as queries:
+                importer.add_ballots(results={"results": page})
+            return len(queries)
+
+        assert import_page(1) == import_page(5)
 
 
 class TestYNRBallotImporterDivisionType:
@@ -607,18 +1067,338 @@ class TestYNRBallotImporterDivisionType:
 
     def test_set_division_type_changed(self, ballot, mocker):
         """
-        Test that division_type gets updated
+        Test that division_type gets updated, but isn't saved until all the
+        ballots are done
         """
         importer = YNRBallotImporter(force_update=True)
         division = {"division": {"division_type": "NEW"}}
         mocker.patch.object(EEHelper, "get_data", return_value=division)
-        mocker.patch.object(ballot.post, "full_clean")
 
         assert importer.set_division_type(ballot=ballot) is None
         assert ballot.post.division_type == "NEW"
         EEHelper.get_data.assert_called_once_with(ballot.ballot_paper_id)
-        ballot.post.full_clean.assert_called_once()
-        ballot.post.save.assert_called_once()
+        ballot.post.save.assert_not_called()
+
+
+class TestYNRElectionImporterMetadata:
+    @pytest.fixture
+    def ee_data(self, mocker):
+        ee_data = {
+            "metadata": None,
+            "explanation": "An explanation",
+            "requires_voter_id": "EA-2022",
+            "cancellation_reason": None,
+            "voting_system": None,
+        }
+        mocker.patch.object(EEHelper, "get_data", return_value=ee_data)
+        return ee_data
+
+    @pytest.mark.django_db
+    def test_records_every_ballot_in_election(self, ee_data):
+        election = ElectionFactory()
+        ballots = [
+            PostElectionFactory(
+                election=election,
+                post=PostFactory(ynr_id=f"post-{i}"),
+                ballot_paper_id=f"local.foo.ward-{i}.2024-05-02",
+            )
+            for i in range(2)
+        ]
+        PostElectionFactory(
+            election=ElectionFactory(slug="local.bar.2024-05-02"),
+            post=PostFactory(ynr_id="other"),
+        )
+        BallotChange.objects.all().delete()
+        importer = YNRElectionImporter()
+        importer.import_metadata_from_ee(election)
+        election.refresh_from_db()
+        assert election.description == "An explanation"
+        assert set(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == {ballot.ballot_paper_id for ballot in ballots}
+
+        # nothing has changed, so nothing is recorded
+        BallotChange.objects.all().delete()
+        importer.import_metadata_from_ee(election)
+        assert not BallotChange.objects.exists()
+
+
+class TestYNRElectionImporter:
+    @pytest.fixture
+    def ballot_dict(self):
+        return {
+            "ballot_paper_id": "local.foo.ward.2024-05-02",
+            "election": {
+                "election_id": "local.foo.2024-05-02",
+                "election_date": "2024-05-02",
+                "name": "Foo local election",
+                "current": True,
+                "party_lists_in_use": False,
+            },
+        }
+
+    @pytest.mark.django_db
+    def test_uses_lists_change_modifies_ballots(self, ballot_dict, mocker):
+        mocker.patch.object(YNRElectionImporter, "import_metadata_from_ee")
+        election = YNRElectionImporter().update_or_create_from_ballot_dict(
+            ballot_dict
+        )
+        ballot = PostElectionFactory(
+            election=election, ballot_paper_id="local.foo.ward.2024-05-02"
+        )
+        PostElection.objects.all().build_cards()
+        BallotChange.objects.all().delete()
+
+        # nothing has changed
+        YNRElectionImporter().update_or_create_from_ballot_dict(ballot_dict)
+        assert PostElection.objects.get().modified == ballot.modified
+
+        ballot_dict["election"]["party_lists_in_use"] = True
+        YNRElectionImporter().update_or_create_from_ballot_dict(ballot_dict)
+        changed = PostElection.objects.get()
+        assert changed.modified > ballot.modified
+        assert changed.current_card is not None
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [ballot.ballot_paper_id]
+
+
+class TestYNRBallotImporterMetadata:
+    @pytest.fixture
+    def ee_data(self, mocker):
+        ee_data = {
+            "organisation": {
+                "territory_code": "ENG",
+                "organisation_type": "local-authority",
+            },
+            "division": {"territory_code": "ENG", "division_type": "MTW"},
+            "voting_system": {"slug": "FPTP", "name": "First-past-the-post"},
+            "metadata": None,
+            "requires_voter_id": "EA-2022",
+            "cancellation_reason": None,
+        }
+        mocker.patch.object(EEHelper, "get_data", return_value=ee_data)
+        return ee_data
+
+    @pytest.fixture
+    def ballots(self):
+        election = ElectionFactory(current=True)
+        return [
+            PostElectionFactory(
+                election=election,
+                post=PostFactory(ynr_id=f"post-{i}", territory=""),
+                ballot_paper_id=f"local.foo.ward-{i}.2024-05-02",
+                voting_system=None,
+            )
+            for i in range(3)
+        ]
+
+    @pytest.mark.django_db
+    def test_writes_once_for_all_ballots(
+        self, ballots, ee_data, django_assert_num_queries
+    ):
+        importer = YNRBallotImporter()
+        importer.voting_systems["FPTP"] = VotingSystem.objects.create(
+            slug="FPTP"
+        )
+        modified = ballots[0].modified
+        BallotChange.objects.all().delete()
+        ballots = list(
+            PostElection.objects.select_related("post").filter(
+                pk__in=[ballot.pk for ballot in ballots]
+            )
+        )
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_metadata_from_ee_for_ballots(ballots)
+        # one bulk_update for the posts and one for the ballots, and one
+        # update for the posts' other ballots, of which there are none
+        updates = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        assert len(updates) == 3
+
+        for ballot in PostElection.objects.select_related("post"):
+            assert ballot.voting_system_id == "FPTP"
+            assert ballot.requires_voter_id == "EA-2022"
+            assert ballot.post.territory == "ENG"
+            assert ballot.post.organization_type == "local-authority"
+            assert ballot.post.division_type == "MTW"
+            assert ballot.modified > modified
+        assert BallotChange.objects.count() == 3
+
+        # nothing has changed, so nothing is written
+        with django_assert_num_queries(0):
+            importer.import_metadata_from_ee_for_ballots(ballots)
+
+    @pytest.mark.django_db
+    def test_post_change_modifies_its_other_ballots(self, ballots, ee_data):
+        importer = YNRBallotImporter()
+        importer.voting_systems["FPTP"] = VotingSystem.objects.create(
+            slug="FPTP"
+        )
+        earlier = PostElectionFactory(
+            election=ElectionFactory(slug="local.foo.2020-05-07"),
+            post=ballots[0].post,
+            ballot_paper_id="local.foo.ward-0.2020-05-07",
+        )
+        BallotChange.objects.all().delete()
+
+        importer.import_metadata_from_ee_for_ballots(
+            list(
+                PostElection.objects.select_related("post").filter(
+                    election=ballots[0].election
+                )
+            )
+        )
+        earlier_now = PostElection.objects.get(pk=earlier.pk)
+        assert earlier_now.modified > earlier.modified
+        assert earlier_now.current_card is not None
+        assert BallotChange.objects.filter(
+            ballot_paper_id=earlier.ballot_paper_id
+        ).exists()
+
+    @pytest.mark.django_db
+    def test_post_change_records_ballot(self, ballots, ee_data):
+        importer = YNRBallotImporter()
+        importer.voting_systems["FPTP"] = VotingSystem.objects.create(
+            slug="FPTP"
+        )
+        ballots = list(PostElection.objects.select_related("post"))
+        importer.import_metadata_from_ee_for_ballots(ballots)
+        BallotChange.objects.all().delete()
+
+        # only the post of the first ballot changes
+        changed = ballots[0]
+        Post.objects.filter(pk=changed.post_id).update(territory="")
+        ballots = list(PostElection.objects.select_related("post"))
+        importer.import_metadata_from_ee_for_ballots(ballots)
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [changed.ballot_paper_id]
+
+    @pytest.mark.django_db
+    def test_invalid_division_type(self, ballots, ee_data):
+        ee_data["division"]["division_type"] = "NEW"
+        importer = YNRBallotImporter()
+        with pytest.raises(ValidationError):
+            importer.import_metadata_from_ee_for_ballots(ballots)
+        assert not Post.objects.filter(territory="ENG")
+
+
+class TestYNRBallotImporterEEChanges:
+    @pytest.fixture
+    def importer(self, mocker):
+        importer = YNRBallotImporter(stdout=mocker.Mock())
+        mocker.patch.object(
+            importer.election_importer, "import_metadata_from_ee"
+        )
+        mocker.patch.object(importer, "import_metadata_from_ee_for_ballots")
+        return importer
+
+    @pytest.mark.django_db
+    def test_check_for_ee_updates_uses_cursor(self, importer, mocker, freezer):
+        freezer.move_to("2024-04-01 12:00:00")
+        iter_modified = mocker.patch.object(
+            importer.ee_helper, "iter_modified_elections", return_value=[]
+        )
+        importer.check_for_ee_updates()
+        since = timezone.datetime(2024, 4, 1, 10, 55, tzinfo=timezone.utc)
+        assert iter_modified.call_args_list == [
+            mocker.call(since),
+            mocker.call(since, deleted=True),
+        ]
+        assert SyncCursor.objects.get().position == timezone.datetime(
+            2024, 4, 1, 12, tzinfo=timezone.utc
+        )
+
+        freezer.tick(60)
+        iter_modified.reset_mock()
+        importer.check_for_ee_updates()
+        since = timezone.datetime(2024, 4, 1, 11, 55, tzinfo=timezone.utc)
+        iter_modified.assert_called_with(since, deleted=True)
+
+    @pytest.mark.django_db
+    def test_cursor_not_moved_on_error(self, importer, mocker):
+        mocker.patch.object(
+            importer.ee_helper,
+            "iter_modified_elections",
+            side_effect=requests.HTTPError,
+        )
+        with pytest.raises(requests.HTTPError):
+            importer.check_for_ee_updates()
+        assert not SyncCursor.objects.filter(position__isnull=False)
+
+    @pytest.mark.django_db
+    def test_apply_ee_changes(self, importer, mocker):
+        build_cards = mocker.patch.object(PostElectionQuerySet, "build_cards")
+        election = ElectionFactory(slug="local.foo.2024-05-02")
+        ballot = PostElectionFactory(
+            election=election, ballot_paper_id="local.foo.bar.2024-05-02"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            importer.apply_ee_changes(
+                [
+                    {
+                        "election_id": "local.2024-05-02",
+                        "group_type": "election",
+                    },
+                    {
+                        "election_id": "local.foo.2024-05-02",
+                        "group_type": "organisation",
+                    },
+                    {
+                        "election_id": "local.foo.bar.2024-05-02",
+                        "group_type": None,
+                    },
+                    {"election_id": "local.baz.2024-05-02", "group_type": None},
+                ]
+            )
+        importer.election_importer.import_metadata_from_ee.assert_called_once_with(
+            election
+        )
+        importer.import_metadata_from_ee_for_ballots.assert_called_once_with(
+            [ballot]
+        )
+        # one query each for the elections and ballots
+        assert len(queries) == 2
+        build_cards.assert_called_once()
+
+    @pytest.mark.django_db
+    def test_apply_ee_deletions(self, importer, mocker):
+        invalidate = mocker.patch(
+            "elections.import_helpers.invalidate_postcode_lookups"
+        )
+        election = ElectionFactory(slug="local.foo.2024-05-02")
+        PostElectionFactory(
+            election=election, ballot_paper_id="local.foo.bar.2024-05-02"
+        )
+        kept = PostElectionFactory(
+            election=election,
+            post=PostFactory(ynr_id="other"),
+            ballot_paper_id="local.foo.baz.2024-05-02",
+        )
+        importer.apply_ee_deletions(
+            [{"election_id": "local.foo.bar.2024-05-02"}]
+        )
+        assert list(PostElection.objects.all()) == [kept]
+        assert Election.objects.exists()
+        invalidate.assert_called_once()
+
+    @pytest.mark.django_db
+    def test_apply_ee_deletions_with_election(self, importer, mocker):
+        invalidate = mocker.patch(
+            "elections.import_helpers.invalidate_postcode_lookups"
+        )
+        election = ElectionFactory(slug="local.foo.2024-05-02")
+        PostElectionFactory(
+            election=election, ballot_paper_id="local.foo.bar.2024-05-02"
+        )
+        importer.apply_ee_deletions([{"election_id": "local.foo.2024-05-02"}])
+        assert not PostElection.objects.exists()
+        # the ballot was deleted with its election
+        invalidate.assert_called_once()
 
 
 class TestYNRPostImporter:
@@ -655,3 +1435,39 @@ class TestYNRPostImporter:
         mock.assert_called_once_with(
             ynr_id="bar", defaults={"label": "example"}
         )
+
+    @pytest.mark.django_db
+    def test_update_or_create_from_ballot_dicts(self):
+        PostFactory(ynr_id="foo", label="old label")
+        ballot_dicts = [
+            {"post": {"id": "foo", "slug": "foo", "label": "new label"}},
+            {"post": {"id": None, "slug": "bar", "label": "example"}},
+            {"post": {"id": None, "slug": None, "label": "skipped"}},
+        ]
+        importer = YNRPostImporter()
+        importer.update_or_create_from_ballot_dicts(ballot_dicts)
+
+        assert dict(Post.objects.values_list("ynr_id", "label")) == {
+            "foo": "new label",
+            "bar": "example",
+        }
+        assert set(importer.post_cache) == {"foo", "bar"}
+
+    @pytest.mark.django_db
+    def test_relabelled_post_modifies_ballots(self):
+        ballot = PostElectionFactory(
+            post=PostFactory(ynr_id="foo", label="old label")
+        )
+        PostElection.objects.all().build_cards()
+        BallotChange.objects.all().delete()
+        importer = YNRPostImporter()
+        importer.update_or_create_from_ballot_dicts(
+            [{"post": {"id": "foo", "slug": "foo", "label": "new label"}}]
+        )
+
+        relabelled = PostElection.objects.get()
+        assert relabelled.modified > ballot.modified
+        assert relabelled.current_card is not None
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [ballot.ballot_paper_id]
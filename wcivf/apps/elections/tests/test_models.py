@@ -362,6 +362,48 @@ class TestPostElectionModel:
             == "six parties or independent candidates"
         )
 
+    @pytest.mark.django_db
+    def test_with_ballot_stats(self, django_assert_num_queries):
+        post_election = PostElectionFactory(
+            election=ElectionFactoryLazySlug(uses_lists=True)
+        )
+        empty = PostElectionFactory(
+            post=PostFactory(ynr_id="empty"),
+            election=post_election.election,
+        )
+        independent = PartyFactory(party_id="ynmp-party:2")
+        party = PartyFactory(party_id="party:1")
+        for candidacy_party in [independent, independent, party, party]:
+            PersonPostFactory(
+                post_election=post_election,
+                post=post_election.post,
+                election=post_election.election,
+                party=candidacy_party,
+            )
+
+        ballots = PostElection.objects.with_ballot_stats().select_related(
+            "election"
+        )
+        with django_assert_num_queries(1):
+            stats = {
+                ballot.pk: (
+                    ballot.candidate_count,
+                    ballot.independent_count,
+                    ballot.party_count,
+                    ballot.party_ballot_count,
+                )
+                for ballot in ballots
+            }
+        assert stats == {
+            post_election.pk: (
+                4,
+                2,
+                1,
+                "three parties or independent candidates",
+            ),
+            empty.pk: (0, 0, 0, None),
+        }
+
     @pytest.mark.django_db
     def test_postal_vote_requires_form(self):
         election = ElectionWithPostFactory(
@@ -463,3 +505,89 @@ class TestPostElectionModel:
         newer_ballot.ballot_paper_id = "parl.place.2025-01-01"
         assert newer_ballot.get_voter_id_requirements == "EA-2022"
         assert newer_ballot.get_postal_voting_requirements == "EA-2022"
+
+    @pytest.mark.django_db
+    @pytest.mark.freeze_time("2021-5-1")
+    def test_build_cards(self, django_assert_num_queries):
+        post = PostFactory(territory="ENG")
+        old = PostElectionFactory(
+            post=post,
+            ballot_paper_id="local.place.ward.2019-05-06",
+            election=ElectionFactoryLazySlug(
+                election_date="2019-5-6", current=False, election_type="local"
+            ),
+        )
+        future = PostElectionFactory(
+            post=post,
+            ballot_paper_id="local.place.ward.2021-05-06",
+            election=ElectionFactoryLazySlug(
+                election_date="2021-5-6", current=True, election_type="local"
+            ),
+        )
+        for party_id in ["PP1", "PP2"]:
+            PersonPostFactory(
+                post_election=future,
+                election=future.election,
+                party=PartyFactory(party_id=party_id),
+            )
+
+        assert PostElection.objects.all().build_cards() == 2
+
+        future = PostElection.objects.select_related("post", "election").get(
+            pk=future.pk
+        )
+        assert future.card == {
+            "built_from": future.modified.timestamp(),
+            "party_ballot_count": "two candidates",
+            "expected_sopn_date": future.get_expected_sopn_date().isoformat(),
+            "voter_id_requirements": None,
+            "postal_voting_requirements": "RPA2000",
+            "later_ballots": [],
+        }
+        with django_assert_num_queries(0):
+            assert future.party_ballot_count == "two candidates"
+            assert future.get_voter_id_requirements is None
+            assert future.expected_sopn_date == datetime.date(2021, 4, 9)
+
+        old = PostElection.objects.select_related("post", "election").get(
+            pk=old.pk
+        )
+        assert old.card["later_ballots"] == [
+            ["2021-05-06", "local.place.ward.2021-05-06"]
+        ]
+        assert old.next_ballot == future
+
+    @pytest.mark.django_db
+    def test_build_cards_only_writes_changed_cards(self):
+        post_election = PostElectionFactory()
+        PersonPostFactory(
+            post_election=post_election, election=post_election.election
+        )
+        assert PostElection.objects.all().build_cards() == 1
+        assert PostElection.objects.all().build_cards() == 0
+
+        PersonPostFactory(
+            post_election=post_election,
+            election=post_election.election,
+            person=PersonFactory(),
+            party=PartyFactory(party_id="PP2"),
+        )
+        assert PostElection.objects.all().build_cards() == 1
+        post_election.refresh_from_db()
+        assert post_election.party_ballot_count == "two candidates"
+
+    @pytest.mark.django_db
+    def test_card_ignored_when_ballot_changed(self):
+        post_election = PostElectionFactory()
+        PersonPostFactory(
+            post_election=post_election, election=post_election.election
+        )
+        PostElection.objects.all().build_cards()
+        post_election.refresh_from_db()
+        assert post_election.current_card is not None
+
+        post_election.card["party_ballot_count"] = "stale"
+        post_election.save()
+        post_election = PostElection.objects.get(pk=post_election.pk)
+        assert post_election.current_card is None
+        assert post_election.party_ballot_count == "one candidate"
@@ -0,0 +1,108 @@
+import time
+from unittest import mock
+
+import pytest
+from django.test import RequestFactory
+from elections.postcode_logger import BufferedPostcodeLogger
+from elections.views.mixins import LogLookUpMixin
+
+
+@pytest.fixture
+def client_logger(settings):
+    settings.POSTCODE_LOGGER = mock.MagicMock()
+    settings.POSTCODE_LOGGER.entry_class = dict
+    settings.POSTCODE_LOGGER.dc_product.wcivf = "WCIVF"
+    return settings.POSTCODE_LOGGER
+
+
+def logged_postcodes(client_logger):
+    return [call.args[0]["postcode"] for call in client_logger.log.mock_calls]
+
+
+def test_log_and_flush(client_logger):
+    postcode_logger = BufferedPostcodeLogger(flush_interval=60)
+
+    assert postcode_logger.log(postcode="SW1A 1AA", utm_source="test")
+    assert postcode_logger.log(postcode="E3 2NX")
+    # nothing's written in the request
+    client_logger.log.assert_not_called()
+
+    postcode_logger.flush()
+    assert client_logger.log.mock_calls == [
+        mock.call(
+            {
+                "dc_product": "WCIVF",
+                "calls_devs_dc_api": True,
+                "postcode": "SW1A 1AA",
+                "utm_source": "test",
+            }
+        ),
+        mock.call(
+            {
+                "dc_product": "WCIVF",
+                "calls_devs_dc_api": True,
+                "postcode": "E3 2NX",
+            }
+        ),
+    ]
+    assert postcode_logger.stats == {
+        "queued": 0,
+        "written": 2,
+        "failed": 0,
+        "dropped": 0,
+    }
+    postcode_logger.close()
+
+
+def test_writes_in_background(client_logger):
+    postcode_logger = BufferedPostcodeLogger(batch_size=2, flush_interval=60)
+
+    postcode_logger.log(postcode="SW1A 1AA")
+    postcode_logger.log(postcode="E3 2NX")
+    # a full batch wakes the thread up
+    for _ in range(100):
+        if postcode_logger.stats["written"] == 2:
+            break
+        time.sleep(0.01)
+    assert logged_postcodes(client_logger) == ["SW1A 1AA", "E3 2NX"]
+
+    # and anything left is written on close
+    postcode_logger.log(postcode="TN4 0PP")
+    postcode_logger.close()
+    assert logged_postcodes(client_logger)[-1] == "TN4 0PP"
+
+
+def test_drops_when_full(client_logger):
+    postcode_logger = BufferedPostcodeLogger(max_size=2, flush_interval=60)
+
+    assert postcode_logger.log(postcode="SW1A 1AA")
+    assert postcode_logger.log(postcode="E3 2NX")
+    assert not postcode_logger.log(postcode="TN4 0PP")
+
+    postcode_logger.close()
+    assert logged_postcodes(client_logger) == ["SW1A 1AA", "E3 2NX"]
+    assert postcode_logger.stats["dropped"] == 1
+
+
+def test_failures_counted(client_logger, caplog):
+    client_logger.log.side_effect = [None, Exception("Firehose down")]
+    postcode_logger = BufferedPostcodeLogger(flush_interval=60)
+
+    postcode_logger.log(postcode="SW1A 1AA")
+    postcode_logger.log(postcode="E3 2NX")
+    postcode_logger.close()
+
+    assert postcode_logger.stats["written"] == 1
+    assert postcode_logger.stats["failed"] == 1
+    assert "Failed to write 1 of 2 postcode log entries" in caplog.text
+
+
+def test_log_postcode_uses_utm_data(mocker):
+    log = mocker.patch("elections.views.mixins.postcode_logger.log")
+    view = LogLookUpMixin()
+    view.request = RequestFactory().get("/")
+    view.request.utm_data = {"utm_source": "test"}
+
+    view.log_postcode("SW1A 1AA")
+
+    log.assert_called_once_with(postcode="SW1A 1AA", utm_source="test")
@@ -1,18 +1,30 @@
+import threading
+
 import pytest
 import vcr
-from django.db.models import Count
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Value
 from django.test import TestCase, override_settings
 from django.urls import reverse
 from elections.models import InvalidPostcodeError, PostElection
+from elections.postcode_logger import postcode_logger
 from elections.tests.factories import (
     ElectionFactory,
     PostElectionFactory,
     PostFactory,
 )
-from elections.views.mixins import PostcodeToPostsMixin
-from elections.views.postcode_view import PostcodeView
+from elections.views.mixins import (
+    BallotQueryExecutor,
+    PostcodeToPostsMixin,
+    PostelectionsToPeopleMixin,
+)
+from elections.views.postcode_view import AsyncPostcodeView, PostcodeView
 from freezegun import freeze_time
+from hustings.models import Husting
 from parishes.models import ParishCouncilElection
+from people.tests.factories import PersonPostFactory
 from pytest_django import asserts
 
 
@@ -107,6 +119,7 @@ class PostcodeViewTests(TestCase):
                 },
                 HTTP_AUTHORIZATION="Token foo",
             )
+            postcode_logger.flush()
 
         logging_message = None
         for record in captured.records:
@@ -132,6 +145,7 @@ class PostcodeViewTests(TestCase):
                 },
                 HTTP_AUTHORIZATION="Token foo",
             )
+            postcode_logger.flush()
         for record in captured.records:
             assert not record.message.startswith("dc-postcode-searches")
 
@@ -158,7 +172,7 @@ class TestPostcodeViewPolls:
             "registration": {},
         }
         mocker.patch(
-            "requests.get",
+            "requests.Session.get",
             return_value=response,
             autospec=True,
         )
@@ -782,6 +796,146 @@ class TestPostcodeViewMethods:
         assert view_obj.get_voter_id_status() is None
 
 
+class TestAsyncPostcodeView:
+    def test_invalid_postcode_redirects(self, mocker, client):
+        mocker.patch.object(
+            PostcodeToPostsMixin,
+            "postcode_to_ballots",
+            side_effect=InvalidPostcodeError,
+        )
+        url = reverse("postcode_view", kwargs={"postcode": "SW1A 1AA"})
+        response = client.get(url)
+
+        assert response.status_code == 302
+        assert response.url == "/?invalid_postcode=1&postcode=SW1A%201AA"
+
+    @pytest.mark.django_db
+    def test_people_fetched_for_each_ballot(self, rf, mocker):
+        election = ElectionFactory()
+        ballots = [
+            PostElectionFactory(
+                election=election, post=PostFactory(ynr_id="a")
+            ),
+            PostElectionFactory(
+                election=election, post=PostFactory(ynr_id="b")
+            ),
+        ]
+        mocker.patch.object(
+            PostcodeToPostsMixin,
+            "postcode_to_ballots",
+            return_value={
+                "address_picker": False,
+                "ballots": PostElection.objects.annotate(
+                    num_parish_councils=Count("parish_councils"),
+                    past_date=Value(0),
+                ).order_by("pk"),
+            },
+        )
+        mocker.patch.object(AsyncPostcodeView, "log_postcode")
+        people_for_ballot = mocker.patch.object(
+            PostelectionsToPeopleMixin,
+            "people_for_ballot",
+            side_effect=lambda ballot, compact: [ballot.ballot_paper_id],
+        )
+        view = AsyncPostcodeView()
+        view.setup(rf.get("/"), postcode="SW1A1AA")
+
+        context = async_to_sync(view.aget_context_data)(postcode="SW1A1AA")
+
+        assert people_for_ballot.call_count == 2
+        assert [ballot.people for ballot in context["postelections"]] == [
+            [ballot.ballot_paper_id] for ballot in ballots
+        ]
+
+    def test_apeople_for_ballots_outside_transaction(self, mocker):
+        """
+        Outside of a transaction the ballots are fetched in
+        ballot_query_executor's threads, and the results are returned in
+        the same order as the ballots
+        """
+        mocker.patch("elections.views.mixins.connection", in_atomic_block=False)
+        mocker.patch.object(
+            PostelectionsToPeopleMixin,
+            "people_for_ballot",
+            side_effect=lambda ballot, compact: [
+                ballot,
+                compact,
+                threading.current_thread().name.startswith("ballot-query"),
+            ],
+        )
+        mixin = PostelectionsToPeopleMixin()
+
+        people = async_to_sync(mixin.apeople_for_ballots)(
+            ["a", "b", "c"], compact=True
+        )
+
+        assert people == [
+            ["a", True, True],
+            ["b", True, True],
+            ["c", True, True],
+        ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_apeople_for_ballots_queries_concurrently(mocker):
+    """
+    Ballots are fetched from the database concurrently, reusing each
+    thread's connection rather than opening one for every ballot, until
+    the executor closes them
+    """
+    executor = BallotQueryExecutor(max_workers=2)
+    mocker.patch("elections.views.mixins.ballot_query_executor", executor)
+    ballots = []
+    for i in range(4):
+        ballot = PostElectionFactory(post=PostFactory(ynr_id=f"post-{i}"))
+        PersonPostFactory(
+            post_election=ballot,
+            post=ballot.post,
+            election=ballot.election,
+            person__name=f"Candidate {i}",
+        )
+        ballots.append(ballot)
+    ballots = list(
+        PostElection.objects.select_related("election").order_by("pk")
+    )
+    used_connections = set()
+    used_threads = set()
+    closed_threads = set()
+    close_all = connections.close_all
+    mocker.patch.object(
+        connections,
+        "close_all",
+        side_effect=lambda: (
+            closed_threads.add(threading.current_thread().name),
+            close_all(),
+        ),
+    )
+
+    class Mixin(PostelectionsToPeopleMixin):
+        def people_for_ballot(self, postelection, compact=False):
+            people = super().people_for_ballot(postelection, compact=compact)
+            used_connections.add(connections["default"])
+            used_threads.add(threading.current_thread().name)
+            return people
+
+    try:
+        for _ in range(2):
+            cache.clear()
+            people = async_to_sync(Mixin().apeople_for_ballots)(ballots)
+            assert [
+                [candidacy.person.name for candidacy in candidacies]
+                for candidacies in people
+            ] == [[f"Candidate {i}"] for i in range(4)]
+
+        # eight ballots were fetched, over the two threads' connections
+        assert len(used_connections) <= 2
+
+        executor.close_connections()
+        assert used_threads <= closed_threads
+    finally:
+        executor.shutdown()
+
+
 class TestPostcodeiCalView:
     def test_invalid_postcode_redirects(self, mocker, client):
         mocker.patch.object(
@@ -806,3 +960,69 @@ class TestPostcodeiCalView:
 
         assert response.status_code == 302
         assert response.url == "/?invalid_postcode=1&postcode=TE1%201ST"
+
+    @pytest.fixture
+    def ballot(self, mocker):
+        ballot = PostElectionFactory(
+            election=ElectionFactory(election_date="2030-05-02")
+        )
+        mocker.patch.object(
+            PostcodeToPostsMixin,
+            "postcode_to_ballots",
+            return_value={
+                "address_picker": False,
+                "polling_station": {},
+                "ballots": PostElection.objects.select_related(
+                    "post", "election"
+                ).prefetch_related("husting_set"),
+            },
+        )
+        return ballot
+
+    @pytest.mark.django_db
+    @freeze_time("2030-04-01")
+    def test_ical_hustings(self, ballot, client):
+        Husting.objects.create(
+            post_election=ballot,
+            title="Future husting",
+            url="https://example.com/future",
+            starts="2030-04-20T19:00:00Z",
+        )
+        Husting.objects.create(
+            post_election=ballot,
+            title="Past husting",
+            url="https://example.com/past",
+            starts="2030-03-20T19:00:00Z",
+        )
+        url = reverse("postcode_ical_view", kwargs={"postcode": "TE11ST"})
+
+        response = client.get(url)
+
+        assert response.status_code == 200
+        content = response.content.decode()
+        assert ballot.election.name in content
+        assert "Future husting" in content
+        assert "Past husting" not in content
+
+    @pytest.mark.django_db
+    def test_ical_conditional_get(self, ballot, client):
+        url = reverse("postcode_ical_view", kwargs={"postcode": "TE11ST"})
+        response = client.get(url)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == 304
+
+        # a different postcode has a different calendar
+        other_url = reverse("postcode_ical_view", kwargs={"postcode": "TE11SU"})
+        response = client.get(other_url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+        ballot.cancelled = True
+        ballot.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
@@ -4,11 +4,11 @@ from elections.views.postcode_view import DummyPostcodeView
 
 from .helpers import ElectionIDSwitcher
 from .views import (
+    AsyncPostcodeView,
     ElectionsView,
     ElectionView,
     PartyListVew,
     PostcodeiCalView,
-    PostcodeView,
     PostView,
     RedirectPostView,
 )
@@ -75,7 +75,7 @@ urlpatterns = [
     ),
     re_path(
         r"^(?P<postcode>[^/]+)/(?P<uprn>[^/]+)/$",
-        PostcodeView.as_view(),
+        AsyncPostcodeView.as_view(),
         name="uprn_view",
     ),
     re_path(
@@ -89,6 +89,8 @@ urlpatterns = [
         name="uprn_ical_view",
     ),
     re_path(
-        r"^(?P<postcode>[^/]+)/$", PostcodeView.as_view(), name="postcode_view"
+        r"^(?P<postcode>[^/]+)/$",
+        AsyncPostcodeView.as_view(),
+        name="postcode_view",
     ),
 ]
@@ -1,2 +1,6 @@
-from .postcode_view import PostcodeView, PostcodeiCalView  # noqa
+from .postcode_view import (  # noqa
+    AsyncPostcodeView,
+    PostcodeiCalView,
+    PostcodeView,
+)
 from .election_views import *  # noqa
@@ -42,7 +42,7 @@ class ElectionView(NewSlugsRedirectMixin, DetailView):
         queryset = queryset.filter(slug=pk).prefetch_related(
             Prefetch(
                 "postelection_set",
-                queryset=PostElection.objects.all()
+                queryset=PostElection.objects.with_ballot_stats()
                 .select_related("election", "post")
                 .order_by("post__label"),
             )
@@ -88,9 +88,11 @@ class PostView(NewSlugsRedirectMixin, PostelectionsToPeopleMixin, DetailView):
         if queryset is None:
             queryset = self.get_queryset()
 
-        queryset = queryset.filter(
-            ballot_paper_id=self.kwargs["election"]
-        ).select_related("post", "election")
+        queryset = (
+            queryset.filter(ballot_paper_id=self.kwargs["election"])
+            .select_related("post", "election")
+            .with_ballot_stats()
+        )
 
         try:
             # Get the single item from the filtered queryset
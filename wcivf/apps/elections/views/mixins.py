@@ -1,25 +1,35 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from typing import Optional
 
-from core.utils import LastWord
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Case, Count, F, IntegerField, Prefetch, When
-from django.db.models.functions import Coalesce
+from django.db import connection, connections
+from django.db.models import Case, Count, IntegerField, Prefetch, When
 from django.http import HttpResponsePermanentRedirect, HttpResponseRedirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.views import View
 from elections.constants import (
     PEOPLE_FOR_BALLOT_KEY_FMT,
     UPDATED_SLUGS,
 )
-from elections.devs_dc_client import DevsDCAPIException, DevsDCClient
+from elections.devs_dc_client import CachedDevsDCClient, DevsDCAPIException
+from elections.postcode_logger import postcode_logger
 from leaflets.models import Leaflet
 from uk_election_timetables.calendars import Country
 from uk_election_timetables.election import TimetableEvent
 from uk_election_timetables.election_ids import from_election_id
 
-DEVS_DC_CLIENT = DevsDCClient()
+DEVS_DC_CLIENT = CachedDevsDCClient()
 
 
 class PostcodeToPostsMixin(object):
@@ -72,6 +82,7 @@ class PostcodeToPostsMixin(object):
         pes = pes.annotate(
             num_parish_councils=Count("parish_councils"),
         )
+        pes = pes.with_ballot_stats()
         pes = pes.select_related("post")
         pes = pes.select_related("election")
         pes = pes.select_related("election__voting_system")
@@ -85,35 +96,130 @@ class PostcodeToPostsMixin(object):
         return ret
 
 
+class BallotsConditionalGetMixin:
+    """
+    Works out an ETag and Last-Modified for responses built from a list of
+    ballots, so that clients polling them can be sent a 304 Not Modified
+    rather than the whole response being built again.
+
+    The ballots, their elections and posts, and their (prefetched)
+    hustings are checked. Anything else the response shows, like the
+    candidates, has to be passed in `extra`, and won't be reflected in the
+    Last-Modified.
+    """
+
+    def get_ballots_version(self, ballots, *extra):
+        """
+        Returns the ETag and Last-Modified datetime (or None, if there are
+        no ballots) for the ballots and any other JSON serializable values
+        in `extra` that the response depends on
+        """
+        digest = hashlib.sha256(
+            json.dumps(extra, sort_keys=True, default=str).encode()
+        )
+        timestamps = []
+        for ballot in ballots:
+            hustings = [
+                (husting.pk, husting.modified)
+                for husting in ballot.husting_set.all()
+            ]
+            # elections and posts don't have a modified timestamp, so use
+            # their values
+            related_values = [
+                getattr(obj, field.attname)
+                for obj in (ballot.election, ballot.post)
+                for field in obj._meta.concrete_fields
+            ]
+            digest.update(
+                repr(
+                    (ballot.pk, ballot.modified, related_values, hustings)
+                ).encode()
+            )
+            timestamps.append(ballot.modified)
+            timestamps += [modified for _, modified in hustings]
+        return quote_etag(digest.hexdigest()), max(timestamps, default=None)
+
+    def get_not_modified_response(self, request, etag, last_modified):
+        """
+        Returns a 304 response if the client's copy is current, otherwise
+        None
+        """
+        if last_modified:
+            last_modified = int(last_modified.timestamp())
+        return get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+
+    def set_version_headers(self, response, etag, last_modified):
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+
+class BallotQueryExecutor(ThreadPoolExecutor):
+    """
+    A thread pool whose threads are long lived and keep their database
+    connections between requests, so there are at most `max_workers` of
+    those in each process, rather than a new connection for every ballot
+    """
+
+    def __init__(self, max_workers, thread_name_prefix="ballot-query"):
+        super().__init__(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix
+        )
+        self.max_workers = max_workers
+
+    def close_connections(self, timeout=30):
+        """
+        Closes the database connections of every thread, for when they
+        mustn't be left open, such as before dropping a database. Each
+        thread is given a task that closes its connections and then waits
+        for the others, so that no thread takes more than one.
+        """
+        barrier = threading.Barrier(self.max_workers)
+
+        def close():
+            connections.close_all()
+            barrier.wait(timeout)
+
+        futures = [self.submit(close) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+
+# The threads that fetch the people for each ballot on a page
+ballot_query_executor = BallotQueryExecutor(
+    max_workers=settings.BALLOT_QUERY_THREADS
+)
+
+
 class PostelectionsToPeopleMixin(object):
     def people_for_ballot(self, postelection, compact=False):
+        """
+        Returns the candidacies on a ballot with everything needed to show
+        them already fetched.
+
+        The evaluated queryset is cached, keyed by when the ballot was last
+        modified. The importers update that timestamp whenever a ballot's
+        candidates, or their details, leaflets or pledges, change, so a
+        stale list is never served.
+        """
         key = PEOPLE_FOR_BALLOT_KEY_FMT.format(
-            postelection.ballot_paper_id, compact
+            postelection.ballot_paper_id,
+            compact,
+            postelection.modified.timestamp(),
         )
         people_for_post = cache.get(key)
-        if people_for_post:
+        if people_for_post is not None:
             return people_for_post
-        people_for_post = postelection.personpost_set.all()
-        people_for_post = people_for_post.annotate(
-            last_name=LastWord("person__name")
-        )
-        people_for_post = people_for_post.annotate(
-            name_for_ordering=Coalesce("person__sort_name", "last_name")
-        )
-        if postelection.election.uses_lists:
-            order_by = ["party__party_name", "list_position"]
-        else:
-            order_by = ["name_for_ordering", "person__name"]
-
-        people_for_post = people_for_post.order_by(
-            F("elected").desc(nulls_last=True),
-            F("votes_cast").desc(nulls_last=True),
-            *order_by,
+        people_for_post = postelection.personpost_set.all().in_ballot_order(
+            postelection.election.uses_lists
         )
-
         people_for_post = people_for_post.select_related(
             "post",
             "election",
+            "post_election",
             "person",
             "party",
         )
@@ -133,9 +239,56 @@ class PostelectionsToPeopleMixin(object):
             people_for_post = people_for_post.prefetch_related(
                 "person__pledges"
             )
+        # evaluate now so that the results, including everything
+        # prefetched, are cached rather than the query
+        len(people_for_post)
         cache.set(key, people_for_post)
         return people_for_post
 
+    async def apeople_for_ballots(self, postelections, compact=False):
+        """
+        Returns the result of people_for_ballot for each ballot in a list,
+        fetching them concurrently in ballot_query_executor's threads.
+
+        Other connections can't see changes made in a transaction that
+        hasn't been committed, so if the caller is in one the ballots are
+        fetched one after another using its connection instead.
+        """
+        in_transaction = await sync_to_async(
+            lambda: connection.in_atomic_block
+        )()
+        if in_transaction:
+            people_for_ballot = sync_to_async(self.people_for_ballot)
+            return await asyncio.gather(
+                *(
+                    people_for_ballot(postelection, compact=compact)
+                    for postelection in postelections
+                )
+            )
+
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    ballot_query_executor,
+                    contextvars.copy_context().run,
+                    functools.partial(
+                        self.people_for_ballot_in_thread,
+                        postelection,
+                        compact=compact,
+                    ),
+                )
+                for postelection in postelections
+            )
+        )
+
+    def people_for_ballot_in_thread(self, postelection, compact=False):
+        # the connection is kept from earlier requests, so make sure it
+        # still works first
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+        return self.people_for_ballot(postelection, compact=compact)
+
 
 class PollingStationInfoMixin(object):
     def show_polling_card(self, post_elections):
@@ -182,13 +335,12 @@ class PollingStationInfoMixin(object):
 
 class LogLookUpMixin(object):
     def log_postcode(self: View, postcode):
-        entry = settings.POSTCODE_LOGGER.entry_class(
-            postcode=postcode,
-            dc_product=settings.POSTCODE_LOGGER.dc_product.wcivf,
-            calls_devs_dc_api=True,
-            **self.request.session.get("utm_data"),
+        """
+        Queues the lookup to be logged, see elections.postcode_logger
+        """
+        postcode_logger.log(
+            postcode=postcode, **getattr(self.request, "utm_data", {})
         )
-        settings.POSTCODE_LOGGER.log(entry)
 
 
 class NewSlugsRedirectMixin(object):
@@ -1,17 +1,28 @@
 from typing import Optional
 
+from asgiref.sync import sync_to_async
 from core.helpers import clean_postcode
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.http import (
+    HttpResponse,
+    HttpResponsePermanentRedirect,
+    HttpResponseRedirect,
+)
+from django.urls import reverse
 from django.utils import timezone
 from django.views.generic import TemplateView, View
+from elections.constants import ICAL_KEY_FMT
 from elections.dummy_models import DummyPostElection
 from elections.models import InvalidPostcodeError
+from hustings.models import Husting
 from icalendar import Calendar, Event, vText
 from parishes.models import ParishCouncilElection
 
 from ..devs_dc_client import DevsDCAPIException
 from .mixins import (
+    BallotsConditionalGetMixin,
     LogLookUpMixin,
     NewSlugsRedirectMixin,
     PollingStationInfoMixin,
@@ -82,9 +93,9 @@ class PostcodeView(
         context["show_polling_card"] = self.show_polling_card(
             context["postelections"]
         )
-        context["is_before_registration_deadline"] = (
-            self.is_before_registration_deadline(context["postelections"])
-        )
+        context[
+            "is_before_registration_deadline"
+        ] = self.is_before_registration_deadline(context["postelections"])
         context["people_for_post"] = {}
         for postelection in context["postelections"]:
             postelection.people = self.people_for_ballot(postelection)
@@ -92,14 +103,14 @@ class PostcodeView(
         context["council"] = self.ballot_dict.get("electoral_services")
         context["registration"] = self.ballot_dict.get("registration")
 
-        context["advance_voting_station"] = (
-            self.get_advance_voting_station_info(context["polling_station"])
-        )
+        context[
+            "advance_voting_station"
+        ] = self.get_advance_voting_station_info(context["polling_station"])
 
         context["ballots_today"] = self.get_todays_ballots()
-        context["multiple_city_of_london_elections_today"] = (
-            self.multiple_city_of_london_elections_today()
-        )
+        context[
+            "multiple_city_of_london_elections_today"
+        ] = self.multiple_city_of_london_elections_today()
         context["referendums"] = list(self.get_referendums())
         context["parish_council_election"] = self.get_parish_council_election()
         context["num_ballots"] = self.num_ballots()
@@ -226,11 +237,91 @@ class PostcodeView(
         return None
 
 
+class AsyncPostcodeView(PostcodeView):
+    """
+    An async version of PostcodeView, with the same context and redirects.
+
+    Rather than fetching the candidates for each ballot one after another,
+    they are all fetched at once after the postcode lookup, so the time
+    taken is that of the slowest ballot. Under ASGI the worker is also free
+    to serve other requests while this one waits on the Devs DC API or the
+    database.
+    """
+
+    people_by_ballot = None
+
+    async def get(self, request, *args, **kwargs):
+        given_slug = self.kwargs.get(self.pk_url_kwarg)
+        updated_slug = self.get_changed_election_slug(given_slug)
+        if updated_slug != given_slug:
+            return HttpResponsePermanentRedirect(
+                reverse("election_view", kwargs={"election": updated_slug})
+            )
+
+        try:
+            context = await self.aget_context_data(**kwargs)
+        except (InvalidPostcodeError, DevsDCAPIException):
+            return HttpResponseRedirect(
+                "/?invalid_postcode=1&postcode={}".format(self.postcode)
+            )
+        response = self.render_to_response(context)
+        # the templates call model methods that can query the database
+        return await sync_to_async(response.render)()
+
+    async def aget_context_data(self, **kwargs):
+        self.postcode = clean_postcode(kwargs["postcode"])
+        self.uprn = self.kwargs.get("uprn")
+        self.people_by_ballot = {}
+
+        # the lookup has to come first as everything else depends on which
+        # ballots the postcode has
+        ballot_dict = await sync_to_async(self.get_ballot_dict)()
+        if not ballot_dict.get("address_picker"):
+            ballots = await sync_to_async(list)(ballot_dict["ballots"])
+            people = await self.apeople_for_ballots(ballots)
+            self.people_by_ballot = {
+                ballot.pk: people_for_ballot
+                for ballot, people_for_ballot in zip(ballots, people)
+            }
+
+        return await sync_to_async(self.get_context_data)(**kwargs)
+
+    def people_for_ballot(self, postelection, compact=False):
+        people = None
+        if self.people_by_ballot:
+            people = self.people_by_ballot.get(postelection.pk)
+        if people is None:
+            people = super().people_for_ballot(postelection, compact=compact)
+        return people
+
+
 class PostcodeiCalView(
-    NewSlugsRedirectMixin, PostcodeToPostsMixin, View, PollingStationInfoMixin
+    NewSlugsRedirectMixin,
+    PostcodeToPostsMixin,
+    BallotsConditionalGetMixin,
+    View,
+    PollingStationInfoMixin,
 ):
+    """
+    A calendar of the elections and hustings for a postcode.
+
+    Calendar clients poll this, so responses have an ETag and Last-Modified
+    for them to make conditional requests with, and the calendar for each
+    version is cached.
+    """
+
     pk_url_kwarg = "postcode"
 
+    def get_calendar(self, postcode):
+        cal = Calendar()
+        cal["summary"] = "Elections in {}".format(postcode)
+        cal["X-WR-CALNAME"] = "Elections in {}".format(postcode)
+        cal["X-WR-TIMEZONE"] = "Europe/London"
+
+        cal.add("version", "2.0")
+        cal.add("prodid", "-//Elections in {}//mxm.dk//".format(postcode))
+        return cal
+
     def get(self, request, *args, **kwargs):
         postcode = kwargs["postcode"]
         uprn = kwargs.get("uprn")
@@ -245,19 +336,12 @@ class PostcodeiCalView(
 
         polling_station = self.ballot_dict.get("polling_station")
 
-        cal = Calendar()
-        cal["summary"] = "Elections in {}".format(postcode)
-        cal["X-WR-CALNAME"] = "Elections in {}".format(postcode)
-        cal["X-WR-TIMEZONE"] = "Europe/London"
-
-        cal.add("version", "2.0")
-        cal.add("prodid", "-//Elections in {}//mxm.dk//".format(postcode))
-
         # If we need the user to enter an address then we
         # need to add an event asking them to do this.
         # This is a bit of a hack, but there's no real other
         # way to tell the user about address pickers
         if self.ballot_dict.get("address_picker", False):
+            cal = self.get_calendar(postcode)
             event = Event()
             event["uid"] = f"{postcode}-address-picker"
             event["summary"] = "You may have upcoming elections"
@@ -276,7 +360,35 @@ class PostcodeiCalView(
             cal.add_component(event)
             return HttpResponse(cal.to_ical(), content_type="text/calendar")
 
-        for post_election in self.ballot_dict["ballots"]:
+        # only future hustings are added, fetched for all the ballots at once
+        ballots = list(
+            self.ballot_dict["ballots"]
+            .prefetch_related(None)
+            .prefetch_related(
+                Prefetch("husting_set", queryset=Husting.objects.future())
+            )
+        )
+        etag, last_modified = self.get_ballots_version(
+            ballots, postcode, uprn, polling_station
+        )
+        response = self.get_not_modified_response(request, etag, last_modified)
+        if response:
+            return response
+
+        key = ICAL_KEY_FMT.format(etag.strip('"'))
+        ical = cache.get(key)
+        if ical is None:
+            ical = self.get_ballots_calendar(
+                postcode, ballots, polling_station
+            ).to_ical()
+            cache.set(key, ical, settings.ICAL_CACHE_TTL)
+
+        response = HttpResponse(ical, content_type="text/calendar")
+        return self.set_version_headers(response, etag, last_modified)
+
+    def get_ballots_calendar(self, postcode, ballots, polling_station):
+        cal = self.get_calendar(postcode)
+        for post_election in ballots:
             if post_election.cancelled:
                 continue
             event = Event()
@@ -313,7 +425,7 @@ class PostcodeiCalView(
             cal.add_component(event)
 
             # add hustings events if there are any in the future
-            for husting in post_election.husting_set.future():
+            for husting in post_election.husting_set.all():
                 event = Event()
                 event["uid"] = husting.uuid
                 event["summary"] = husting.title
@@ -324,7 +436,7 @@ class PostcodeiCalView(
                 event.add("DESCRIPTION", f"Find out more at {husting.url}")
                 cal.add_component(event)
 
-        return HttpResponse(cal.to_ical(), content_type="text/calendar")
+        return cal
 
 
 class DummyPostcodeView(PostcodeView):
@@ -351,8 +463,10 @@ class DummyPostcodeView(PostcodeView):
         )
         context["show_polling_card"] = True
         context["polling_station"] = self.get_polling_station()
-        context["is_before_registration_deadline"] = (
-            PostcodeView().is_before_registration_deadline(context["postelections"])
+        context[
+            "is_before_registration_deadline"
+        ] = PostcodeView().is_before_registration_deadline(
+            context["postelections"]
         )
         context["registration"] = self.get_registration()
         context["council"] = self.get_electoral_services()
@@ -4,6 +4,7 @@ Importer for all our important Hustings data
 
 import datetime
 
+from api.export import write_snapshot
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
@@ -164,6 +165,10 @@ class Command(BaseCommand):
             if answer != "y":
                 return None
 
+        # ballots whose hustings aren't imported again have changed too
+        PostElection.objects.filter(
+            husting__isnull=False
+        ).distinct().record_changes()
         count, _ = Husting.objects.all().delete()
         self.stdout.write(f"Deleting {count} Husting objects")
 
@@ -176,4 +181,5 @@ class Command(BaseCommand):
         for url in urls:
             self.importer = HustingImporter(url=url)
             self.import_hustings()
+        write_snapshot()
         return None
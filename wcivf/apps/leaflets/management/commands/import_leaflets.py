@@ -1,14 +1,22 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
 from django.utils import timezone as tz
 from django.utils.http import urlencode
 from elections.models import PostElection
 from leaflets.models import Leaflet
 from people.models import Person
 
+BASE_URL = "https://electionleaflets.org/api/leaflets"
+# How many leaflets are saved at once
+BATCH_SIZE = 500
+# How many seconds to wait for Election Leaflets to respond
+REQUEST_TIMEOUT = 30
+
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
@@ -25,16 +33,17 @@ class Command(BaseCommand):
             help="Import leaflets uploaded since last imported Leaflet",
         )
 
-    @transaction.atomic
     def handle(self, **options):
-        base_url = "https://electionleaflets.org/api/leaflets"
-
+        self.seen = set()
         qs = PostElection.objects.filter(election__current=True)
         if options["recently_uploaded"]:
             # delete non current leaflets
-            Leaflet.objects.exclude(
+            old_leaflets = Leaflet.objects.exclude(
                 person__personpost__post_election__in=qs
-            ).delete()
+            )
+            person_ids = set(old_leaflets.values_list("person_id", flat=True))
+            old_leaflets.delete()
+            self.update_ballots(person_ids)
 
             try:
                 last_uploaded = (
@@ -53,51 +62,173 @@ class Command(BaseCommand):
                 )
 
             params = urlencode({"date_uploaded__gt": last_uploaded})
-            url = f"{base_url}/?{params}"
-            req = requests.get(url)
-            while url:
-                if req.status_code == 200:
-                    results = req.json()
-                    url = results.get("next", None)
-                    self.add_leaflets(results.get("results", []))
-                else:
-                    url = None
+            results, _ = self.get_pages(f"{BASE_URL}/?{params}")
+            for i in range(0, len(results), BATCH_SIZE):
+                self.add_leaflets(results[i : i + BATCH_SIZE])
         else:
-            Leaflet.objects.all().delete()
-            for ballot in qs:
-                url = f"{base_url}/?ballot={ballot.ballot_paper_id}"
-                while url:
-                    req = requests.get(url)
-                    if req.status_code == 200:
-                        results = req.json()
-                        url = results.get("next", None)
-                        self.add_leaflets(results.get("results", []))
-                    else:
-                        url = None
+            self.import_current_ballots()
+
+    def get_pages(self, url):
+        """
+        Returns the leaflets from each page of results starting at `url`,
+        and whether every page was downloaded
+        """
+        results = []
+        while url:
+            try:
+                req = requests.get(url, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException:
+                return results, False
+            if req.status_code != 200:
+                return results, False
+            page = req.json()
+            results.extend(page.get("results", []))
+            url = page.get("next", None)
+        return results, True
+
+    def import_current_ballots(self):
+        """
+        Downloads the leaflets for each current ballot, a few ballots at a
+        time, and saves them in batches as they arrive. Leaflets that are
+        no longer on any current ballot are deleted at the end, rather than
+        deleting everything first, so the site carries on showing leaflets
+        while this runs.
+        """
+        ballot_paper_ids = PostElection.objects.filter(
+            election__current=True
+        ).values_list("ballot_paper_id", flat=True)
+        urls = (
+            f"{BASE_URL}/?ballot={ballot_paper_id}"
+            for ballot_paper_id in ballot_paper_ids
+        )
+
+        complete = True
+        batch = []
+        workers = settings.LEAFLETS_IMPORT_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # futures in ballot order. Only a few more ballots than there
+            # are workers are downloaded ahead of those being saved, to
+            # bound how many leaflets are held in memory at once
+            pending = deque()
+            while True:
+                while len(pending) < workers * 2:
+                    url = next(urls, None)
+                    if url is None:
+                        break
+                    pending.append(executor.submit(self.get_pages, url))
+                if not pending:
+                    break
+                results, downloaded = pending.popleft().result()
+                complete = complete and downloaded
+                batch.extend(results)
+                if len(batch) >= BATCH_SIZE:
+                    self.add_leaflets(batch)
+                    batch = []
+        if batch:
+            self.add_leaflets(batch)
+
+        if not complete:
+            self.stderr.write(
+                "Not every ballot's leaflets could be downloaded, "
+                "so no leaflets were deleted"
+            )
+            return
+        self.delete_unseen_leaflets()
 
     def add_leaflets(self, results):
+        """
+        Saves the leaflets for each person on them, writing only the ones
+        that are new or have changed
+        """
+        rows = {}
         for leaflet in results:
             if "people" not in leaflet:
                 continue
+            upload_date = datetime.strptime(
+                leaflet["date_uploaded"].split(".")[0], "%Y-%m-%dT%H:%M:%S"
+            )
+            dt_aware = tz.make_aware(upload_date, tz.get_current_timezone())
             for person_data in leaflet["people"]:
-                person_id = list(person_data.keys())[0]
-                thumb_url = leaflet["first_page_thumb"]
-                leaflet_id = leaflet["pk"]
-                upload_date = datetime.strptime(
-                    leaflet["date_uploaded"].split(".")[0], "%Y-%m-%dT%H:%M:%S"
+                person_id = int(list(person_data.keys())[0])
+                rows[(leaflet["pk"], person_id)] = (
+                    leaflet["first_page_thumb"],
+                    dt_aware,
                 )
-                dt_aware = tz.make_aware(upload_date, tz.get_current_timezone())
-                try:
-                    person = Person.objects.get_by_pk_or_redirect_from_ynr(
-                        person_id
-                    )
-                    Leaflet.objects.update_or_create(
-                        leaflet_id=leaflet_id,
-                        person=person,
-                        defaults={
-                            "thumb_url": thumb_url,
-                            "date_uploaded_to_electionleaflets": dt_aware,
-                        },
-                    )
-                except Person.DoesNotExist:
-                    print("No person found with id %s" % person_id)
+
+        # people that were merged in YNR get the leaflets of the people
+        # merged into them
+        person_ids = Person.objects.resolve_pks(
+            {person_id for _, person_id in rows}
+        )
+        leaflets = {}
+        for (leaflet_id, person_id), (thumb_url, uploaded) in rows.items():
+            if person_id not in person_ids:
+                self.stdout.write(f"No person found with id {person_id}")
+                continue
+            person_id = person_ids[person_id]
+            leaflets[(leaflet_id, person_id)] = Leaflet(
+                leaflet_id=leaflet_id,
+                person_id=person_id,
+                thumb_url=thumb_url,
+                date_uploaded_to_electionleaflets=uploaded,
+            )
+        self.seen.update(leaflets)
+
+        existing_leaflets = Leaflet.objects.filter(
+            leaflet_id__in={leaflet_id for leaflet_id, _ in leaflets}
+        ).values_list(
+            "leaflet_id",
+            "person_id",
+            "thumb_url",
+            "date_uploaded_to_electionleaflets",
+        )
+        existing = {
+            (leaflet_id, person_id): (thumb_url, uploaded)
+            for leaflet_id, person_id, thumb_url, uploaded in existing_leaflets
+        }
+        to_write = [
+            leaflet
+            for key, leaflet in leaflets.items()
+            if existing.get(key)
+            != (leaflet.thumb_url, leaflet.date_uploaded_to_electionleaflets)
+        ]
+        Leaflet.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=["leaflet_id", "person"],
+            update_fields=["thumb_url", "date_uploaded_to_electionleaflets"],
+            batch_size=BATCH_SIZE,
+        )
+        self.update_ballots({leaflet.person_id for leaflet in to_write})
+        return to_write
+
+    def delete_unseen_leaflets(self):
+        """
+        Deletes the leaflets that weren't in this import
+        """
+        unseen = []
+        person_ids = set()
+        for pk, leaflet_id, person_id in Leaflet.objects.values_list(
+            "pk", "leaflet_id", "person_id"
+        ).iterator():
+            if (leaflet_id, person_id) not in self.seen:
+                unseen.append(pk)
+                person_ids.add(person_id)
+        for i in range(0, len(unseen), BATCH_SIZE):
+            Leaflet.objects.filter(pk__in=unseen[i : i + BATCH_SIZE]).delete()
+        self.update_ballots(person_ids)
+        self.stdout.write(f"Deleted {len(unseen)} leaflets")
+
+    def update_ballots(self, person_ids):
+        """
+        Marks the ballots of people whose leaflets have changed as
+        modified, so that their cached candidates are fetched again
+        """
+        if not person_ids:
+            return
+        ballots = PostElection.objects.filter(
+            personpost__person_id__in=person_ids
+        ).distinct()
+        ballots.update(modified=tz.now())
+        ballots.record_changes()
+        ballots.build_cards()
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.11 on 2026-10-17 12:40
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def delete_duplicate_leaflets(apps, schema_editor):
+    """
+    Leaflets used to be deleted and imported again each time, which could
+    leave more than one row for a leaflet and person if imports overlapped.
+    Keep the newest of each so the unique constraint can be added.
+    """
+    Leaflet = apps.get_model("leaflets", "Leaflet")
+    duplicates = (
+        Leaflet.objects.values("leaflet_id", "person_id")
+        .annotate(count=Count("pk"), keep=Max("pk"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        Leaflet.objects.filter(
+            leaflet_id=duplicate["leaflet_id"],
+            person_id=duplicate["person_id"],
+        ).exclude(pk=duplicate["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("people", "0049_personredirect"),
+        ("leaflets", "0002_auto_20210603_0922"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_leaflets, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name="leaflet",
+            unique_together={("leaflet_id", "person")},
+        ),
+    ]
@@ -17,3 +17,6 @@ class Leaflet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     objects = LeafletQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("leaflet_id", "person")
@@ -0,0 +1,212 @@
+from io import StringIO
+
+import pytest
+import requests
+from django.utils import timezone
+from elections.models import BallotChange, PostElection
+from elections.tests.factories import PostElectionFactory, PostFactory
+from leaflets.management.commands.import_leaflets import BASE_URL, Command
+from leaflets.models import Leaflet
+from people.models import PersonRedirect
+from people.tests.factories import PersonFactory, PersonPostFactory
+
+
+def leaflet_json(pk, person_id, thumb="https://example.com/thumb.jpg"):
+    return {
+        "pk": pk,
+        "first_page_thumb": thumb,
+        "date_uploaded": "2024-05-01T10:00:00.123",
+        "people": [{str(person_id): "A Person"}],
+    }
+
+
+@pytest.fixture
+def stderr():
+    return StringIO()
+
+
+@pytest.fixture
+def command(stderr):
+    command = Command(stdout=StringIO(), stderr=stderr)
+    command.seen = set()
+    return command
+
+
+@pytest.fixture
+def mock_get(mocker):
+    return mocker.patch(
+        "leaflets.management.commands.import_leaflets.requests.get"
+    )
+
+
+@pytest.mark.django_db
+class TestImportLeaflets:
+    def test_add_leaflets(self, command):
+        person = PersonFactory(ynr_id=1)
+        merged_into = PersonFactory(ynr_id=3)
+        PersonRedirect.objects.update_from_ynr(
+            [{"old_person_id": 2, "new_person_id": 3}]
+        )
+
+        written = command.add_leaflets(
+            [
+                leaflet_json(10, 1),
+                leaflet_json(11, 2),
+                leaflet_json(12, 99),
+                {"pk": 13},
+            ]
+        )
+
+        assert len(written) == 2
+        assert set(Leaflet.objects.values_list("leaflet_id", "person_id")) == {
+            (10, person.pk),
+            (11, merged_into.pk),
+        }
+        assert command.seen == {(10, person.pk), (11, merged_into.pk)}
+
+    def test_add_leaflets_only_writes_changes(self, command):
+        PersonFactory(ynr_id=1)
+        command.add_leaflets([leaflet_json(10, 1), leaflet_json(11, 1)])
+        created_at = Leaflet.objects.get(leaflet_id=10).created_at
+
+        written = command.add_leaflets(
+            [leaflet_json(10, 1), leaflet_json(11, 1, thumb="https://a.b/")]
+        )
+
+        assert [leaflet.leaflet_id for leaflet in written] == [11]
+        assert Leaflet.objects.count() == 2
+        assert Leaflet.objects.get(leaflet_id=11).thumb_url == "https://a.b/"
+        assert Leaflet.objects.get(leaflet_id=10).created_at == created_at
+
+    def test_ballots_of_changed_leaflets_modified(self, command):
+        ballot = PostElectionFactory()
+        PersonPostFactory(
+            person=PersonFactory(ynr_id=1),
+            post_election=ballot,
+            post=ballot.post,
+            election=ballot.election,
+        )
+        PostElection.objects.all().build_cards()
+        BallotChange.objects.all().delete()
+        modified = PostElection.objects.get().modified
+
+        command.add_leaflets([leaflet_json(10, 1)])
+        assert PostElection.objects.get().modified > modified
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [ballot.ballot_paper_id]
+
+        # deleting it changes the ballot again
+        modified = PostElection.objects.get().modified
+        command.seen = set()
+        command.delete_unseen_leaflets()
+        assert PostElection.objects.get().modified > modified
+        assert BallotChange.objects.count() == 2
+
+    def test_import_current_ballots(self, command, mock_get, mocker, settings):
+        settings.LEAFLETS_IMPORT_WORKERS = 2
+        PersonFactory(ynr_id=1)
+        PersonFactory(ynr_id=2)
+        for ynr_id in ("post-1", "post-2"):
+            PostElectionFactory(
+                post=PostFactory(ynr_id=ynr_id),
+                ballot_paper_id=f"local.{ynr_id}.2024-05-02",
+                election__current=True,
+            )
+        Leaflet.objects.create(leaflet_id=1, person_id=2)
+        kept = Leaflet.objects.create(
+            leaflet_id=10,
+            person_id=1,
+            thumb_url="https://example.com/thumb.jpg",
+            date_uploaded_to_electionleaflets=timezone.make_aware(
+                timezone.datetime(2024, 5, 1, 10)
+            ),
+        )
+        pages = {
+            f"{BASE_URL}/?ballot=local.post-1.2024-05-02": {
+                "results": [leaflet_json(10, 1)],
+                "next": "page-2",
+            },
+            "page-2": {"results": [leaflet_json(11, 2)], "next": None},
+            f"{BASE_URL}/?ballot=local.post-2.2024-05-02": {
+                "results": [leaflet_json(10, 1)],
+                "next": None,
+            },
+        }
+
+        def get(url, timeout):
+            response = mocker.MagicMock()
+            response.status_code = 200
+            response.json.return_value = pages[url]
+            return response
+
+        mock_get.side_effect = get
+
+        command.import_current_ballots()
+
+        assert set(Leaflet.objects.values_list("leaflet_id", "person_id")) == {
+            (10, 1),
+            (11, 2),
+        }
+        assert Leaflet.objects.get(leaflet_id=10).pk == kept.pk
+
+    def test_failed_download_deletes_nothing(self, command, mock_get, stderr):
+        PersonFactory(ynr_id=1)
+        PostElectionFactory(election__current=True)
+        Leaflet.objects.create(leaflet_id=1, person_id=1)
+        mock_get.return_value.status_code = 500
+
+        command.import_current_ballots()
+
+        assert Leaflet.objects.count() == 1
+        assert "no leaflets were deleted" in stderr.getvalue()
+
+    def test_timeout_deletes_nothing(self, command, mock_get, stderr):
+        PersonFactory(ynr_id=1)
+        PostElectionFactory(election__current=True)
+        Leaflet.objects.create(leaflet_id=1, person_id=1)
+        mock_get.side_effect = requests.Timeout
+
+        command.import_current_ballots()
+
+        assert mock_get.call_args.kwargs["timeout"]
+        assert Leaflet.objects.count() == 1
+        assert "no leaflets were deleted" in stderr.getvalue()
+
+    def test_downloads_a_few_ballots_ahead(self, command, mocker, settings):
+        settings.LEAFLETS_IMPORT_WORKERS = 1
+        mocker.patch(
+            "leaflets.management.commands.import_leaflets.BATCH_SIZE", 1
+        )
+        for i in range(10):
+            PostElectionFactory(
+                post=PostFactory(ynr_id=f"post-{i}"),
+                ballot_paper_id=f"local.post-{i}.2024-05-02",
+                election__current=True,
+            )
+        downloaded = []
+
+        def get_pages(url):
+            downloaded.append(url)
+            return [url], True
+
+        mocker.patch.object(command, "get_pages", side_effect=get_pages)
+        # how many ballots had been downloaded as each is saved
+        downloaded_when_saved = []
+        add_leaflets = mocker.patch.object(
+            command,
+            "add_leaflets",
+            side_effect=lambda results: downloaded_when_saved.append(
+                len(downloaded)
+            ),
+        )
+        mocker.patch.object(command, "delete_unseen_leaflets")
+
+        command.import_current_ballots()
+
+        assert add_leaflets.call_count == 10
+        # saved in the order they were asked for
+        saved = [call.args[0][0] for call in add_leaflets.call_args_list]
+        assert saved == downloaded
+        for saved, count in enumerate(downloaded_when_saved):
+            assert count <= saved + 2
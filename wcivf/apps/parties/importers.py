@@ -3,7 +3,7 @@ from collections import namedtuple
 
 from core.helpers import twitter_username
 from core.mixins import ReadFromFileMixin, ReadFromUrlMixin
-from elections.models import Election, PostElection
+from elections.models import BallotChange, Election, PostElection
 from parties.models import LocalParty, Manifesto, Party
 
 LocalElection = namedtuple("LocalElection", ["date", "csv_files"])
@@ -36,9 +36,15 @@ class LocalPartyImporter(ReadFromUrlMixin, ReadFromFileMixin):
         Deletes LocalParty objects associated with elections for the given
         election date
         """
-        count, _ = LocalParty.objects.filter(
+        local_parties = LocalParty.objects.filter(
             file_url__in=self.election.csv_files,
-        ).delete()
+        )
+        BallotChange.objects.record(
+            local_parties.values_list(
+                "post_election__ballot_paper_id", flat=True
+            )
+        )
+        count, _ = local_parties.delete()
 
         self.write(f"Deleted {count} local parties")
 
@@ -8,7 +8,16 @@ from elections.models import Election
 from model_utils.models import TimeStampedModel
 
 
-class PartyManager(models.Manager):
+class PartyQuerySet(models.QuerySet):
+    def with_candidate_counts(self):
+        """
+        Annotates each party with the number of candidacies it has had, as
+        `candidate_count`
+        """
+        return self.annotate(candidate_count=models.Count("personpost"))
+
+
+class PartyManager(models.Manager.from_queryset(PartyQuerySet)):
     def update_or_create_from_ynr(self, party):
         defaults = {
             "party_name": party["name"],
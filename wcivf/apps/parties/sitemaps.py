@@ -7,6 +7,7 @@ class PartySitemap(Sitemap):
     changefreq = "daily"
     priority = 0.5
     protocol = "https"
+    changed_field = None
 
     def items(self):
         return Party.objects.all()
@@ -41,4 +41,4 @@ class PartyView(DetailView):
 
         return ["parties/party_detail.html"]
 
-    queryset = Party.objects.all()
+    queryset = Party.objects.with_candidate_counts()
@@ -38,7 +38,11 @@ class YNRPersonImporter:
             yield page
 
     def paginator(self, url):
-        return JsonPaginator(page1=url, stdout=self.stdout)
+        return JsonPaginator(
+            page1=url,
+            stdout=self.stdout,
+            prefetch=settings.IMPORT_PREFETCH_PAGES,
+        )
 
     def delete_deleted_people(self):
         deleted_ynr_pks = []
@@ -6,7 +6,6 @@ import csv
 import datetime
 
 import requests
-from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from people.models import AssociatedCompany, Person
@@ -42,27 +41,9 @@ class Command(BaseCommand):
         AssociatedCompany.objects.all().delete()
 
     def get_person(self, person_id):
-        try:
-            return Person.objects.get(ynr_id=person_id)
-        except Person.DoesNotExist:
-            # if this person doesn't exist in WhoCIVF
-            # this could be due to a merge.
-            # See if we can get an alternative person id from YNR
-            url = settings.YNR_BASE + "/api/v0.9/person_redirects/" + person_id
-            req = requests.get(url)
-            result = req.json()
-
-            if "new_person_id" not in result:
-                # we couldn't find an alt person id, re-raise the exception
-                raise
-
-            try:
-                # see if the alt person id exists
-                return Person.objects.get(ynr_id=result["new_person_id"])
-            except Person.DoesNotExist:
-                # this person still doesn't exist in WhoCIVF
-                # re-raise the exception
-                raise
+        # if this person doesn't exist in WhoCIVF this could be due to a
+        # merge, in which case we use the person they were merged into
+        return Person.objects.get_by_pk_or_redirect(person_id)
 
     def create_company(self, data):
         """
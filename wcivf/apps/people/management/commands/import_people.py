@@ -1,25 +1,30 @@
-import json
-import os
-import shutil
-import tempfile
 from urllib.parse import urlencode
 
 import requests
+from api.export import write_snapshot
 from core.helpers import show_data_on_error
+from core.models import OrphanCandidate
+from core.orphans import delete_orphans
 from dateutil.parser import parse
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.utils import timezone
+from elections.helpers import StreamingJsonPaginator
 from elections.import_helpers import YNRBallotImporter
-from elections.models import PostElection
+from elections.models import BallotChange, PostElection
 from parties.models import Party
-from people.models import Person
+from people.models import Person, PersonPost, PersonRedirect
 
 from wcivf.apps.elections.import_helpers import time_function_length
 from wcivf.apps.people.import_helpers import YNRPersonImporter
 
+YNR_REDIRECT_TIMEOUT = 10
+
 
 class Command(BaseCommand):
+    batch_size = 200
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--recently-updated",
@@ -43,6 +48,13 @@ class Command(BaseCommand):
             default=False,
             help="Ignore candidacies when importing people",
         )
+        parser.add_argument(
+            "--all-redirects",
+            action="store_true",
+            dest="all_redirects",
+            default=False,
+            help="Save every person redirect in YNR, not just recent ones",
+        )
 
     def valid_date(self, value):
         return parse(value)
@@ -69,123 +81,126 @@ class Command(BaseCommand):
         if options["recently_updated"]:
             importer = YNRPersonImporter(params={"last_updated": last_updated})
             for page in importer.people_to_import:
-                self.add_people(results=page)
+                self.stdout.write(f"Found {page['count']} people to import")
+                self.add_people(people=page["results"])
 
         else:
-            self.dirpath = tempfile.mkdtemp()
-            self.download_pages()
             self.add_to_db()
-            shutil.rmtree(self.dirpath)
 
         self.delete_merged_people()
         self.delete_orphaned_people()
+        write_snapshot()
 
     def add_to_db(self):
-        self.existing_people = set(Person.objects.values_list("pk", flat=True))
-        self.seen_people = set()
-
-        files = [f for f in os.listdir(self.dirpath) if f.endswith(".json")]
-        files = sorted(files, key=lambda k: int(k.split("-")[-1].split(".")[0]))
-        for file in files:
-            self.stdout.write("Importing {}".format(file))
-            with open(os.path.join(self.dirpath, file), "r") as f:
-                results = json.loads(f.read())
-                self.add_people(results)
-
-        should_clean_up = not any(
-            [
-                self.options["recently_updated"],
-                self.options["since"],
-            ]
-        )
-        if should_clean_up:
-            deleted_ids = self.existing_people.difference(self.seen_people)
-            Person.objects.filter(ynr_id__in=deleted_ids).delete()
-
-    def save_page(self, url, page):
-        # get the file name from the page number
-        if "cached-api" in url:
-            filename = url.split("/")[-1]
-        else:
-            if "page=" in url:
-                page_number = url.split("page=")[1].split("&")[0]
-
-            else:
-                page_number = 1
-            filename = "page-{}.json".format(page_number)
-        file_path = os.path.join(self.dirpath, filename)
-
-        # Save the page
-        with open(file_path, "w") as f:
-            f.write(page)
-
-    def download_pages(self):
+        # people are parsed from the responses one at a time, and saved in
+        # batches so that memory use doesn't depend on the page size
+        batch = []
+        for person in self.iter_people():
+            batch.append(person)
+            if len(batch) == self.batch_size:
+                self.add_people(people=batch)
+                batch = []
+        if batch:
+            self.add_people(people=batch)
+
+    @property
+    def import_url(self):
         params = {"page_size": "200"}
         if self.options["recently_updated"] or self.options["since"]:
             params["last_updated"] = self.past_time_str
 
-            next_page = settings.YNR_BASE + "/api/next/people/?{}".format(
+            return settings.YNR_BASE + "/api/next/people/?{}".format(
                 urlencode(params)
             )
-        else:
-            next_page = (
-                settings.YNR_BASE
-                + "/media/cached-api/latest/people-000001.json"
-            )
+        return settings.YNR_BASE + "/media/cached-api/latest/people-000001.json"
 
-        while next_page:
-            self.stdout.write("Downloading {}".format(next_page))
-            req = requests.get(next_page)
-            req.raise_for_status()
-            page = req.text
-            results = req.json()
-            self.save_page(next_page, page)
-            next_page = results.get("next")
+    def iter_people(self):
+        return StreamingJsonPaginator(page1=self.import_url, stdout=self.stdout)
 
     @time_function_length
     @transaction.atomic
-    def add_people(self, results):
-        self.stdout.write(f"Found {results['count']} people to import")
-        for person in results["results"]:
+    def add_people(self, people):
+        person_objs = Person.objects.bulk_upsert_from_ynr(people)
+        # people without any candidacies in YNR shouldn't have any here
+        OrphanCandidate.objects.record(
+            OrphanCandidate.PERSON,
+            [
+                person_obj.pk
+                for person, person_obj in zip(people, person_objs)
+                if not person["candidacies"]
+            ],
+        )
+        changed_ballot_ids = set()
+        for person, person_obj in zip(people, person_objs):
             with show_data_on_error("Person {}".format(person["id"]), person):
-                person_obj = Person.objects.update_or_create_from_ynr(person)
                 self.stdout.write(
                     f"Updated {person_obj.name} ({person_obj.pk})"
                 )
 
                 if self.options["recently_updated"]:
-                    self.delete_old_candidacies(
-                        person_data=person,
-                        person_obj=person_obj,
+                    changed_ballot_ids.update(
+                        self.delete_old_candidacies(
+                            person_data=person,
+                            person_obj=person_obj,
+                        )
                     )
                     if not self.options["exclude_candidacies"]:
-                        self.update_candidacies(
-                            person_data=person, person_obj=person_obj
+                        changed_ballot_ids.update(
+                            self.update_candidacies(
+                                person_data=person, person_obj=person_obj
+                            )
                         )
-                    # dont keep track of seen people in a recent update
-                    continue
 
-                if person["candidacies"]:
-                    self.seen_people.add(person_obj.pk)
+        if changed_ballot_ids:
+            # bulk_upsert_from_ynr built the cards for these ballots before
+            # their candidacies changed
+            self.update_changed_ballots(changed_ballot_ids)
+
+    def update_changed_ballots(self, ballot_ids):
+        """
+        Re-ranks the results and rebuilds the cards of ballots whose
+        candidacies have been added, changed or deleted
+        """
+        PersonPost.objects.filter(
+            post_election_id__in=ballot_ids
+        ).update_result_ranks()
+        ballots = PostElection.objects.filter(pk__in=ballot_ids)
+        ballots.update(modified=timezone.now())
+        ballots.build_cards()
 
     def delete_old_candidacies(self, person_data, person_obj):
         """
-        Delete any candidacies that have been deleted upstream in YNR
+        Delete any candidacies that have been deleted upstream in YNR.
+        Returns the IDs of the ballots they were on.
         """
         ballot_paper_ids = [
             c["ballot"]["ballot_paper_id"] for c in person_data["candidacies"]
         ]
 
-        count, _ = person_obj.personpost_set.exclude(
+        old_candidacies = person_obj.personpost_set.exclude(
             post_election__ballot_paper_id__in=ballot_paper_ids
-        ).delete()
+        )
+        ballots = dict(
+            old_candidacies.values_list(
+                "post_election_id", "post_election__ballot_paper_id"
+            )
+        )
+        BallotChange.objects.record(ballots.values())
+        count, _ = old_candidacies.delete()
+        if count:
+            OrphanCandidate.objects.record(
+                OrphanCandidate.PERSON, [person_obj.pk]
+            )
         self.stdout.write(f"Deleted {count} candidacies for {person_obj.name}")
+        return list(ballots)
 
     def update_candidacies(self, person_data, person_obj):
         """
         Loops through candidacy dictionaries in the person data and updates or
-        creates the candidacy object for the Person
+        creates the candidacy object for the Person. Returns the IDs of the
+        ballots they're on.
         """
+        ballot_ids = []
         for candidacy in person_data["candidacies"]:
             ballot_paper_id = candidacy["ballot"]["ballot_paper_id"]
             try:
@@ -239,31 +254,46 @@ class Command(BaseCommand):
 
             msg = f"{personpost} was {'created' if created else 'updated'}"
             self.stdout.write(msg=msg)
+            ballot_ids.append(ballot.pk)
+        return ballot_ids
 
     def import_ballots_for_date(self, date):
         self.ballot_importer.do_import(params={"election_date": date})
 
     @time_function_length
     def delete_merged_people(self):
-        url = f"{settings.YNR_BASE}/api/next/person_redirects/?page_size=200&updated_gte={self.past_time_str}"
+        """
+        Saves the person redirects made since the last import (or all of
+        them, with --all-redirects), so that the merged people can be
+        resolved locally, and deletes the merged people along with their
+        candidacies
+        """
+        url = f"{settings.YNR_BASE}/api/next/person_redirects/?page_size=200"
+        if not self.options["all_redirects"]:
+            url = f"{url}&updated_gte={self.past_time_str}"
         if settings.YNR_API_KEY:
             url = f"{url}&auth_token={settings.YNR_API_KEY}"
         merged_ids = []
         while url:
-            req = requests.get(url)
+            req = requests.get(url, timeout=YNR_REDIRECT_TIMEOUT)
             page = req.json()
-            for result in page["results"]:
-                merged_ids.append(result["old_person_id"])
+            redirects = PersonRedirect.objects.update_from_ynr(page["results"])
+            merged_ids.extend(redirect.old_person_id for redirect in redirects)
             url = page.get("next")
+        ballots = PostElection.objects.filter(
+            personpost__person_id__in=merged_ids
+        )
+        ballots.record_changes()
+        ballot_ids = set(ballots.values_list("pk", flat=True))
         Person.objects.filter(ynr_id__in=merged_ids).delete()
+        if ballot_ids:
+            self.update_changed_ballots(ballot_ids)
 
     @time_function_length
     def delete_orphaned_people(self):
         """
-        Delete all people without candidacies
+        Delete the people that this or earlier imports left without
+        candidacies
         """
-        _, deleted_dict = Person.objects.filter(
-            personpost__isnull=True
-        ).delete()
-        count = deleted_dict.get("people.Person", 0)
+        count = delete_orphans(OrphanCandidate.PERSON)
         self.stdout.write(f"Deleted {count} orphaned People objects")
@@ -1,7 +1,9 @@
-import requests
-from django.conf import settings
+from core.helpers import set_changed_fields
+from core.utils import LastWord
+from django.core.cache import caches
 from django.db import models
-from django.db.models import Count
+from django.db.models import Count, F, Window
+from django.db.models.functions import Coalesce, Rank
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
@@ -31,6 +33,25 @@ class PersonPostQuerySet(models.QuerySet):
     def by_party(self):
         return self.order_by("party__party_name", "list_position")
 
+    def in_ballot_order(self, uses_lists):
+        """
+        Orders candidacies as they're listed for a ballot: winners first,
+        then by votes, then by party and list position for elections that
+        use lists, or by surname for those that don't
+        """
+        if uses_lists:
+            order_by = ["party__party_name", "list_position"]
+        else:
+            order_by = ["name_for_ordering", "person__name"]
+        return self.annotate(
+            last_name=LastWord("person__name"),
+            name_for_ordering=Coalesce("person__sort_name", "last_name"),
+        ).order_by(
+            F("elected").desc(nulls_last=True),
+            F("votes_cast").desc(nulls_last=True),
+            *order_by,
+        )
+
     def elected(self):
         return self.filter(elected=True)
 
@@ -79,8 +100,66 @@ class PersonPostQuerySet(models.QuerySet):
         return self.filter(election__current=True)
 
     def contains_delisted_person(self):
+        if self._result_cache is not None:
+            # already evaluated, e.g. when cached by people_for_ballot
+            return any(person_post.person.delisted for person_post in self)
         return self.filter(person__delisted=True).exists()
 
+    def with_result_ranks(self):
+        """
+        Annotates each candidacy with its position by votes on its ballot
+        (`result_rank`), how many candidates it shares that position with
+        (`result_ties`) and how many candidates are on the ballot
+        (`result_candidates`). Candidates with the same number of votes get
+        the same rank, and the next rank is skipped.
+        """
+        return self.annotate(
+            result_rank=Window(
+                Rank(),
+                partition_by=F("post_election_id"),
+                order_by=F("votes_cast").desc(nulls_last=True),
+            ),
+            result_ties=Window(
+                Count("pk"),
+                partition_by=[F("post_election_id"), F("votes_cast")],
+            ),
+            result_candidates=Window(
+                Count("pk"), partition_by=F("post_election_id")
+            ),
+        )
+
+    def update_result_ranks(self):
+        """
+        Stores the rank by votes of every candidacy on the ballots of those
+        in this queryset, so that results pages don't have to work it out.
+        Only the candidacies whose rank has changed are written.
+        """
+        candidacies = (
+            self.model.objects.filter(
+                post_election_id__in=self.values("post_election_id")
+            )
+            .with_result_ranks()
+            .only(
+                "pk", "votes_cast", "rank", "joint_rank", "candidates_on_ballot"
+            )
+        )
+        to_update = []
+        for candidacy in candidacies:
+            has_votes = candidacy.votes_cast is not None
+            values = {
+                "rank": candidacy.result_rank if has_votes else None,
+                "joint_rank": has_votes and candidacy.result_ties > 1,
+                "candidates_on_ballot": candidacy.result_candidates,
+            }
+            if set_changed_fields(candidacy, values):
+                to_update.append(candidacy)
+        self.model.objects.bulk_update(
+            to_update,
+            ["rank", "joint_rank", "candidates_on_ballot"],
+            batch_size=1000,
+        )
+        return len(to_update)
+
 
 class PersonPostManager(models.Manager):
     def get_queryset(self):
@@ -109,7 +188,10 @@ class PersonPostManager(models.Manager):
 
 
 class PersonManager(models.Manager):
-    def update_or_create_from_ynr(self, person):
+    def get_defaults_from_ynr(self, person):
+        """
+        Returns a dict of field values for a person dict from YNR
+        """
         last_updated = parse_datetime(person["last_updated"])
 
         sort_name = person.get("sort_name")
@@ -152,25 +234,184 @@ class PersonManager(models.Manager):
         if "thumbnail" in person:
             defaults["photo_url"] = person["thumbnail"]
 
-        person_id = person["id"]
-        person_obj, _ = self.update_or_create(
-            ynr_id=person_id, defaults=defaults
-        )
+        return defaults
+
+    def update_or_create_from_ynr(self, person):
+        return self.bulk_upsert_from_ynr([person])[0]
 
-        # Update any related ballots modified field
-        # to indicate that the ballot has changes
-        for candidacy in person_obj.personpost_set.all():
-            candidacy.post_election.modified = last_updated
+    def bulk_upsert_from_ynr(self, people):
+        """
+        Creates or updates a Person for each person dict from YNR, writing
+        all the people that are new or have changed in a single query.
 
-        return person_obj
+        Ballots that the changed people are candidates on have their
+        modified timestamp updated, to indicate that the ballot has
+        changes, and their cards rebuilt. Returns the Person objects in the
+        same order as `people`.
+        """
+        from elections.models import PostElection
+
+        defaults_by_id = {
+            int(person["id"]): self.get_defaults_from_ynr(person)
+            for person in people
+        }
+        person_objs = self.in_bulk(list(defaults_by_id))
+
+        to_write = []
+        update_fields = set()
+        for person_id, defaults in defaults_by_id.items():
+            # fields not in the defaults for this person keep their current
+            # value, or the default for new people
+            update_fields.update(defaults)
+            person_obj = person_objs.get(person_id)
+            if not person_obj:
+                person_obj = person_objs[person_id] = self.model(
+                    ynr_id=person_id
+                )
+            changed = set_changed_fields(person_obj, defaults)
+            if changed or person_obj._state.adding:
+                to_write.append(person_obj)
+
+        if to_write:
+            self.bulk_create(
+                to_write,
+                update_conflicts=True,
+                unique_fields=["ynr_id"],
+                update_fields=sorted(update_fields),
+            )
+            ballots = PostElection.objects.filter(
+                personpost__person__in=to_write
+            ).distinct()
+            ballots.update(modified=timezone.now())
+            ballots.record_changes()
+            ballots.build_cards()
+
+        return [person_objs[int(person["id"])] for person in people]
+
+    def get_by_pk_or_redirect(self, pk):
+        """
+        Returns the person with the ID, or the person they were merged into
+        in YNR
+        """
+        from .models import PersonRedirect
 
-    def get_by_pk_or_redirect_from_ynr(self, pk):
         try:
             return self.get(pk=pk)
         except self.model.DoesNotExist:
-            req = requests.get(
-                "{}/api/next/person_redirects/{}/".format(settings.YNR_BASE, pk)
+            new_pk = PersonRedirect.objects.resolve(pk)
+            if new_pk == int(pk):
+                raise
+            return self.get(pk=new_pk)
+
+    def resolve_pks(self, pks):
+        """
+        Returns a dict of person IDs to the ID of the person to use for
+        each, which is the person they were merged into if they were,
+        leaving out IDs of people we don't have. Makes a few queries however
+        many IDs there are.
+        """
+        from .models import PersonRedirect
+
+        pks = {int(pk) for pk in pks}
+        existing = set(self.filter(pk__in=pks).values_list("pk", flat=True))
+        redirects = PersonRedirect.objects.resolve_many(pks - existing)
+        existing.update(
+            self.filter(pk__in=set(redirects.values())).values_list(
+                "pk", flat=True
+            )
+        )
+        resolved = {pk: redirects.get(pk, pk) for pk in pks}
+        return {
+            pk: new_pk for pk, new_pk in resolved.items() if new_pk in existing
+        }
+
+
+PERSON_REDIRECT_CACHE_KEY_FMT = "person_redirect_{}"
+PERSON_REDIRECT_CACHE_TTL = 60 * 10
+# People can be merged into people that are later merged themselves, but
+# never more than a few times
+MAX_PERSON_REDIRECTS = 10
+
+
+class PersonRedirectManager(models.Manager):
+    @property
+    def local_cache(self):
+        return caches["local"]
+
+    def update_from_ynr(self, redirects):
+        """
+        Saves a page of redirects from YNR's person_redirects API
+        """
+        objs = [
+            self.model(
+                old_person_id=int(redirect["old_person_id"]),
+                new_person_id=int(redirect["new_person_id"]),
+            )
+            for redirect in redirects
+        ]
+        self.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=["old_person_id"],
+            update_fields=["new_person_id"],
+        )
+        self.local_cache.delete_many(
+            [
+                PERSON_REDIRECT_CACHE_KEY_FMT.format(obj.old_person_id)
+                for obj in objs
+            ]
+        )
+        return objs
+
+    def resolve(self, person_id):
+        """
+        Returns the ID of the person that a person was merged into,
+        following any later merges, or the ID itself if they weren't merged
+        """
+        person_id = int(person_id)
+        key = PERSON_REDIRECT_CACHE_KEY_FMT.format(person_id)
+        resolved = self.local_cache.get(key)
+        if resolved is not None:
+            return resolved
+
+        resolved = person_id
+        seen = {person_id}
+        for _ in range(MAX_PERSON_REDIRECTS):
+            new_person_id = (
+                self.filter(old_person_id=resolved)
+                .values_list("new_person_id", flat=True)
+                .first()
+            )
+            if new_person_id is None or new_person_id in seen:
+                break
+            seen.add(new_person_id)
+            resolved = new_person_id
+
+        self.local_cache.set(key, resolved, PERSON_REDIRECT_CACHE_TTL)
+        return resolved
+
+    def resolve_many(self, person_ids):
+        """
+        Like resolve for many people at once, with a query for each level
+        of merges rather than for each person. Returns a dict of the IDs of
+        people that were merged to the IDs they resolve to.
+        """
+        resolved = {int(person_id): int(person_id) for person_id in person_ids}
+        pending = set(resolved)
+        for _ in range(MAX_PERSON_REDIRECTS):
+            if not pending:
+                break
+            redirects = dict(
+                self.filter(
+                    old_person_id__in={resolved[pk] for pk in pending}
+                ).values_list("old_person_id", "new_person_id")
             )
-            if req.status_code == 200:
-                return self.get(pk=req.json()["new_person_id"])
-            raise
+            merged = set()
+            for pk in pending:
+                new_person_id = redirects.get(resolved[pk])
+                # stop if the redirects go round in a circle
+                if new_person_id is not None and new_person_id != pk:
+                    resolved[pk] = new_person_id
+                    merged.add(pk)
+            pending = merged
+        return {pk: new_pk for pk, new_pk in resolved.items() if new_pk != pk}
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-17 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("people", "0048_person_blue_sky_url_person_other_url_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PersonRedirect",
+            fields=[
+                (
+                    "old_person_id",
+                    models.IntegerField(primary_key=True, serialize=False),
+                ),
+                ("new_person_id", models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
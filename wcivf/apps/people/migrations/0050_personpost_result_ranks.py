@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-17 13:10
+
+from django.db import migrations, models
+from django.db.models import Count, F, Window
+from django.db.models.functions import Rank
+
+
+def add_result_ranks(apps, schema_editor):
+    PersonPost = apps.get_model("people", "PersonPost")
+    candidacies = PersonPost.objects.annotate(
+        result_rank=Window(
+            Rank(),
+            partition_by=F("post_election_id"),
+            order_by=F("votes_cast").desc(nulls_last=True),
+        ),
+        result_ties=Window(
+            Count("pk"), partition_by=[F("post_election_id"), F("votes_cast")]
+        ),
+        result_candidates=Window(
+            Count("pk"), partition_by=F("post_election_id")
+        ),
+    ).only("pk", "votes_cast")
+    fields = ["rank", "joint_rank", "candidates_on_ballot"]
+    to_update = []
+    for candidacy in candidacies.iterator(chunk_size=2000):
+        has_votes = candidacy.votes_cast is not None
+        candidacy.rank = candidacy.result_rank if has_votes else None
+        candidacy.joint_rank = has_votes and candidacy.result_ties > 1
+        candidacy.candidates_on_ballot = candidacy.result_candidates
+        to_update.append(candidacy)
+        if len(to_update) == 1000:
+            PersonPost.objects.bulk_update(to_update, fields)
+            to_update = []
+    PersonPost.objects.bulk_update(to_update, fields)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("people", "0049_personredirect"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="personpost",
+            name="candidates_on_ballot",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="personpost",
+            name="joint_rank",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(add_result_ranks, migrations.RunPython.noop),
+    ]
@@ -13,7 +13,12 @@ from parties.models import Party
 
 from wcivf import settings
 
-from .managers import VALUE_TYPES_TO_IMPORT, PersonManager, PersonPostManager
+from .managers import (
+    VALUE_TYPES_TO_IMPORT,
+    PersonManager,
+    PersonPostManager,
+    PersonRedirectManager,
+)
 
 
 class PersonPost(models.Model):
@@ -39,7 +44,11 @@ class PersonPost(models.Model):
     previous_party_affiliations = models.ManyToManyField(
         Party, related_name="affiliated_memberships", blank=True
     )
+    # the position by votes on the ballot, set by update_result_ranks when
+    # results are imported
     rank = models.PositiveIntegerField(null=True)
+    joint_rank = models.BooleanField(default=False)
+    candidates_on_ballot = models.PositiveIntegerField(null=True)
     deselected = models.BooleanField(default=False)
     deselected_source = models.CharField(max_length=800, blank=True, null=True)
 
@@ -116,34 +125,14 @@ class PersonPost(models.Model):
     @property
     def get_results_rank(self):
         """Get the rank of the person in the election"""
-
-        candidate_count = len(self.post_election.personpost_set.all())
-        list_of_candidates_sorted_by_votes_cast = (
-            self.post_election.personpost_set.order_by("-votes_cast")
-        )
-        for index, candidate in enumerate(
-            list_of_candidates_sorted_by_votes_cast
-        ):
-            # If we find the candidate in the sorted list, assign their rank based on their index
-            # in the list. Otherwise, loop through the list until we find the candidate.
-            if self.person == candidate.person:
-                candidate.rank = index + 1
-                candidate.save()
-                # If the candidate has the same number of votes as the next candidate,
-                # there is a tie and assign a joint rank
-                if index != candidate_count - 1 and (
-                    candidate.votes_cast
-                    == list_of_candidates_sorted_by_votes_cast[
-                        index + 1
-                    ].votes_cast
-                ):
-                    return f"Joint {ordinal(candidate.rank)} / {candidate_count} candidates"
-                if candidate_count > 1:
-                    return f"{ordinal(candidate.rank)} / {candidate_count} candidates"
-                return (
-                    f"{ordinal(candidate.rank)} / {candidate_count} candidate"
-                )
-        return None
+        if not self.rank or not self.candidates_on_ballot:
+            return None
+        rank = ordinal(self.rank)
+        if self.joint_rank:
+            rank = f"Joint {rank}"
+        if self.candidates_on_ballot > 1:
+            return f"{rank} / {self.candidates_on_ballot} candidates"
+        return f"{rank} / {self.candidates_on_ballot} candidate"
 
     class Meta:
         ordering = ("-election__election_date",)
@@ -456,6 +445,21 @@ class Person(models.Model):
         return " ".join(intro.split())
 
 
+class PersonRedirect(models.Model):
+    """
+    A person that was merged into another in YNR, kept in sync by
+    import_people so that old IDs can be resolved without asking YNR
+    """
+
+    old_person_id = models.IntegerField(primary_key=True)
+    new_person_id = models.IntegerField(db_index=True)
+
+    objects = PersonRedirectManager()
+
+    def __str__(self):
+        return f"{self.old_person_id} -> {self.new_person_id}"
+
+
 class AssociatedCompany(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
     company_name = models.CharField(max_length=255)
@@ -7,6 +7,8 @@ class PersonSitemap(Sitemap):
     changefreq = "daily"
     priority = 0.9
     protocol = "https"
+    # changes whenever a URL would, see core.sitemaps
+    changed_field = "last_updated"
 
     def items(self):
         return Person.objects.all().order_by("pk")
@@ -1,8 +1,11 @@
 import pytest
-from elections.models import PostElection
+from elections.models import BallotChange, PostElection
+from elections.tests.factories import PostElectionFactory
 from parties.models import Party
+from parties.tests.factories import PartyFactory
 from people.management.commands.import_people import Command
-from people.models import Person, PersonPost
+from people.models import Person, PersonPost, PersonRedirect
+from people.tests.factories import PersonFactory, PersonPostFactory
 
 
 class TestUpdateCandidacies:
@@ -150,3 +153,187 @@ class TestUpdateCandidacies:
             ]
         )
         delete.assert_called_once()
+
+
+class TestAddPeople:
+    @pytest.mark.django_db
+    def test_cards_rebuilt_for_changed_candidacies(self, mocker):
+        ballot = PostElectionFactory(ballot_paper_id="local.foo.2024-05-02")
+        PartyFactory(party_id="party:53")
+        person = PersonFactory()
+        PostElection.objects.all().build_cards()
+        ballot.refresh_from_db()
+        built_from = ballot.modified
+        assert ballot.current_card["party_ballot_count"] is None
+        mocker.patch.object(
+            Person.objects, "bulk_upsert_from_ynr", return_value=[person]
+        )
+        command = Command()
+        command.options = {
+            "recently_updated": True,
+            "exclude_candidacies": False,
+        }
+
+        command.add_people(
+            people=[
+                {
+                    "id": person.pk,
+                    "candidacies": [
+                        {
+                            "elected": False,
+                            "party_list_position": None,
+                            "deselected": False,
+                            "deselected_source": None,
+                            "party": {"legacy_slug": "party:53"},
+                            "party_name": "Labour Party",
+                            "party_description_text": "Labour Party",
+                            "ballot": {
+                                "ballot_paper_id": ballot.ballot_paper_id
+                            },
+                            "previous_party_affiliations": [],
+                        }
+                    ],
+                }
+            ]
+        )
+
+        ballot = PostElection.objects.select_related("post", "election").get(
+            pk=ballot.pk
+        )
+        assert ballot.modified > built_from
+        assert ballot.current_card["party_ballot_count"] == "one candidate"
+
+    @pytest.mark.django_db
+    def test_results_reranked_for_deleted_candidacies(self, mocker):
+        ballot = PostElectionFactory(ballot_paper_id="local.foo.2024-05-02")
+        people = []
+        for votes_cast in [100, 50]:
+            candidacy = PersonPostFactory(
+                post_election=ballot,
+                post=ballot.post,
+                election=ballot.election,
+                votes_cast=votes_cast,
+            )
+            people.append(candidacy.person)
+        PersonPost.objects.all().update_result_ranks()
+        mocker.patch.object(
+            Person.objects, "bulk_upsert_from_ynr", return_value=people[:1]
+        )
+        command = Command()
+        command.options = {
+            "recently_updated": True,
+            "exclude_candidacies": False,
+        }
+
+        # the winner's candidacy was deleted in YNR
+        command.add_people(people=[{"id": people[0].pk, "candidacies": []}])
+
+        candidacy = PersonPost.objects.get()
+        assert candidacy.person == people[1]
+        assert candidacy.rank == 1
+        assert candidacy.candidates_on_ballot == 1
+
+
+class TestAddToDb:
+    @pytest.mark.django_db
+    def test_people_added_in_batches(self, mocker):
+        command = Command()
+        command.batch_size = 2
+        command.options = {"recently_updated": False, "since": None}
+        people = [{"id": 1}, {"id": 2}, {"id": 3}]
+        mocker.patch.object(command, "iter_people", return_value=iter(people))
+        add_people = mocker.patch.object(command, "add_people")
+
+        command.add_to_db()
+
+        assert add_people.call_args_list == [
+            mocker.call(people=[{"id": 1}, {"id": 2}]),
+            mocker.call(people=[{"id": 3}]),
+        ]
+
+
+class TestDeleteMergedPeople:
+    @pytest.mark.django_db
+    def test_redirects_saved_and_merged_people_deleted(self, mocker):
+        PersonFactory(ynr_id=1)
+        PersonFactory(ynr_id=2)
+        PersonFactory(ynr_id=3)
+        pages = [
+            {
+                "results": [{"old_person_id": 1, "new_person_id": 2}],
+                "next": "http://example.com/page-2",
+            },
+            {
+                "results": [{"old_person_id": 2, "new_person_id": 3}],
+                "next": None,
+            },
+        ]
+        mock_get = mocker.patch(
+            "people.management.commands.import_people.requests.get"
+        )
+        mock_get.return_value.json.side_effect = pages
+        command = Command()
+        command.past_time_str = "2024-01-01"
+        command.options = {"all_redirects": False}
+
+        command.delete_merged_people()
+
+        assert list(Person.objects.values_list("pk", flat=True)) == [3]
+        assert PersonRedirect.objects.resolve(1) == 3
+        assert Person.objects.get_by_pk_or_redirect(1).pk == 3
+        assert "updated_gte=2024-01-01" in mock_get.call_args_list[0].args[0]
+
+    @pytest.mark.django_db
+    def test_ballots_of_merged_people_updated(self, mocker):
+        ballot = PostElectionFactory(ballot_paper_id="local.foo.2024-05-02")
+        for ynr_id, votes_cast in [(1, 100), (2, 50)]:
+            PersonPostFactory(
+                person=PersonFactory(ynr_id=ynr_id),
+                post_election=ballot,
+                post=ballot.post,
+                election=ballot.election,
+                votes_cast=votes_cast,
+            )
+        PersonPost.objects.all().update_result_ranks()
+        PostElection.objects.all().build_cards()
+        BallotChange.objects.all().delete()
+        mock_get = mocker.patch(
+            "people.management.commands.import_people.requests.get"
+        )
+        mock_get.return_value.json.return_value = {
+            "results": [{"old_person_id": 1, "new_person_id": 3}],
+            "next": None,
+        }
+        command = Command()
+        command.past_time_str = "2024-01-01"
+        command.options = {"all_redirects": False}
+
+        command.delete_merged_people()
+
+        # the merged person's candidacy went with them
+        candidacy = PersonPost.objects.get()
+        assert candidacy.rank == 1
+        assert candidacy.candidates_on_ballot == 1
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == [ballot.ballot_paper_id]
+        ballot = PostElection.objects.select_related("post", "election").get()
+        assert ballot.current_card["party_ballot_count"] == "one candidate"
+
+    @pytest.mark.django_db
+    def test_all_redirects(self, mocker):
+        mock_get = mocker.patch(
+            "people.management.commands.import_people.requests.get"
+        )
+        mock_get.return_value.json.return_value = {
+            "results": [{"old_person_id": 1, "new_person_id": 2}],
+            "next": None,
+        }
+        command = Command()
+        command.past_time_str = "2024-01-01"
+        command.options = {"all_redirects": True}
+
+        command.delete_merged_people()
+
+        assert "updated_gte" not in mock_get.call_args.args[0]
+        assert PersonRedirect.objects.resolve(1) == 2
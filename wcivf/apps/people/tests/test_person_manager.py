@@ -1,13 +1,15 @@
 import pytest
+from django.core.cache import caches
 from django.test import TestCase
 from django.utils import timezone
+from elections.models import BallotChange
 from elections.tests.factories import (
     ElectionFactory,
     ElectionFactoryLazySlug,
     PostElectionFactory,
     PostFactory,
 )
-from people.models import Person, PersonPost
+from people.models import Person, PersonPost, PersonRedirect
 from people.tests.factories import PersonFactory, PersonPostFactory
 
 
@@ -89,3 +91,173 @@ class PersonPostManagerTests(TestCase):
         self.assertIn(self.in_past_current, qs)
         self.assertNotIn(self.in_past_not_current, qs)
         self.assertNotIn(self.in_future_not_current, qs)
+
+
+class TestBulkUpsertFromYNR:
+    def ynr_person(self, person_id, name="Joe Bloggs", **kwargs):
+        return {
+            "id": person_id,
+            "name": name,
+            "sort_name": None,
+            "email": "",
+            "gender": "",
+            "birth_date": None,
+            "death_date": None,
+            "last_updated": "2021-01-13T12:00:00Z",
+            "statement_to_voters": "",
+            "statement_to_voters_last_updated": None,
+            "favourite_biscuit": None,
+            "identifiers": [
+                {
+                    "value_type": "theyworkforyou",
+                    "internal_identifier": "uk.org.publicwhip/person/1234",
+                    "value": "",
+                },
+                {
+                    "value_type": "homepage_url",
+                    "value": "https://example.com",
+                },
+            ],
+            **kwargs,
+        }
+
+    @pytest.mark.django_db
+    def test_creates_people(self):
+        people = Person.objects.bulk_upsert_from_ynr(
+            [self.ynr_person(1), self.ynr_person(2, name="Jane Smith")]
+        )
+
+        assert [person.pk for person in people] == [1, 2]
+        person = Person.objects.get(pk=1)
+        assert person.name == "Joe Bloggs"
+        assert person.sort_name == "Bloggs"
+        assert person.twfy_id == 1234
+        assert person.homepage_url == "https://example.com"
+        assert Person.objects.get(pk=2).name == "Jane Smith"
+
+    @pytest.mark.django_db
+    def test_unchanged_people_not_written(self, django_assert_num_queries):
+        Person.objects.bulk_upsert_from_ynr([self.ynr_person(1)])
+
+        with django_assert_num_queries(1):
+            people = Person.objects.bulk_upsert_from_ynr([self.ynr_person(1)])
+        assert people[0].name == "Joe Bloggs"
+
+    @pytest.mark.django_db
+    def test_changed_people_updated_and_ballots_touched(self):
+        joe, jane = Person.objects.bulk_upsert_from_ynr(
+            [self.ynr_person(1), self.ynr_person(2, name="Jane Smith")]
+        )
+        joes_ballot = PostElectionFactory(ballot_paper_id="local.a.2021-05-06")
+        janes_ballot = PostElectionFactory(
+            ballot_paper_id="local.b.2021-05-06",
+            election=ElectionFactoryLazySlug(),
+        )
+        PersonPostFactory(
+            person=joe,
+            post_election=joes_ballot,
+            post=joes_ballot.post,
+            election=joes_ballot.election,
+        )
+        PersonPostFactory(
+            person=jane,
+            post_election=janes_ballot,
+            post=janes_ballot.post,
+            election=janes_ballot.election,
+        )
+
+        BallotChange.objects.all().delete()
+        Person.objects.bulk_upsert_from_ynr(
+            [
+                self.ynr_person(1, name="Joseph Bloggs"),
+                self.ynr_person(2, name="Jane Smith"),
+            ]
+        )
+
+        assert Person.objects.get(pk=1).name == "Joseph Bloggs"
+        joes_ballot_modified = joes_ballot.modified
+        janes_ballot_modified = janes_ballot.modified
+        joes_ballot.refresh_from_db()
+        janes_ballot.refresh_from_db()
+        assert joes_ballot.modified > joes_ballot_modified
+        assert janes_ballot.modified == janes_ballot_modified
+        assert list(
+            BallotChange.objects.values_list("ballot_paper_id", flat=True)
+        ) == ["local.a.2021-05-06"]
+
+
+class TestPersonRedirects:
+    @pytest.fixture(autouse=True)
+    def local_cache(self, settings):
+        settings.CACHES = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+            },
+            "local": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "test-local",
+            },
+        }
+        caches["local"].clear()
+
+    @pytest.mark.django_db
+    def test_resolve(self, django_assert_num_queries):
+        PersonRedirect.objects.update_from_ynr(
+            [
+                {"old_person_id": 1, "new_person_id": 2},
+                {"old_person_id": 2, "new_person_id": 3},
+                {"old_person_id": 4, "new_person_id": 5},
+                {"old_person_id": 5, "new_person_id": 4},
+            ]
+        )
+        assert PersonRedirect.objects.resolve("1") == 3
+        assert PersonRedirect.objects.resolve(3) == 3
+        assert PersonRedirect.objects.resolve(4) == 5
+        with django_assert_num_queries(0):
+            assert PersonRedirect.objects.resolve(1) == 3
+            assert PersonRedirect.objects.resolve(3) == 3
+
+    @pytest.mark.django_db
+    def test_update_from_ynr_invalidates_cache(self):
+        assert PersonRedirect.objects.resolve(1) == 1
+        PersonRedirect.objects.update_from_ynr(
+            [{"old_person_id": "1", "new_person_id": "2"}]
+        )
+        assert PersonRedirect.objects.resolve(1) == 2
+        PersonRedirect.objects.update_from_ynr(
+            [{"old_person_id": "1", "new_person_id": "3"}]
+        )
+        assert PersonRedirect.objects.resolve(1) == 3
+        assert PersonRedirect.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_get_by_pk_or_redirect(self):
+        person = PersonFactory(ynr_id=2)
+        PersonRedirect.objects.update_from_ynr(
+            [{"old_person_id": 1, "new_person_id": 2}]
+        )
+        assert Person.objects.get_by_pk_or_redirect(2) == person
+        assert Person.objects.get_by_pk_or_redirect("1") == person
+        with pytest.raises(Person.DoesNotExist):
+            Person.objects.get_by_pk_or_redirect(3)
+
+    @pytest.mark.django_db
+    def test_resolve_pks(self, django_assert_num_queries):
+        PersonFactory(ynr_id=1)
+        PersonFactory(ynr_id=4)
+        PersonRedirect.objects.update_from_ynr(
+            [
+                {"old_person_id": 2, "new_person_id": 3},
+                {"old_person_id": 3, "new_person_id": 4},
+                {"old_person_id": 5, "new_person_id": 6},
+                {"old_person_id": 7, "new_person_id": 8},
+                {"old_person_id": 8, "new_person_id": 7},
+            ]
+        )
+        assert PersonRedirect.objects.resolve_many([2, 5, 7, 9]) == {
+            2: 4,
+            5: 6,
+            7: 8,
+        }
+        with django_assert_num_queries(5):
+            assert Person.objects.resolve_pks(["1", 2, 5, 9]) == {1: 1, 2: 4}
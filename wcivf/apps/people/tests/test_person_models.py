@@ -1,10 +1,9 @@
 from django.test import TestCase
-from people.tests.factories import PersonFactory
+from elections.tests.factories import PostElectionFactory
+from people.models import PersonPost
+from people.tests.factories import PersonFactory, PersonPostFactory
 from people.tests.helpers import create_person
 
-from wcivf.apps.elections.tests.factories import ElectionFactory
-from wcivf.apps.people.tests.factories import PersonPostFactory
-
 
 class TestPersonModel(TestCase):
     def setUp(self):
@@ -138,38 +137,62 @@ class TestPersonModel(TestCase):
             with self.subTest(msg=candidacy[1]):
                 self.assertEqual(person.intro_template, expected)
 
+    def create_candidacies(self, *votes):
+        ballot = PostElectionFactory()
+        candidacies = [
+            PersonPostFactory(
+                post_election=ballot,
+                post=ballot.post,
+                election=ballot.election,
+                votes_cast=votes_cast,
+            )
+            for votes_cast in votes
+        ]
+        PersonPost.objects.filter(pk=candidacies[0].pk).update_result_ranks()
+        for candidacy in candidacies:
+            candidacy.refresh_from_db()
+        return candidacies
+
     def test_get_results_rank(self):
         """Test that the get_results_rank method returns the correct rank
         given vote count is available."""
+        candidate1, candidate2, candidate3 = self.create_candidacies(
+            100, 200, 300
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(candidate3.get_results_rank, "1st / 3 candidates")
+            self.assertEqual(candidate1.get_results_rank, "3rd / 3 candidates")
 
-        election = ElectionFactory()
-        candidate1 = PersonPostFactory(election=election)
-        candidate2 = PersonPostFactory(election=election)
-        candidate3 = PersonPostFactory(election=election)
-        candidate1.votes_cast = 100
-        candidate2.votes_cast = 200
-        candidate3.votes_cast = 300
-        results_rank_str = candidate3.get_results_rank
-        candidate3.refresh_from_db()
-        self.assertTrue(results_rank_str, "1st / 3 candidates")
+    def test_get_results_rank_one_candidate(self):
+        (candidate,) = self.create_candidacies(100)
+        self.assertEqual(candidate.get_results_rank, "1st / 1 candidate")
+
+    def test_get_results_rank_without_votes(self):
+        candidate1, candidate2 = self.create_candidacies(100, None)
+        self.assertEqual(candidate1.get_results_rank, "1st / 2 candidates")
+        self.assertIsNone(candidate2.get_results_rank)
+        self.assertIsNone(PersonPostFactory.build().get_results_rank)
 
     def test_get_results_rank_tied_candidates(self):
         """Test that the get_results_rank method returns the correct rank
         given vote count is available and there is a tie for a non-elected
         candidate."""
+        candidates = self.create_candidacies(100, 200, 200, 300)
+        self.assertEqual(
+            [candidate.get_results_rank for candidate in candidates],
+            [
+                "4th / 4 candidates",
+                "Joint 2nd / 4 candidates",
+                "Joint 2nd / 4 candidates",
+                "1st / 4 candidates",
+            ],
+        )
 
-        election = ElectionFactory()
-        candidate1 = PersonPostFactory(election=election)
-        candidate2 = PersonPostFactory(election=election)
-        candidate3 = PersonPostFactory(election=election)
-        candidate4 = PersonPostFactory(election=election)
-        candidate1.votes_cast = 100
-        candidate2.votes_cast = 200
-        candidate3.votes_cast = 200
-        candidate4.votes_cast = 300
-        results_rank_str_2 = candidate2.get_results_rank
-        results_rank_str_3 = candidate3.get_results_rank
+    def test_update_result_ranks_only_writes_changes(self):
+        candidate1, candidate2 = self.create_candidacies(100, 200)
+        queryset = PersonPost.objects.filter(pk=candidate1.pk)
+        self.assertEqual(queryset.update_result_ranks(), 0)
+        PersonPost.objects.filter(pk=candidate1.pk).update(votes_cast=300)
+        self.assertEqual(queryset.update_result_ranks(), 2)
         candidate2.refresh_from_db()
-        candidate3.refresh_from_db()
-        self.assertTrue(results_rank_str_2, "Joint 2nd / 4 candidates")
-        self.assertTrue(results_rank_str_3, "Joint 2nd / 4 candidates")
+        self.assertEqual(candidate2.get_results_rank, "2nd / 2 candidates")
@@ -13,6 +13,7 @@ from elections.tests.factories import (
 )
 from freezegun import freeze_time
 from parties.tests.factories import LocalPartyFactory, PartyFactory
+from people.models import PersonPost, PersonRedirect
 from people.tests.factories import (
     PersonFactory,
     PersonPostFactory,
@@ -349,6 +350,8 @@ class PersonViewTests(TestCase):
             party=party,
             votes_cast=1000,
         )
+        # as the results importer does
+        PersonPost.objects.all().update_result_ranks()
         response = self.client.get(self.person_url, follow=True)
         self.assertTemplateUsed(
             "people/includes/_person_previous_elections_card.html"
@@ -744,6 +747,20 @@ class PersonViewTests(TestCase):
         req = self.client.get("/person/partywebsite.org/")
         self.assertEqual(req.status_code, 404)
 
+    def test_merged_person_redirects(self):
+        PersonRedirect.objects.update_from_ynr(
+            [{"old_person_id": 1, "new_person_id": self.person.pk}]
+        )
+        response = self.client.get("/person/1/old-name")
+        self.assertRedirects(
+            response,
+            f"/person/{self.person.pk}/",
+            status_code=301,
+            fetch_redirect_response=False,
+        )
+        response = self.client.get("/person/2/")
+        self.assertEqual(response.status_code, 404)
+
     def test_noindex_tag_added(self):
         noindex_string = """<meta name="robots" content="noindex">"""
         PersonPostWithPartyFactory(
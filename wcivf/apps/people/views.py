@@ -1,11 +1,11 @@
 from django.db.models import Count, Prefetch, Q
-from django.http import Http404
+from django.http import Http404, HttpResponsePermanentRedirect
 from django.urls import reverse
 from django.views.generic import DetailView, RedirectView
 from elections.dummy_models import DummyPostElection
 from parties.models import LocalParty, Manifesto
 
-from .models import Person, PersonPost
+from .models import Person, PersonPost, PersonRedirect
 
 
 class PersonMixin(object):
@@ -59,6 +59,22 @@ class PersonMixin(object):
 class PersonView(DetailView, PersonMixin):
     model = Person
 
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except Http404:
+            # People merged in YNR are deleted, so send anyone following an
+            # old link to the person they were merged into
+            pk = self.kwargs.get(self.pk_url_kwarg)
+            if pk is None:
+                raise
+            new_pk = PersonRedirect.objects.resolve(pk)
+            if new_pk == pk:
+                raise
+            return HttpResponsePermanentRedirect(
+                reverse("person_view", kwargs={"pk": new_pk})
+            )
+
     def get_template_names(self):
         """
         When we don't have a TheyWorkForYou ID or the person has no current
@@ -18,6 +18,7 @@ import csv
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.utils import timezone
 from elections.models import PostElection
 from people.models import Person
 from pledges.models import CandidatePledge
@@ -36,6 +37,10 @@ class Command(BaseCommand):
 
     @transaction.atomic
     def handle(self, **options):
+        # the people whose pledges are deleted or added
+        person_ids = set(
+            CandidatePledge.objects.values_list("person_id", flat=True)
+        )
         # Delete all data first, as rows in the source might have been deleted
         CandidatePledge.objects.all().delete()
         with open(options["filename"], "r") as fh:
@@ -45,6 +50,17 @@ class Command(BaseCommand):
                     self.add_pledge(row)
                 except Exception:
                     print(row)
+        person_ids.update(
+            CandidatePledge.objects.values_list("person_id", flat=True)
+        )
+
+        # so that the cached candidates on their ballots are fetched again
+        ballots = PostElection.objects.filter(
+            personpost__person_id__in=person_ids
+        ).distinct()
+        ballots.update(modified=timezone.now())
+        ballots.record_changes()
+        ballots.build_cards()
 
     def add_pledge(self, row):
         person = Person.objects.get(pk=row.pop(PERSON_ID_TEXT))
@@ -138,6 +138,7 @@ MEDIA_ROOT = root("media")
 MEDIA_URL = "/media/"
 
 WSGI_APPLICATION = "wcivf.wsgi.application"
+ASGI_APPLICATION = "wcivf.asgi.application"
 
 
 # Database
@@ -193,6 +194,11 @@ STATIC_URL = "/static/"
 
 STATICFILES_DIRS = (root("assets"),)
 STATIC_ROOT = root("static")
+# Where the build_sitemaps command writes the sitemap files
+SITEMAP_DIR = root("sitemaps")
+# Where the imports and export_current_ballots command write the snapshot of
+# the current ballots. No snapshot is written if this isn't set.
+BALLOT_EXPORT_DIR = root("exports")
 
 PIPELINE = get_pipeline_settings(
     extra_css=["scss/style.scss"],
@@ -209,7 +215,12 @@ CACHES = {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
-    }
+    },
+    # Small per-process cache used in front of redis for hot keys
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
 }
 SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
 SESSION_CACHE_ALIAS = "default"
@@ -217,11 +228,45 @@ SESSION_CACHE_ALIAS = "default"
 YNR_API_KEY = os.environ.get("YNR_API_KEY", None)
 YNR_BASE = "https://candidates.democracyclub.org.uk"
 YNR_UTM_QUERY_STRING = "utm_source=who&utm_campaign=ynr_cta"
+# How many pages ahead of the one being imported to download, when the page
+# URLs can be predicted (as with the files in YNR's cached API)
+IMPORT_PREFETCH_PAGES = 2
+# How many ballots' leaflets to download from Election Leaflets at once
+LEAFLETS_IMPORT_WORKERS = 8
 EE_BASE = "https://elections.democracyclub.org.uk"
+# EveryElection API responses are cached for EE_CACHE_TTL seconds, or
+# EE_CACHE_MISSING_TTL for elections EE doesn't know about, with at most
+# EE_CACHE_MAX_ENTRIES kept in memory. Unless EE_CACHE_DIR is None, a
+# snapshot of the cache is kept there, so that responses evicted from memory
+# (e.g. by prewarming every election) and later imports can reuse it.
+EE_CACHE_DIR = os.environ.get("EE_CACHE_DIR", root("cache"))
+EE_CACHE_MAX_ENTRIES = 5000
+EE_CACHE_TTL = 60 * 60 * 6
+EE_CACHE_MISSING_TTL = 60 * 10
 DEVS_DC_BASE = os.environ.get(
     "DEVS_DC_BASE", "https://developers.democracyclub.org.uk"
 )
 DEVS_DC_API_KEY = os.environ.get("DEVS_DC_API_KEY", None)
+DEVS_DC_POOL_SIZE = 10
+DEVS_DC_CONNECT_TIMEOUT = 3
+DEVS_DC_READ_TIMEOUT = 10
+DEVS_DC_MAX_RETRIES = 2
+# Stop calling the Devs DC API for DEVS_DC_CIRCUIT_BREAKER_RESET_TIMEOUT
+# seconds after this many consecutive failures
+DEVS_DC_CIRCUIT_BREAKER_THRESHOLD = 5
+DEVS_DC_CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+# How long (in seconds) postcode lookups against the Devs DC API are cached.
+# Entries are fresh for POSTCODE_LOOKUP_CACHE_TTL, then served stale for up
+# to POSTCODE_LOOKUP_CACHE_STALE_TTL while they are revalidated. The
+# in-process copy is kept for at most POSTCODE_LOOKUP_LOCAL_CACHE_TTL.
+POSTCODE_LOOKUP_CACHE_TTL = 60 * 10
+POSTCODE_LOOKUP_CACHE_STALE_TTL = 60 * 60
+POSTCODE_LOOKUP_LOCAL_CACHE_TTL = 60
+# How long (in seconds) each version of a postcode's iCal feed is cached
+ICAL_CACHE_TTL = 60 * 60
+# How many threads in each process fetch the candidates for the ballots on
+# a postcode page, each with its own database connection
+BALLOT_QUERY_THREADS = 4
 
 WDIV_BASE = "http://wheredoivote.co.uk"
 WDIV_API = "/api/beta"
@@ -282,6 +327,11 @@ if os.environ.get("DC_ENVIRONMENT"):
 LOGGER_ARN = os.environ.get("LOGGER_ARN", None)
 firehose_args = {"function_arn": LOGGER_ARN} if LOGGER_ARN else {"fake": True}
 POSTCODE_LOGGER = DCWidePostcodeLoggingClient(**firehose_args)
+# Lookups are queued and written to POSTCODE_LOGGER in the background, see
+# elections.postcode_logger
+POSTCODE_LOG_QUEUE_SIZE = 10000
+POSTCODE_LOG_BATCH_SIZE = 100
+POSTCODE_LOG_FLUSH_INTERVAL = 1
 
 
 with contextlib.suppress(ImportError):
@@ -3,7 +3,10 @@ STATICFILES_STORAGE = "pipeline.storage.PipelineStorage"
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.dummy.DummyCache",
-    }
+    },
+    "local": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    },
 }
 
 DATABASES = {
@@ -20,3 +23,7 @@ DATABASES = {
 SECRET_KEY = "just_for_ci"
 YNR_API_KEY = None
 EE_BASE = "https://elections.democracyclub.org.uk"
+# Tests that need a snapshot of the current ballots set their own directory
+BALLOT_EXPORT_DIR = None
+# Tests that need a snapshot of the EE cache set their own directory
+EE_CACHE_DIR = None
@@ -11,3 +11,9 @@ DATABASES["default"] = {  # noqa
     "PORT": os.environ.get("RDS_DB_PORT", "5432"),
 }
 EE_BASE = "https://elections.democracyclub.org.uk"
+# /tmp is kept between invocations of a warm Lambda
+EE_CACHE_DIR = os.environ.get("EE_CACHE_DIR", "/tmp/ee_cache")
+# The web servers don't share the Lambda's filesystem, so they write their
+# own snapshots of the current ballots from cron, rather than the imports
+# here writing one
+BALLOT_EXPORT_DIR = None
@@ -1,20 +1,9 @@
+from core.views import SitemapIndexView, SitemapSectionView
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.sitemaps.views import index, sitemap
 from django.urls import include, path, re_path
-from django.views.decorators.cache import cache_page
 from django.views.generic import RedirectView, TemplateView
-from elections.sitemaps import ElectionSitemap, PostElectionSitemap
-from parties.sitemaps import PartySitemap
-from people.sitemaps import PersonSitemap
-
-sitemaps = {
-    "elections": ElectionSitemap,
-    "postelections": PostElectionSitemap,
-    "people": PersonSitemap,
-    "parties": PartySitemap,
-}
 
 urlpatterns = (
     [
@@ -30,15 +19,10 @@ urlpatterns = (
             "ppcs/",
             include(("ppc_2024.urls", "ppc_2024"), namespace="ppc_2024"),
         ),
-        path(
-            "sitemap.xml",
-            cache_page(86400)(index),
-            {"sitemaps": sitemaps},
-        ),
+        path("sitemap.xml", SitemapIndexView.as_view()),
         path(
             "sitemap-<section>.xml",
-            cache_page(86400)(sitemap),
-            {"sitemaps": sitemaps},
+            SitemapSectionView.as_view(),
             name="django.contrib.sitemaps.views.sitemap",
         ),
         re_path(